@@ -0,0 +1,139 @@
+"""
+Admission control and load shedding per route class.
+
+Each request is classified (device ingest, device commands, long polls,
+dashboard reads) and admitted only if the worker has headroom for that
+class. Pressure is the larger of:
+
+  * concurrency: requests in flight in this worker / ADMISSION_CAPACITY
+    (default 32, the gthread thread count)
+  * latency: a class's recent mean latency / its latency_target, taken
+    over classes that completed requests in the last few seconds, so a slow
+    database shows up even before threads run out. It only counts once
+    concurrency is at least latency_gate: a class that is simply slow by
+    nature (large tenants, streamed bodies timed until they finish) must
+    not get itself shed on an idle worker
+
+A class is shed once pressure reaches its shed_at, so dashboard reads go
+first, then command polls, and ingestion only when the worker is actually
+full. Critical classes ignore the latency signal, and classes without a
+latency_target (long polls) do not feed it. max_share caps a class's own
+concurrency (long polls would otherwise hold every thread).
+
+Shed reads can be answered from StaleCache, the last good response for the
+same URL and user; everything else gets 503 with Retry-After.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+LATENCY_WINDOW_SECONDS = 5.0
+
+
+class RouteClass:
+    def __init__(self, name, shed_at=1.0, max_share=1.0, latency_target=0.5, critical=False):
+        self.name = name
+        self.shed_at = shed_at
+        self.max_share = max_share
+        self.latency_target = latency_target
+        self.critical = critical
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.latency_ewma = 0.0
+        self.last_completed = None
+
+
+class AdmissionController:
+    def __init__(self, classes, capacity=32, alpha=0.2, latency_gate=0.25):
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.capacity = capacity
+        self.alpha = alpha
+        self.latency_gate = latency_gate
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def _latency_pressure(self, now):
+        pressure = 0.0
+        for route_class in self.classes.values():
+            if route_class.latency_target is None or route_class.last_completed is None:
+                continue
+            if now - route_class.last_completed < LATENCY_WINDOW_SECONDS:
+                pressure = max(pressure, route_class.latency_ewma / route_class.latency_target)
+        return pressure
+
+    def _pressure(self, in_flight, now, critical=False):
+        concurrency = in_flight / self.capacity
+        if critical or concurrency < self.latency_gate:
+            return concurrency
+        return max(concurrency, self._latency_pressure(now))
+
+    def pressure(self, now=None):
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            return self._pressure(self.in_flight, now)
+
+    def try_admit(self, name, now=None):
+        """Reserve a slot for a request of class `name`; False means shed it."""
+        route_class = self.classes[name]
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            pressure = self._pressure(self.in_flight + 1, now, route_class.critical)
+            if (pressure > route_class.shed_at
+                    or route_class.in_flight + 1 > max(1, int(self.capacity * route_class.max_share))):
+                route_class.shed += 1
+                return False
+            self.in_flight += 1
+            route_class.in_flight += 1
+            route_class.admitted += 1
+            return True
+
+    def release(self, name, duration, now=None):
+        route_class = self.classes[name]
+        with self._lock:
+            self.in_flight -= 1
+            route_class.in_flight -= 1
+            route_class.latency_ewma += self.alpha * (duration - route_class.latency_ewma)
+            route_class.last_completed = now if now is not None else time.monotonic()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "in_flight": self.in_flight,
+                "pressure": round(self._pressure(self.in_flight, now), 3),
+                "classes": {
+                    name: {"in_flight": c.in_flight, "admitted": c.admitted, "shed": c.shed,
+                           "latency_ewma_ms": round(c.latency_ewma * 1000, 3), "shed_at": c.shed_at}
+                    for name, c in self.classes.items()
+                },
+            }
+
+
+class StaleCache:
+    """Last good response body per key, kept for up to max_age seconds (LRU bounded)."""
+
+    def __init__(self, max_age=60.0, maxsize=1000):
+        self.max_age = max_age
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.served = 0
+
+    def put(self, key, body, mimetype, now=None):
+        with self._lock:
+            self._entries[key] = (now if now is not None else time.monotonic(), body, mimetype)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key, now=None):
+        """Return (age seconds, body, mimetype) or None if missing or too old."""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > self.max_age:
+                return None
+            self.served += 1
+            return now - entry[0], entry[1], entry[2]
@@ -0,0 +1,229 @@
+"""
+Vectorized trip analytics over DeviceLocationHistory.
+
+History for many devices is loaded in one query into flat NumPy arrays
+(sorted by serial, then time) and summarised per device per UTC day without
+any Python-level loop over points:
+
+    distance_m, moving_seconds, max_speed_mps, avg_speed_mps, stop_count
+
+Segments are the gaps between consecutive points of the same device on the
+same day; a segment counts as moving when its speed exceeds MOVING_SPEED_MPS.
+A stop is a run of stationary segments lasting at least STOP_MIN_SECONDS.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+EARTH_RADIUS_M = 6371008.8
+MOVING_SPEED_MPS = 0.5
+STOP_MIN_SECONDS = 120
+SUMMARY_FIELDS = ("point_count", "distance_m", "moving_seconds", "max_speed_mps", "avg_speed_mps", "stop_count")
+# Dialects whose INSERT can skip rows another request has just cached
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres; accepts scalars or NumPy arrays (degrees)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def to_epoch_seconds(timestamps):
+    """Convert a sequence of datetimes (naive = UTC) to a float64 array of epoch seconds."""
+    if len(timestamps) and timestamps[0] is not None and timestamps[0].tzinfo is not None:
+        timestamps = [t.astimezone(timezone.utc).replace(tzinfo=None) for t in timestamps]
+    return np.array(timestamps, dtype="datetime64[us]").astype(np.int64) / 1e6
+
+
+def load_history_arrays(session, history_model, serials, start, end):
+    """
+    Load history for `serials` with start <= timestamp < end as arrays.
+
+    Returns (serial_names, codes, lat, lon, t) where codes index into
+    serial_names and rows are sorted by serial then time.
+    """
+    H = history_model
+    # Prefer Kalman-smoothed coordinates where they were stored; jitter inflates distance
+    stmt = (select(H.serial_number,
+                   func.coalesce(H.smoothed_latitude, H.latitude),
+                   func.coalesce(H.smoothed_longitude, H.longitude),
+                   H.timestamp)
+            .where(H.serial_number.in_(list(serials)), H.timestamp >= start, H.timestamp < end,
+                   H.is_outlier.is_(False))
+            .order_by(H.serial_number, H.timestamp))
+    rows = session.execute(stmt).all()
+    if not rows:
+        empty = np.empty(0)
+        return [], np.empty(0, dtype=np.int64), empty, empty, empty
+    serial_col, lat, lon, ts = zip(*rows)
+    serial_arr = np.array(serial_col, dtype=object)
+    changed = np.empty(len(serial_arr), dtype=bool)
+    changed[0] = True
+    changed[1:] = serial_arr[1:] != serial_arr[:-1]
+    codes = np.cumsum(changed) - 1
+    names = list(serial_arr[changed])
+    return (names, codes,
+            np.array(lat, dtype=np.float64), np.array(lon, dtype=np.float64), to_epoch_seconds(ts))
+
+
+def summarize(codes, lat, lon, t, moving_speed=MOVING_SPEED_MPS, stop_min_seconds=STOP_MIN_SECONDS):
+    """
+    Per (device code, UTC day) summaries for sorted point arrays.
+
+    Returns (group_codes, group_days, stats) where group_days are days since
+    the epoch and stats maps each name in SUMMARY_FIELDS to an array.
+    """
+    n = len(codes)
+    if n == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), {f: empty for f in SUMMARY_FIELDS}
+
+    days = np.floor_divide(t, 86400).astype(np.int64)
+    new_group = np.empty(n, dtype=bool)
+    new_group[0] = True
+    new_group[1:] = (codes[1:] != codes[:-1]) | (days[1:] != days[:-1])
+    group = np.cumsum(new_group) - 1
+    n_groups = group[-1] + 1
+    starts = np.flatnonzero(new_group)
+
+    # Segment i joins point i and i + 1; only keep segments inside a group
+    same = ~new_group[1:]
+    seg_group = group[1:][same]
+    dist = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])[same]
+    dt = np.diff(t)[same]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(dt > 0, dist / dt, 0.0)
+    moving = speed > moving_speed
+
+    point_count = np.bincount(group, minlength=n_groups)
+    distance = np.bincount(seg_group, weights=dist, minlength=n_groups)
+    moving_seconds = np.bincount(seg_group, weights=np.where(moving, dt, 0.0), minlength=n_groups)
+    max_speed = np.zeros(n_groups)
+    np.maximum.at(max_speed, seg_group, speed)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_speed = np.where(moving_seconds > 0, distance / moving_seconds, 0.0)
+
+    # Stops: runs of consecutive stationary segments in a group, long enough
+    stationary = ~moving
+    run_start = stationary.copy()
+    if len(run_start) > 1:
+        run_start[1:] &= ~(stationary[:-1] & (seg_group[1:] == seg_group[:-1]))
+    run_id = np.cumsum(run_start) - 1
+    stop_count = np.zeros(n_groups, dtype=np.int64)
+    if stationary.any():
+        run_duration = np.bincount(run_id[stationary], weights=dt[stationary])
+        run_group = seg_group[run_start]
+        long_runs = run_duration[: len(run_group)] >= stop_min_seconds
+        stop_count = np.bincount(run_group[long_runs], minlength=n_groups)
+
+    stats = {
+        "point_count": point_count,
+        "distance_m": distance,
+        "moving_seconds": moving_seconds,
+        "max_speed_mps": max_speed,
+        "avg_speed_mps": avg_speed,
+        "stop_count": stop_count,
+    }
+    return codes[starts], days[starts], stats
+
+
+def epoch_day(day):
+    return (day - date(1970, 1, 1)).days
+
+
+def day_from_epoch(value):
+    return date(1970, 1, 1) + timedelta(days=int(value))
+
+
+class TripAnalytics:
+    """Computes daily summaries and caches completed days in DeviceDailySummary."""
+
+    def __init__(self, db, history_model, summary_model):
+        self.db = db
+        self.History = history_model
+        self.Summary = summary_model
+
+    def compute(self, serials, first_day, last_day):
+        """Fresh summaries for serials over [first_day, last_day] as {(serial, day): dict}."""
+        start = datetime.combine(first_day, datetime.min.time())
+        end = datetime.combine(last_day + timedelta(days=1), datetime.min.time())
+        names, codes, lat, lon, t = load_history_arrays(self.db.session, self.History, serials, start, end)
+        group_codes, group_days, stats = summarize(codes, lat, lon, t)
+        columns = {f: stats[f].tolist() for f in SUMMARY_FIELDS}
+        result = {}
+        for i, (code, day) in enumerate(zip(group_codes.tolist(), group_days.tolist())):
+            result[(names[code], day_from_epoch(day))] = {f: columns[f][i] for f in SUMMARY_FIELDS}
+        return result
+
+    def daily(self, serials, first_day, last_day, today=None):
+        """
+        Summaries for every (serial, day) in range, served from the cache where
+        possible. Completed days are computed once and stored; today is always
+        computed fresh.
+        """
+        today = today or datetime.now(timezone.utc).date()
+        S = self.Summary
+        serials = list(serials)
+        if not serials:
+            return {}
+        cached = {}
+        stmt = select(S.serial_number, S.day, *[getattr(S, f) for f in SUMMARY_FIELDS]).where(
+            S.serial_number.in_(serials), S.day >= first_day, S.day <= last_day)
+        for row in self.db.session.execute(stmt):
+            cached[(row[0], row[1])] = dict(zip(SUMMARY_FIELDS, row[2:]))
+
+        days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+        missing = [(s, d) for d in days for s in serials if (s, d) not in cached]
+        if not missing:
+            return cached
+
+        missing_serials = sorted({s for s, _ in missing})
+        missing_days = [d for _, d in missing]
+        fresh = self.compute(missing_serials, min(missing_days), max(missing_days))
+        zero = {f: 0 for f in SUMMARY_FIELDS}
+        to_store = []
+        for key in missing:
+            summary = fresh.get(key, zero)
+            cached[key] = summary
+            if key[1] < today:
+                to_store.append({"serial_number": key[0], "day": key[1], **summary})
+        if to_store:
+            self._store(to_store)
+        return cached
+
+    def _store(self, rows):
+        # Concurrent loads of the same days compute identical rows; the first one stored wins
+        S = self.Summary
+        make_insert = UPSERT_INSERTS.get(self.db.session.get_bind(mapper=S).dialect.name)
+        if make_insert is not None:
+            stmt = make_insert(S.__table__).on_conflict_do_nothing(index_elements=["serial_number", "day"])
+        else:
+            stmt = insert(S.__table__)
+        try:
+            self.db.session.execute(stmt, rows)
+            self.db.session.commit()
+        except IntegrityError:
+            self.db.session.rollback()
+
+    def invalidate(self, keys, session=None):
+        """
+        Drop cached (serial_number, day) summaries, e.g. after late-arriving
+        points or retention deletes for past days. With `session` the delete
+        joins the caller's transaction; otherwise it is committed here.
+        """
+        days_by_serial = {}
+        for serial_number, day in keys:
+            days_by_serial.setdefault(serial_number, set()).add(day)
+        if not days_by_serial:
+            return
+        S = self.Summary
+        stmt = delete(S).where(or_(*(and_(S.serial_number == serial_number, S.day.in_(sorted(days)))
+                                     for serial_number, days in days_by_serial.items())))
+        (session or self.db.session).execute(stmt)
+        if session is None:
+            self.db.session.commit()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the hot endpoints against a synthetic fleet.
+
+Build a dataset once (SQLite file by default, or any DATABASE_URL such as a
+local Postgres), then time the key request paths in-process through the
+Flask test client, so the numbers cover routing, SQL and serialization but
+not the network:
+
+    python benchmark.py generate --database bench.db --preset large
+    python benchmark.py run --database bench.db --json results/$(git rev-parse --short HEAD).json
+    python benchmark.py compare results/old.json results/new.json
+
+Presets: small (1k devices, 100k history rows), medium (10k, 5M) and
+large (100k, 50M); --devices/--history-rows override them. Generation is
+seeded, so the same arguments give the same dataset.
+
+Every case is warmed up and then sampled --repeat times; the result file
+records min/median/mean/stdev/p95/IQR per case plus the commit, dataset
+size and platform, so runs can be compared across commits. Rate limiting,
+admission control and the presence sweeper are switched off for the run:
+they would throttle or shed the benchmark's own traffic, or add background
+noise to the measurements.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from load_generator import percentile
+
+PRESETS = {
+    "small": {"devices": 1000, "history_rows": 100_000},
+    "medium": {"devices": 10_000, "history_rows": 5_000_000},
+    "large": {"devices": 100_000, "history_rows": 50_000_000},
+}
+SERIAL_PREFIX = "BENCH-"
+PASSWORD = "bench-password"
+CHUNK_ROWS = 20_000
+
+
+def database_url(value):
+    if "://" in value:
+        return value.replace("postgres://", "postgresql://", 1)
+    return "sqlite:///" + os.path.abspath(value)
+
+
+def load_app(url):
+    """Import the application bound to `url`, with throttling and background sweeps off."""
+    os.environ["DATABASE_URL"] = url
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    os.environ.setdefault("ADMISSION_CONTROL", "0")
+    os.environ.setdefault("PRESENCE_SWEEPER", "0")
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import tracking_software
+    return tracking_software
+
+
+def serial(index):
+    return f"{SERIAL_PREFIX}{index:07d}"
+
+
+# ===================== DATASET =====================
+def generate(args):
+    from werkzeug.security import generate_password_hash
+    from sqlalchemy import insert, text
+
+    ts = load_app(database_url(args.database))
+    rng = random.Random(args.seed)
+    users = args.users or max(1, args.devices // args.devices_per_user)
+    per_device = max(1, args.history_rows // args.devices)
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    step = timedelta(days=args.days) / per_device
+    started = time.monotonic()
+
+    with ts.app.app_context():
+        ts.db.drop_all()
+        ts.db.create_all()
+        engine = ts.db.engine
+        with engine.begin() as conn:
+            if conn.dialect.name == "sqlite":
+                # Per-connection, and only this bulk load uses it
+                conn.execute(text("PRAGMA synchronous=OFF"))
+            password = generate_password_hash(PASSWORD)
+            conn.execute(insert(ts.User), [
+                {"username": f"bench-user-{i}", "email": f"bench{i}@example.com",
+                 "password": password, "plan": "pro"} for i in range(users)])
+
+            history, devices, written, chunks = [], [], 0, 0
+            for index in range(args.devices):
+                lat = args.lat + rng.uniform(-args.spread, args.spread)
+                lon = args.lon + rng.uniform(-args.spread, args.spread)
+                at = now - step * per_device
+                for _ in range(per_device):
+                    lat += rng.gauss(0, 0.0003)
+                    lon += rng.gauss(0, 0.0003)
+                    at += step
+                    history.append({"serial_number": serial(index), "latitude": lat, "longitude": lon,
+                                    "timestamp": at, "is_outlier": False})
+                devices.append({
+                    "serial_number": serial(index), "name": f"Bench {index}", "make": "Bench",
+                    "model": "Synthetic", "device_type": "Simulated", "current_status": "active",
+                    "current_location": "Synthetic", "os_version": "n/a", "latitude": lat, "longitude": lon,
+                    "last_updated": at, "last_seen": at, "presence": "offline",
+                    "user_id": index % users + 1})
+                if len(history) >= CHUNK_ROWS:
+                    conn.execute(insert(ts.DeviceLocationHistory), history)
+                    written += len(history)
+                    history = []
+                    chunks += 1
+                    if chunks % 50 == 0:
+                        rate = written / (time.monotonic() - started)
+                        print(f"  {written:,} history rows ({rate:,.0f}/s)", flush=True)
+                if len(devices) >= CHUNK_ROWS:
+                    conn.execute(insert(ts.Device), devices)
+                    devices = []
+            if history:
+                conn.execute(insert(ts.DeviceLocationHistory), history)
+                written += len(history)
+            if devices:
+                conn.execute(insert(ts.Device), devices)
+        if engine.dialect.name == "sqlite":
+            with engine.connect() as conn:
+                conn.execute(text("ANALYZE"))
+        elif engine.dialect.name == "postgresql":
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("ANALYZE"))
+    print(f"Generated {users:,} users, {args.devices:,} devices and {written:,} history rows "
+          f"in {time.monotonic() - started:.1f}s")
+
+
+def dataset_info(ts):
+    from sqlalchemy import func, select
+
+    session = ts.db.session
+    return {
+        "dialect": ts.db.engine.dialect.name,
+        "users": session.scalar(select(func.count()).select_from(ts.User)),
+        "devices": session.scalar(select(func.count()).select_from(ts.Device)),
+        # max(id) rather than COUNT(*): close enough and instant on 50M rows
+        "history_rows": session.scalar(select(func.max(ts.DeviceLocationHistory.id))) or 0,
+    }
+
+
+# ===================== CASES =====================
+class Case:
+    """One timed request; setup(i) runs untimed before sample i and returns (method, path, json)."""
+
+    def __init__(self, name, setup, expect=200):
+        self.name = name
+        self.setup = setup
+        self.expect = expect
+
+
+def build_cases(ts, owned, others):
+    """owned: serials of the benchmark user's devices; others: serials of other users' devices."""
+    target = owned[0]
+    rng = random.Random(7)
+    positions = {}
+
+    def next_point(serial_number, at=None):
+        if serial_number not in positions:
+            device = ts.Device.query.filter_by(serial_number=serial_number).first()
+            positions[serial_number] = [device.latitude, device.longitude]
+        position = positions[serial_number]
+        position[0] += rng.gauss(0, 0.0001)
+        position[1] += rng.gauss(0, 0.0001)
+        return {"serial_number": serial_number, "latitude": position[0], "longitude": position[1],
+                "last_seen": (at or datetime.now(timezone.utc)).isoformat(), "accuracy": 10}
+
+    def report_location(i):
+        return "POST", "/api/report_location", next_point(others[i % len(others)])
+
+    def report_locations(i):
+        serial_number = others[i % len(others)]
+        now = datetime.now(timezone.utc)
+        points = [next_point(serial_number, now - timedelta(seconds=5 * (49 - k))) for k in range(50)]
+        return "POST", "/api/report_locations", {"serial_number": serial_number, "points": points}
+
+    def pending_command(i):
+        ts.command_queue.enqueue(serial_number=target, command_type="ping", command_data={},
+                                 user_id=None, ttl=None, commit=True)
+        return "GET", f"/api/device_commands/{target}", None
+
+    return [
+        Case("report_location", report_location),
+        Case("report_locations_50", report_locations),
+        Case("api_devices", lambda i: ("GET", "/api/devices", None)),
+        Case("device_location", lambda i: ("GET", f"/api/device_location/{owned[i % len(owned)]}", None)),
+        Case("live_locations", lambda i: ("GET", "/api/live_locations", None)),
+        Case("all_devices", lambda i: ("GET", "/api/all_devices", None)),
+        Case("export_device_history", lambda i: ("GET", f"/export/{owned[i % len(owned)]}", None)),
+        Case("device_commands_empty", lambda i: ("GET", f"/api/device_commands/{others[i % len(others)]}", None)),
+        Case("device_commands_pending", pending_command),
+    ]
+
+
+# ===================== TIMING =====================
+def summarize(samples):
+    """Robust statistics (milliseconds) for a list of durations in seconds."""
+    values = sorted(samples)
+    median = statistics.median(values)
+    stdev = statistics.stdev(values) if len(values) > 1 else 0.0
+    quartiles = statistics.quantiles(values, n=4) if len(values) > 1 else [median, median, median]
+    return {
+        "samples": len(values),
+        "min_ms": round(values[0] * 1000, 4),
+        "median_ms": round(median * 1000, 4),
+        "mean_ms": round(statistics.fmean(values) * 1000, 4),
+        "stdev_ms": round(stdev * 1000, 4),
+        "p95_ms": round(percentile(values, 95) * 1000, 4),
+        "iqr_ms": round((quartiles[2] - quartiles[0]) * 1000, 4),
+        "ops_per_s": round(1 / median, 2) if median else None,
+    }
+
+
+def time_case(client, case, warmup, repeat, min_time):
+    samples = []
+    started = time.monotonic()
+    i = 0
+    while i < warmup + repeat or time.monotonic() - started < min_time:
+        method, path, payload = case.setup(i)
+        gc.collect()
+        begin = time.perf_counter()
+        response = client.open(path, method=method, json=payload)
+        response.get_data()  # streamed bodies (CSV export) are produced here
+        elapsed = time.perf_counter() - begin
+        if response.status_code != case.expect:
+            raise RuntimeError(f"{case.name}: {method} {path} answered {response.status_code}, "
+                               f"expected {case.expect}: {response.get_data(as_text=True)[:200]}")
+        if i >= warmup:
+            samples.append(elapsed)
+        i += 1
+    return summarize(samples)
+
+
+def git_revision():
+    def git(*args):
+        try:
+            return subprocess.run(("git",) + args, capture_output=True, text=True, timeout=10,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "-uno"))}
+
+
+def run(args):
+    ts = load_app(database_url(args.database))
+    client = ts.app.test_client()
+    with ts.app.app_context():
+        dataset = dataset_info(ts)
+        if not dataset["devices"]:
+            raise SystemExit("No devices in the database; run `benchmark.py generate` first")
+        users = dataset["users"]
+        owned = [serial(i) for i in range(dataset["devices"]) if i % users == 0][:1000]
+        others = [serial(i) for i in range(dataset["devices"]) if i % users != 0][:1000] or owned
+    response = client.post("/login", data={"email": "bench0@example.com", "password": PASSWORD})
+    if response.status_code != 302 or "/login" in response.headers.get("Location", ""):
+        raise SystemExit("Could not log in as the benchmark user; was the dataset made by `generate`?")
+
+    results = {}
+    with ts.app.app_context():
+        cases = build_cases(ts, owned, others)
+    for case in cases:
+        if args.only and case.name not in args.only:
+            continue
+        with ts.app.app_context():
+            results[case.name] = time_case(client, case, args.warmup, args.repeat, args.min_time)
+        r = results[case.name]
+        print(f"{case.name:<26}{r['median_ms']:>11.3f}{r['p95_ms']:>11.3f}{r['iqr_ms']:>11.3f}"
+              f"{r['ops_per_s'] or 0:>11}", flush=True)
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dataset": dataset,
+            "config": {"warmup": args.warmup, "repeat": args.repeat, "min_time": args.min_time},
+        },
+        "results": results,
+    }
+
+
+# ===================== COMPARE =====================
+def compare(old, new, threshold):
+    """Median change per case; a case counts as changed only beyond `threshold` and the IQR noise."""
+    rows = []
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        before, after = old["results"][name], new["results"][name]
+        change = (after["median_ms"] - before["median_ms"]) / before["median_ms"] if before["median_ms"] else 0.0
+        noise = max(before["iqr_ms"], after["iqr_ms"])
+        verdict = "same"
+        if abs(change) > threshold and abs(after["median_ms"] - before["median_ms"]) > noise:
+            verdict = "slower" if change > 0 else "faster"
+        rows.append({"name": name, "before_ms": before["median_ms"], "after_ms": after["median_ms"],
+                     "change": round(change, 4), "verdict": verdict})
+    return rows
+
+
+def print_comparison(rows, old, new, out=sys.stdout):
+    def label(result):
+        git = result["meta"]["git"]
+        return (git["commit"] or "unknown")[:10] + ("+" if git["dirty"] else "")
+    print(f"{'case':<26}{label(old):>13}{label(new):>13}{'change':>10}", file=out)
+    for row in rows:
+        print(f"{row['name']:<26}{row['before_ms']:>13.3f}{row['after_ms']:>13.3f}"
+              f"{row['change'] * 100:>9.1f}%  {row['verdict'] if row['verdict'] != 'same' else ''}", file=out)
+
+
+# ===================== CLI =====================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tracking server's hot paths.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="build a synthetic fleet (drops existing tables)")
+    gen.add_argument("--database", default="bench.db", help="SQLite file or database URL")
+    gen.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    gen.add_argument("--devices", type=int)
+    gen.add_argument("--history-rows", type=int)
+    gen.add_argument("--users", type=int, help="default: one per --devices-per-user devices")
+    gen.add_argument("--devices-per-user", type=int, default=100)
+    gen.add_argument("--days", type=float, default=30, help="history window ending now")
+    gen.add_argument("--lat", type=float, default=-1.2833)
+    gen.add_argument("--lon", type=float, default=36.8167)
+    gen.add_argument("--spread", type=float, default=0.5)
+    gen.add_argument("--seed", type=int, default=1)
+
+    bench = commands.add_parser("run", help="time the hot paths against a generated dataset")
+    bench.add_argument("--database", default="bench.db", help="SQLite file or database URL")
+    bench.add_argument("--warmup", type=int, default=5)
+    bench.add_argument("--repeat", type=int, default=50)
+    bench.add_argument("--min-time", type=float, default=0, help="keep sampling each case at least this long")
+    bench.add_argument("--only", nargs="+", help="case names to run")
+    bench.add_argument("--json", help="write results to this file")
+
+    cmp = commands.add_parser("compare", help="compare two result files")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+    cmp.add_argument("--threshold", type=float, default=0.05, help="relative median change that counts")
+    cmp.add_argument("--fail-on-regression", action="store_true")
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        preset = PRESETS[args.preset]
+        args.devices = args.devices or preset["devices"]
+        args.history_rows = args.history_rows if args.history_rows is not None else preset["history_rows"]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "generate":
+        generate(args)
+    elif args.command == "run":
+        print(f"{'case':<26}{'median ms':>11}{'p95 ms':>11}{'iqr ms':>11}{'ops/s':>11}")
+        result = run(args)
+        if args.json:
+            os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent=2)
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        rows = compare(old, new, args.threshold)
+        print_comparison(rows, old, new)
+        if args.fail_on_regression and any(row["verdict"] == "slower" for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Wake-ups for long-polling devices when a command is enqueued.
+
+Within a process, waiters block on a threading.Event per request and
+send_command sets every event registered for the serial. Across gunicorn
+workers:
+
+  * Postgres: send_command issues pg_notify('device_commands', serial) in
+    its transaction; each worker runs one LISTEN thread on a dedicated
+    connection and forwards notifications to its local waiters.
+  * SQLite has no notification channel, so waiters also wake every
+    LONGPOLL_RECHECK_SECONDS and re-check the (indexed) queue themselves.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "device_commands"
+# Payload used for bulk jobs: every waiter re-checks its own queue
+BROADCAST = "*"
+
+
+class CommandNotifier:
+    def __init__(self, db):
+        self.db = db
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._listener_pid = None
+        self.notifications = 0
+
+    def uses_pg_notify(self):
+        return self.db.engine.dialect.name == "postgresql"
+
+    def recheck_interval(self):
+        """How often a waiter re-checks the queue without being notified."""
+        default = 15.0 if self.uses_pg_notify() else 1.0
+        return float(os.environ.get("LONGPOLL_RECHECK_SECONDS", default))
+
+    @contextmanager
+    def subscribe(self, serial_number):
+        """Register a waiter for the duration of a long-poll; yields its Event."""
+        self._ensure_listener()
+        event = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(serial_number, set()).add(event)
+        try:
+            yield event
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(serial_number)
+                if waiters is not None:
+                    waiters.discard(event)
+                    if not waiters:
+                        del self._waiters[serial_number]
+
+    def waiting(self):
+        with self._lock:
+            return sum(len(w) for w in self._waiters.values())
+
+    def notify_local(self, serial_number):
+        """Wake local waiters for serial_number ("*" wakes every waiter)."""
+        with self._lock:
+            if serial_number == BROADCAST:
+                events = [event for waiters in self._waiters.values() for event in waiters]
+            else:
+                events = list(self._waiters.get(serial_number, ()))
+        for event in events:
+            event.set()
+        self.notifications += 1
+
+    def publish(self, serial_number):
+        """
+        Announce a new command for serial_number. Call before committing the
+        command so other workers are notified exactly when it becomes visible.
+        """
+        if self.uses_pg_notify():
+            self.db.session.execute(text("SELECT pg_notify(:channel, :serial)"),
+                                    {"channel": CHANNEL, "serial": serial_number})
+
+    def _ensure_listener(self):
+        if not self.uses_pg_notify() or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen, name="command-listener", daemon=True).start()
+
+    def _listen(self):
+        while True:
+            raw = None
+            try:
+                raw = self.db.engine.raw_connection()
+                conn = raw.driver_connection
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CHANNEL}")
+                while True:
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.notify_local(conn.notifies.pop(0).payload)
+            except Exception:
+                logger.exception("Command notification listener failed; reconnecting")
+                time.sleep(1.0)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.invalidate()
+                    except Exception:
+                        pass
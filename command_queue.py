@@ -0,0 +1,204 @@
+"""
+Device command queue with atomic claim, visibility timeouts and expiry.
+
+A poll claims the device's visible commands with a single
+UPDATE ... WHERE id IN (SELECT ... LIMIT n) RETURNING statement:
+
+  * Postgres adds FOR UPDATE SKIP LOCKED to the subquery, so concurrent polls
+    never block on or double-deliver the same rows.
+  * SQLite runs the whole statement under its database write lock, which
+    gives the same guarantee.
+
+Claimed commands become "sent" and invisible until visible_at (now +
+COMMAND_VISIBILITY_SECONDS). Without a command_ack in that window they are
+delivered again. Commands past expires_at (COMMAND_TTL_SECONDS after
+enqueue) are never delivered; expire() marks them expired, and marks
+commands delivered COMMAND_MAX_DELIVERIES times without an ack as failed.
+
+The claim predicate is served by ix_device_command_claim
+(serial_number, status, visible_at, expires_at).
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, insert, literal, select, update
+
+OPEN_STATUSES = ("pending", "sent")
+
+
+def utcnow():
+    """Naive UTC now, matching how DateTime columns are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class CommandQueue:
+    def __init__(self, db, command_model, ttl=None, visibility=None, max_deliveries=None, expire_every=60):
+        self.db = db
+        self.table = command_model.__table__
+        self.ttl = ttl or _env_int("COMMAND_TTL_SECONDS", 86400)
+        self.visibility = visibility or _env_int("COMMAND_VISIBILITY_SECONDS", 60)
+        self.max_deliveries = max_deliveries or _env_int("COMMAND_MAX_DELIVERIES", 5)
+        self.expire_every = expire_every
+        self._last_expire = 0.0
+        self._lock = threading.Lock()
+
+    def enqueue(self, serial_number, command_type, command_data=None, user_id=None, ttl=None, commit=True):
+        """Insert a pending command visible immediately; returns its id."""
+        now = utcnow()
+        command_id = self.db.session.execute(
+            insert(self.table).values(
+                serial_number=serial_number,
+                command_type=command_type,
+                command_data=json.dumps(command_data or {}),
+                status="pending",
+                created_at=now,
+                visible_at=now,
+                expires_at=now + timedelta(seconds=ttl or self.ttl),
+                delivery_count=0,
+                user_id=user_id,
+            ).returning(self.table.c.id)
+        ).scalar_one()
+        if commit:
+            self.db.session.commit()
+        return command_id
+
+    def enqueue_for_devices(self, serials_select, command_type, command_data=None, user_id=None,
+                            job_id=None, ttl=None):
+        """
+        Queue one command per serial selected by `serials_select` (a SELECT of
+        a single serial_number column) in a single INSERT ... SELECT.
+        Returns the number of commands created; the caller commits.
+        """
+        t = self.table
+        now = utcnow()
+        serials = serials_select.subquery()
+        source = select(
+            serials.c[0],
+            literal(command_type),
+            literal(json.dumps(command_data or {})),
+            literal("pending"),
+            literal(now),
+            literal(now),
+            literal(now + timedelta(seconds=ttl or self.ttl)),
+            literal(0),
+            literal(user_id, type_=t.c.user_id.type),
+            literal(job_id, type_=t.c.job_id.type),
+        )
+        columns = ["serial_number", "command_type", "command_data", "status", "created_at",
+                   "visible_at", "expires_at", "delivery_count", "user_id", "job_id"]
+        return self.db.session.execute(insert(t).from_select(columns, source)).rowcount
+
+    def claim(self, serial_number, limit=50, now=None):
+        """Atomically claim up to `limit` deliverable commands for a device."""
+        self.maybe_expire()
+        t = self.table
+        now = now or utcnow()
+        candidates = (select(t.c.id)
+                      .where(t.c.serial_number == serial_number,
+                             t.c.status.in_(OPEN_STATUSES),
+                             t.c.visible_at <= now,
+                             t.c.expires_at > now,
+                             t.c.delivery_count < self.max_deliveries)
+                      .order_by(t.c.id)
+                      .limit(limit))
+        if self.db.session.get_bind().dialect.name == "postgresql":
+            candidates = candidates.with_for_update(skip_locked=True)
+        rows = self.db.session.execute(
+            update(t)
+            .where(t.c.id.in_(candidates.scalar_subquery()))
+            .values(status="sent", visible_at=now + timedelta(seconds=self.visibility),
+                    delivery_count=t.c.delivery_count + 1)
+            .returning(t.c.id, t.c.command_type, t.c.command_data, t.c.created_at, t.c.delivery_count)
+        ).all()
+        self.db.session.commit()
+        return sorted(rows, key=lambda row: row.id)
+
+    def ack(self, command_id, status="executed", executed_at=None, serial_number=None):
+        """Complete an open command; returns False if it was unknown or already closed."""
+        t = self.table
+        scope = [t.c.id == command_id, t.c.status.in_(OPEN_STATUSES)]
+        if serial_number is not None:
+            scope.append(t.c.serial_number == serial_number)
+        row = self.db.session.execute(
+            update(t)
+            .where(*scope)
+            .values(status=status, executed_at=executed_at or utcnow())
+            .returning(t.c.id)
+        ).first()
+        self.db.session.commit()
+        return row is not None
+
+    def ack_many(self, acks, serial_number=None, commit=True):
+        """
+        Complete many commands with one UPDATE. `acks` are (command_id, status,
+        executed_at) tuples; when serial_number is given only that device's
+        commands can be acknowledged. Returns {command_id: result} where result
+        is "acknowledged", "already_closed" or "not_found".
+        """
+        t = self.table
+        acks = {command_id: (status, executed_at or utcnow()) for command_id, status, executed_at in acks}
+        if not acks:
+            return {}
+        scope = [t.c.id.in_(list(acks))]
+        if serial_number is not None:
+            scope.append(t.c.serial_number == serial_number)
+        updated = set(self.db.session.execute(
+            update(t)
+            .where(*scope, t.c.status.in_(OPEN_STATUSES))
+            .values(status=case({command_id: status for command_id, (status, _) in acks.items()},
+                                value=t.c.id),
+                    executed_at=case({command_id: at for command_id, (_, at) in acks.items()},
+                                     value=t.c.id))
+            .returning(t.c.id)
+        ).scalars())
+        missing = [command_id for command_id in acks if command_id not in updated]
+        known = set()
+        if missing:
+            known = set(self.db.session.execute(
+                select(t.c.id).where(t.c.id.in_(missing), *scope[1:])).scalars())
+        if commit:
+            self.db.session.commit()
+        return {command_id: "acknowledged" if command_id in updated
+                else "already_closed" if command_id in known else "not_found"
+                for command_id in acks}
+
+    def depth(self, serial_number=None):
+        """Number of open commands, optionally for one device."""
+        t = self.table
+        stmt = select(t.c.id).where(t.c.status.in_(OPEN_STATUSES))
+        if serial_number is not None:
+            stmt = stmt.where(t.c.serial_number == serial_number)
+        return self.db.session.execute(select(self.db.func.count()).select_from(stmt.subquery())).scalar()
+
+    def expire(self, now=None):
+        """Close commands past their TTL or delivery budget; returns (expired, failed)."""
+        t = self.table
+        now = now or utcnow()
+        expired = self.db.session.execute(
+            update(t).where(t.c.status.in_(OPEN_STATUSES), t.c.expires_at <= now)
+            .values(status="expired")).rowcount
+        failed = self.db.session.execute(
+            update(t).where(t.c.status == "sent", t.c.visible_at <= now,
+                            t.c.delivery_count >= self.max_deliveries)
+            .values(status="failed")).rowcount
+        self.db.session.commit()
+        return expired, failed
+
+    def maybe_expire(self):
+        """Run expire() at most once every `expire_every` seconds per process."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_expire < self.expire_every:
+                return
+            self._last_expire = now
+        self.expire()
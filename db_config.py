@@ -0,0 +1,117 @@
+"""
+Connection pool settings and read-replica routing.
+
+Pool (server databases only; SQLite keeps its own pooling):
+
+    DB_POOL_SIZE        persistent connections per worker (default 10)
+    DB_MAX_OVERFLOW     extra connections under bursts (default 22, so
+                        size + overflow covers gunicorn's 32 threads)
+    DB_POOL_TIMEOUT     seconds to wait for a free connection (default 10)
+    DB_POOL_RECYCLE     seconds before a connection is replaced (default
+                        1800, under typical proxy/NAT idle cut-offs)
+    DB_POOL_PRE_PING    1/0, test connections on checkout (default 1)
+
+Replica: with DATABASE_REPLICA_URL set, the session routes SELECTs to the
+"replica" bind while session.info["use_replica"] is set (per request, by
+the read-only views). Flushes and every non-SELECT statement always go to
+the primary. ReplicaMonitor decides whether the replica may be used: its
+lag is measured at most once per check interval and must be within the
+staleness bound; after an error the replica is skipped for a while.
+"""
+import logging
+import os
+import threading
+import time
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = "replica"
+
+# Seconds behind the primary: 0 when fully replayed (an idle primary makes
+# pg_last_xact_replay_timestamp() age without any real lag) or not a standby
+POSTGRES_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+def engine_options_from_env(url, environ=os.environ):
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": int(environ.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(environ.get("DB_MAX_OVERFLOW", 22)),
+        "pool_timeout": float(environ.get("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": environ.get("DB_POOL_PRE_PING", "1") != "0",
+    }
+
+
+def measure_lag(engine):
+    """Replication lag of `engine` in seconds (0 for non-Postgres databases)."""
+    if engine.dialect.name != "postgresql":
+        return 0.0
+    with engine.connect() as conn:
+        return float(conn.execute(text(POSTGRES_LAG_SQL)).scalar() or 0)
+
+
+def bound_engines(db):
+    """Engines statements can run on, by label: the primary and, when configured, the replica."""
+    engines = {"primary": db.engine}
+    if REPLICA_BIND in db.engines:
+        engines[REPLICA_BIND] = db.engines[REPLICA_BIND]
+    return engines
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends plain SELECTs to the replica bind when asked to."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get("use_replica") and not self._flushing
+                and getattr(clause, "is_select", False)):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaMonitor:
+    def __init__(self, measure, max_lag=5.0, check_interval=1.0, retry_after=10.0):
+        self.measure = measure
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.lag = None
+        self.healthy = False
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def usable(self, now=None):
+        """True if reads may go to the replica; one caller at a time refreshes the lag, the rest don't wait."""
+        now = now if now is not None else time.monotonic()
+        if now >= self._next_check and self._lock.acquire(blocking=False):
+            try:
+                self._next_check = now + self.check_interval
+                self.lag = self.measure()
+                self.healthy = self.lag <= self.max_lag
+                if not self.healthy:
+                    logger.warning("Replica is %.1fs behind (limit %.1fs); reading from the primary",
+                                   self.lag, self.max_lag)
+            except Exception:
+                logger.exception("Replica lag check failed; reading from the primary")
+                self.mark_failed(now)
+            finally:
+                self._lock.release()
+        return self.healthy
+
+    def mark_failed(self, now=None):
+        now = now if now is not None else time.monotonic()
+        self.healthy = False
+        self.lag = None
+        self._next_check = now + self.retry_after
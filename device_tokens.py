@@ -0,0 +1,147 @@
+"""
+Stateless device tokens.
+
+A token is issued when a device is registered and names its serial:
+
+    v1.<base64url serial>.<issued-at ms>.<base64url HMAC-SHA256>
+
+Verification recomputes the HMAC with DEVICE_TOKEN_SECRET (falling back to
+SECRET_KEY) and compares in constant time, so it needs no database access.
+With neither set no tokens are issued or accepted: a well-known default
+key would let anyone sign a token for any serial. Revocation is per device: rotating or deleting a device
+records a "revoked before" time, and tokens issued before it are rejected.
+Those times form a small set that each process keeps in memory and reloads
+every DEVICE_TOKEN_REVOCATION_REFRESH_SECONDS.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+VERSION = "v1"
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def secret_from_env(environ=os.environ):
+    """DEVICE_TOKEN_SECRET, else SECRET_KEY; None (tokens disabled) when neither is set."""
+    secret = environ.get("DEVICE_TOKEN_SECRET") or environ.get("SECRET_KEY")
+    if not secret:
+        logger.error("Neither DEVICE_TOKEN_SECRET nor SECRET_KEY is set; device tokens are disabled")
+    return secret or None
+
+
+class DeviceTokenSigner:
+    def __init__(self, secret):
+        if isinstance(secret, str):
+            secret = secret.encode("utf-8")
+        self.secret = secret or None
+
+    def _signature(self, message):
+        return _b64encode(hmac.new(self.secret, message.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, serial_number, issued_at_ms=None):
+        """Signed token for the serial, or None without a secret."""
+        if self.secret is None:
+            return None
+        message = f"{VERSION}.{_b64encode(serial_number.encode('utf-8'))}.{issued_at_ms or now_ms()}"
+        return f"{message}.{self._signature(message)}"
+
+    def verify(self, token):
+        """Return (serial_number, issued_at_ms) for a well-signed token, else None."""
+        if self.secret is None or not isinstance(token, str) or not token.isascii():
+            return None
+        try:
+            message, signature = token.rsplit(".", 1)
+            version, serial, issued_at = message.split(".")
+        except ValueError:
+            return None
+        if version != VERSION or not hmac.compare_digest(signature, self._signature(message)):
+            return None
+        try:
+            return _b64decode(serial).decode("utf-8"), int(issued_at)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return None
+
+
+class RevocationList:
+    """
+    In-memory {serial_number: revoked_before_ms}, reloaded with `load()` at
+    most every `refresh_every` seconds. The reload happens on the request
+    that finds the list stale; concurrent requests keep using the old copy.
+    """
+
+    def __init__(self, load, refresh_every=None):
+        self.load = load
+        self.refresh_every = refresh_every if refresh_every is not None else float(
+            os.environ.get("DEVICE_TOKEN_REVOCATION_REFRESH_SECONDS", 30))
+        self._revoked = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _maybe_refresh(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_every:
+            return
+        if not self._lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_every:
+                self._revoked = dict(self.load())
+                self._loaded_at = time.monotonic()
+        except Exception:
+            logger.exception("Could not reload device token revocations")
+            self._loaded_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def revoke(self, serial_number, before_ms):
+        """Record a revocation made by this process; others see it on their next reload."""
+        revoked = dict(self._revoked)
+        revoked[serial_number] = max(before_ms, revoked.get(serial_number, 0))
+        self._revoked = revoked
+
+    def is_revoked(self, serial_number, issued_at_ms):
+        self._maybe_refresh()
+        revoked_before = self._revoked.get(serial_number)
+        return revoked_before is not None and issued_at_ms < revoked_before
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+class DeviceTokens:
+    """Issue and check device tokens against a signer and a revocation list."""
+
+    def __init__(self, signer, revocations):
+        self.signer = signer
+        self.revocations = revocations
+
+    @property
+    def enabled(self):
+        return self.signer.secret is not None
+
+    def issue(self, serial_number, issued_at_ms=None):
+        return self.signer.issue(serial_number, issued_at_ms)
+
+    def verify(self, token):
+        """Serial number the token authenticates, or None if invalid or revoked."""
+        claims = self.signer.verify(token)
+        if claims is None or self.revocations.is_revoked(*claims):
+            return None
+        return claims[0]
@@ -0,0 +1,163 @@
+"""
+Staged, batched enrichment pipeline that runs off the request path.
+
+Ingest persists the raw point and calls Pipeline.submit(), which never
+blocks: if the first queue is full the item is dropped and counted. Each
+Stage has its own bounded queue and worker threads that pull items in
+batches (up to batch_size, waiting at most max_wait for a batch to fill),
+run the stage handler once per batch and pass the handler's output items to
+the next stage.
+
+Per-stage metrics: queue depth, items in/out, drops, failures, batches and
+queue+processing latency (count, mean, max and recent p50/p95).
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """One pipeline step: a bounded queue drained in batches by worker threads."""
+
+    def __init__(self, name, handler, workers=1, batch_size=100, max_wait=0.05, maxsize=10000):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.next = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=1024)
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def put(self, item, enqueued_at=None):
+        """Queue an item without blocking; returns False if it was dropped."""
+        try:
+            self.queue.put_nowait((enqueued_at or time.monotonic(), item))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.received += 1
+        return True
+
+    def _take_batch(self):
+        first = self.queue.get()
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            with self._lock:
+                self._in_flight += len(batch)
+            try:
+                outputs = self.handler([item for _, item in batch]) or []
+            except Exception:
+                logger.exception("Enrichment stage %s failed on a batch of %d", self.name, len(batch))
+                outputs = []
+                with self._lock:
+                    self.failed += len(batch)
+            now = time.monotonic()
+            with self._lock:
+                self.batches += 1
+                self.processed += len(batch)
+                for enqueued_at, _ in batch:
+                    latency = now - enqueued_at
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+                    self._latencies.append(latency)
+            if self.next is not None:
+                for item in outputs:
+                    self.next.put(item)
+            with self._lock:
+                self._in_flight -= len(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"enrich-{self.name}-{i}", daemon=True).start()
+
+    def idle(self):
+        # unfinished_tasks only drops after a batch is handled and forwarded
+        return self.queue.unfinished_tasks == 0
+
+    def stats(self):
+        with self._lock:
+            recent = sorted(self._latencies)
+            count = self.processed
+            return {
+                "queue_depth": self.queue.qsize(),
+                "in_flight": self._in_flight,
+                "received": self.received,
+                "processed": count,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "batches": self.batches,
+                "latency_mean_ms": round(self.latency_total / count * 1000, 3) if count else 0.0,
+                "latency_max_ms": round(self.latency_max * 1000, 3),
+                "latency_p50_ms": round(recent[len(recent) // 2] * 1000, 3) if recent else 0.0,
+                "latency_p95_ms": round(recent[int(len(recent) * 0.95)] * 1000, 3) if recent else 0.0,
+            }
+
+
+class Pipeline:
+    """Chain of stages; threads start lazily in the process that first submits."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so (re)start them per worker process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                for stage in self.stages:
+                    stage.start()
+                self._pid = os.getpid()
+
+    def submit(self, item):
+        """Hand an item to the first stage; never blocks the caller."""
+        self._ensure_started()
+        return self.stages[0].put(item)
+
+    def wait_idle(self, timeout=5.0):
+        """Block until every stage is drained (used by tests and shutdown hooks)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(stage.idle() for stage in self.stages):
+                return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
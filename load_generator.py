@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Asyncio load generator: thousands of virtual devices against a running server.
+
+Each virtual device is a coroutine that reports its position on the real
+device endpoints, optionally polls for commands and acknowledges them, and
+moves according to a motion model. All devices share one aiohttp session,
+so tens of thousands of devices need a single process.
+
+    python load_generator.py --url http://127.0.0.1:5000 --devices 5000 \
+        --interval 5 --duration 120 --motion vehicle --poll-interval 30
+
+With --register (and --email/--password of an existing account) each device
+is registered first through /api/register_device and uses the returned
+device token. Without it the serials must already exist (or the server
+answers 404, which is reported as an error).
+
+Results: throughput, p50/p95/p99 latency and error rates per endpoint,
+printed at the end (and every --progress seconds) and optionally written as
+JSON with --json.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from array import array
+from datetime import datetime, timezone
+
+import aiohttp
+
+METERS_PER_DEGREE = 111320.0
+
+
+# ===================== STATS =====================
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = array("d")
+        self.statuses = {}
+        self.errors = {}
+
+    def record(self, latency, status=None, error=None):
+        self.latencies.append(latency)
+        if error is not None:
+            self.errors[error] = self.errors.get(error, 0) + 1
+        else:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, elapsed):
+        values = sorted(self.latencies)
+        total = len(values)
+        ok = sum(count for status, count in self.statuses.items() if 200 <= status < 300)
+        return {
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+            "ok": ok,
+            "error_rate": round((total - ok) / total, 4) if total else 0.0,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "errors": dict(self.errors),
+            "latency_ms": {
+                "p50": _ms(percentile(values, 50)),
+                "p95": _ms(percentile(values, 95)),
+                "p99": _ms(percentile(values, 99)),
+                "max": _ms(values[-1] if values else None),
+                "mean": _ms(sum(values) / total if total else None),
+            },
+        }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+class Stats:
+    def __init__(self):
+        self.endpoints = {}
+        self.points = 0
+        self.commands = 0
+        self.started = time.monotonic()
+
+    def endpoint(self, name):
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints[name] = EndpointStats()
+        return stats
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "points_sent": self.points,
+            "points_per_s": round(self.points / elapsed, 2) if elapsed else 0.0,
+            "commands_received": self.commands,
+            "endpoints": {name: stats.summary(elapsed) for name, stats in sorted(self.endpoints.items())},
+        }
+
+
+def print_summary(summary, out=sys.stdout):
+    print(f"\n{summary['elapsed_s']:.1f}s  points sent: {summary['points_sent']} "
+          f"({summary['points_per_s']}/s)  commands received: {summary['commands_received']}", file=out)
+    print(f"{'endpoint':<22}{'reqs':>9}{'req/s':>10}{'err%':>8}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}",
+          file=out)
+    for name, s in summary["endpoints"].items():
+        latency = s["latency_ms"]
+        print(f"{name:<22}{s['requests']:>9}{s['throughput_rps']:>10}{s['error_rate'] * 100:>8.2f}"
+              f"{latency['p50'] or 0:>10}{latency['p95'] or 0:>10}{latency['p99'] or 0:>10}", file=out)
+        failures = {**{k: v for k, v in s["statuses"].items() if not k.startswith("2")}, **s["errors"]}
+        if failures:
+            print(f"{'':<22}failures: {failures}", file=out)
+
+
+# ===================== MOTION =====================
+class Motion:
+    """Position of one virtual device; step(dt) advances it by dt seconds."""
+
+    def __init__(self, model, lat, lon, rng):
+        self.model = model
+        self.lat = lat
+        self.lon = lon
+        self.rng = rng
+        self.heading = rng.uniform(0, 2 * math.pi)
+        self.speed = {"static": 0.0, "walk": 1.4, "vehicle": rng.uniform(8, 25)}[model]
+
+    def step(self, dt):
+        if self.model == "static":
+            # GPS jitter only
+            north, east = self.rng.gauss(0, 3), self.rng.gauss(0, 3)
+        else:
+            turn = 0.6 if self.model == "walk" else 0.15
+            self.heading += self.rng.gauss(0, turn)
+            if self.model == "vehicle":
+                self.speed = min(35.0, max(0.0, self.speed + self.rng.gauss(0, 1.5)))
+            distance = self.speed * dt
+            north, east = distance * math.cos(self.heading), distance * math.sin(self.heading)
+        self.lat += north / METERS_PER_DEGREE
+        self.lon += east / (METERS_PER_DEGREE * max(0.01, math.cos(math.radians(self.lat))))
+        return self.lat, self.lon
+
+
+# ===================== DEVICES =====================
+class VirtualDevice:
+    def __init__(self, index, args, session, stats, stop_at, rng):
+        self.serial = f"{args.serial_prefix}{index:06d}"
+        self.args = args
+        self.session = session
+        self.stats = stats
+        self.stop_at = stop_at
+        self.rng = rng
+        self.motion = Motion(args.motion, args.lat + rng.uniform(-args.spread, args.spread),
+                             args.lon + rng.uniform(-args.spread, args.spread), rng)
+        self.headers = {}
+        self.buffer = []
+        self.pending_acks = []
+
+    async def request(self, name, method, path, payload=None):
+        started = time.perf_counter()
+        try:
+            async with self.session.request(method, self.args.url + path, json=payload,
+                                            headers=self.headers) as response:
+                body = await response.read()
+                self.stats.endpoint(name).record(time.perf_counter() - started, response.status)
+                if response.status == 200 and body:
+                    return json.loads(body)
+        except asyncio.TimeoutError:
+            self.stats.endpoint(name).record(time.perf_counter() - started, error="timeout")
+        except aiohttp.ClientError as exc:
+            self.stats.endpoint(name).record(time.perf_counter() - started, error=type(exc).__name__)
+        return None
+
+    async def register(self):
+        result = await self.request("register_device", "POST", "/api/register_device", {
+            "serial_number": self.serial, "name": f"Load {self.serial}", "make": "LoadGen",
+            "model": self.args.motion, "device_type": "Simulated", "current_status": "active",
+            "current_location": "Load test", "email": self.args.email, "password": self.args.password,
+        })
+        if result and result.get("device_token"):
+            self.headers = {"Authorization": f"Bearer {result['device_token']}"}
+
+    async def report(self):
+        lat, lon = self.motion.step(self.args.interval)
+        point = {"serial_number": self.serial, "latitude": round(lat, 7), "longitude": round(lon, 7),
+                 "last_seen": datetime.now(timezone.utc).isoformat(), "accuracy": 10}
+        self.buffer.append(point)
+        if len(self.buffer) < self.args.batch_size:
+            return
+        points, self.buffer = self.buffer, []
+        acks, self.pending_acks = self.pending_acks, []
+        if self.args.batch_size == 1:
+            payload = dict(points[0], acks=acks) if acks else points[0]
+            await self.request("report_location", "POST", "/api/report_location", payload)
+        else:
+            payload = {"serial_number": self.serial, "points": points}
+            if acks:
+                payload["acks"] = acks
+            await self.request("report_locations", "POST", "/api/report_locations", payload)
+        self.stats.points += len(points)
+
+    async def poll_commands(self):
+        commands = await self.request("device_commands", "GET", f"/api/device_commands/{self.serial}") or []
+        self.stats.commands += len(commands)
+        for command in commands:
+            ack = {"command_id": command["id"], "status": "executed",
+                   "executed_at": datetime.now(timezone.utc).isoformat()}
+            if self.args.ack_mode == "separate":
+                await self.request("command_ack", "POST", "/api/command_ack", ack)
+            else:
+                self.pending_acks.append(ack)
+
+    async def run(self):
+        if self.args.register:
+            await self.register()
+        # Spread devices across the ramp-up window and the first interval
+        await asyncio.sleep(self.rng.uniform(0, self.args.ramp_up + self.args.interval))
+        next_poll = time.monotonic() + self.rng.uniform(0, self.args.poll_interval or 0)
+        while time.monotonic() < self.stop_at:
+            await self.report()
+            if self.args.poll_interval and time.monotonic() >= next_poll:
+                await self.poll_commands()
+                next_poll = time.monotonic() + self.args.poll_interval
+            jitter = self.rng.uniform(-self.args.jitter, self.args.jitter) * self.args.interval
+            await asyncio.sleep(max(0.0, self.args.interval + jitter))
+
+
+async def progress(stats, every):
+    while True:
+        await asyncio.sleep(every)
+        summary = stats.summary()
+        parts = [f"{name} {s['throughput_rps']}/s p95={s['latency_ms']['p95']}ms err={s['error_rate']:.2%}"
+                 for name, s in summary["endpoints"].items()]
+        print(f"[{summary['elapsed_s']:.0f}s] " + " | ".join(parts), flush=True)
+
+
+async def run(args):
+    stats = Stats()
+    rng = random.Random(args.seed)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    stop_at = time.monotonic() + args.ramp_up + args.duration
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        devices = [VirtualDevice(i, args, session, stats, stop_at, random.Random(rng.random()))
+                   for i in range(args.devices)]
+        reporter = asyncio.create_task(progress(stats, args.progress)) if args.progress else None
+        await asyncio.gather(*(device.run() for device in devices))
+        if reporter:
+            reporter.cancel()
+    return stats.summary()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a fleet of devices against the tracking server.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60, help="seconds of steady load after ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=10, help="seconds over which devices start")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between position fixes per device")
+    parser.add_argument("--jitter", type=float, default=0.1, help="fraction of the interval to randomise")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="fixes per upload; >1 uses /api/report_locations")
+    parser.add_argument("--motion", choices=("static", "walk", "vehicle"), default="walk")
+    parser.add_argument("--poll-interval", type=float, default=0,
+                        help="seconds between command polls per device (0 disables)")
+    parser.add_argument("--ack-mode", choices=("piggyback", "separate"), default="piggyback")
+    parser.add_argument("--register", action="store_true", help="register devices first and use their tokens")
+    parser.add_argument("--email")
+    parser.add_argument("--password")
+    parser.add_argument("--serial-prefix", default="LOAD-")
+    parser.add_argument("--lat", type=float, default=-1.2833)
+    parser.add_argument("--lon", type=float, default=36.8167)
+    parser.add_argument("--spread", type=float, default=0.2, help="degrees around lat/lon to start devices")
+    parser.add_argument("--concurrency", type=int, default=500, help="max open connections")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--progress", type=float, default=5, help="seconds between progress lines (0 disables)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the summary to this file")
+    args = parser.parse_args(argv)
+    args.url = args.url.rstrip("/")
+    if args.register and not (args.email and args.password):
+        parser.error("--register needs --email and --password of the account that owns the devices")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    summary = asyncio.run(run(args))
+    summary["config"] = {key: value for key, value in vars(args).items() if key != "password"}
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
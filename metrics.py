@@ -0,0 +1,220 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+Hot-path updates take no locks: every thread writes to its own shard (a
+pair of dicts reached through threading.local), and shards are only summed
+when /metrics is scraped. Gauges and values owned by other components
+(queue depth, in-flight requests, ...) are read at scrape time through
+collector callbacks; running totals kept by other components (cache hits,
+shed requests, ...) come from counter collectors and are merged with this
+worker's own counters.
+
+Each gunicorn worker has its own registry. With METRICS_DIR set, workers
+write their counters and histograms to METRICS_DIR/<pid>.json every
+METRICS_FLUSH_SECONDS and a scrape merges every file, so totals cover the
+whole instance whichever worker answers (counter collectors included, so
+they stay monotonic). Use a fresh directory per deploy.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _snapshot(mapping):
+    # Another thread may insert while we copy; retrying is cheaper than locking writers
+    while True:
+        try:
+            return list(mapping.items())
+        except RuntimeError:
+            continue
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._collectors = []
+        self._counter_collectors = []
+        self._flusher_pid = None
+
+    # -- declaration --------------------------------------------------------
+    def counter(self, name, help_text):
+        self._meta[name] = ("counter", help_text, None)
+
+    def gauge(self, name, help_text):
+        self._meta[name] = ("gauge", help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = ("histogram", help_text, tuple(buckets))
+
+    def collector(self, fn):
+        """Register fn() -> iterable of (name, labels, value), called on every scrape."""
+        self._collectors.append(fn)
+        return fn
+
+    def counter_collector(self, fn):
+        """
+        Register fn() -> iterable of (name, labels, running total) for counters
+        kept by other components. They are flushed with this worker's own
+        counters, so must not touch the database (flushes run off-request).
+        """
+        self._counter_collectors.append(fn)
+        return fn
+
+    # -- hot path -----------------------------------------------------------
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = ({}, {})
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def inc(self, name, value=1, labels=()):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        histograms = self._shard()[1]
+        key = (name, labels)
+        entry = histograms.get(key)
+        if entry is None:
+            entry = histograms[key] = [0] * (len(self._meta[name][2]) + 3)
+        entry[bisect.bisect_left(self._meta[name][2], value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    # -- collection ---------------------------------------------------------
+    def _merge_local(self):
+        counters, histograms = {}, {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard_counters, shard_histograms in shards:
+            for key, value in _snapshot(shard_counters):
+                counters[key] = counters.get(key, 0) + value
+            for key, entry in _snapshot(shard_histograms):
+                merged = histograms.setdefault(key, [0] * len(entry))
+                for i, value in enumerate(list(entry)):
+                    merged[i] += value
+        for fn in self._counter_collectors:
+            try:
+                for name, labels, value in fn():
+                    key = (name, tuple(labels))
+                    counters[key] = counters.get(key, 0) + value
+            except Exception:
+                logger.exception("Metrics counter collector %s failed", getattr(fn, "__name__", fn))
+        return counters, histograms
+
+    def _merge_files(self, directory):
+        counters, histograms = {}, {}
+        for filename in os.listdir(directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in data["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, entry in data["histograms"]:
+                merged = histograms.setdefault((name, tuple(map(tuple, labels))), [0] * len(entry))
+                for i, value in enumerate(entry):
+                    merged[i] += value
+        return counters, histograms
+
+    def flush(self, directory):
+        """Write this worker's counters and histograms to directory/<pid>.json."""
+        counters, histograms = self._merge_local()
+        data = {"counters": [[name, labels, value] for (name, labels), value in counters.items()],
+                "histograms": [[name, labels, entry] for (name, labels), entry in histograms.items()]}
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    def start_flusher(self, directory, interval=5.0):
+        """Flush periodically from a daemon thread, once per process."""
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        os.makedirs(directory, exist_ok=True)
+
+        def loop():
+            while True:
+                try:
+                    self.flush(directory)
+                except Exception:
+                    logger.exception("Could not flush metrics to %s", directory)
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name="metrics-flusher", daemon=True).start()
+
+    def render(self, directory=None):
+        if directory:
+            self.flush(directory)
+            counters, histograms = self._merge_files(directory)
+        else:
+            counters, histograms = self._merge_local()
+        gauges = {}
+        for fn in self._collectors:
+            try:
+                for name, labels, value in fn():
+                    target = gauges if self._meta.get(name, ("gauge",))[0] == "gauge" else counters
+                    target[(name, tuple(labels))] = target.get((name, tuple(labels)), 0) + value
+            except Exception:
+                logger.exception("Metrics collector %s failed", getattr(fn, "__name__", fn))
+
+        by_name = {}
+        for (name, labels), value in list(counters.items()) + list(gauges.items()):
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), entry in histograms.items():
+            by_name.setdefault(name, []).append((labels, entry))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text, buckets = self._meta.get(name, ("untyped", "", None))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name[name], key=lambda item: item[0]):
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = _format_value(bound) if bound != float("inf") else "+Inf"
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(value[-2]))}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
@@ -22,6 +22,17 @@ BoxLayout:
         text: app.device_name
         multiline: False
         on_text: app.device_name = self.text.strip()
+    TextInput:
+        id: email
+        hint_text: "Account email (for Register)"
+        text: app.account_email
+        multiline: False
+        on_text: app.account_email = self.text.strip()
+    TextInput:
+        id: password
+        hint_text: "Account password"
+        password: True
+        multiline: False
     TextInput:
         id: server
         hint_text: "Server URL (http://ip:5000)"
@@ -55,6 +66,8 @@ class ClientApp(App):
     server_url = StringProperty("http://YOUR_SERVER_IP:5000")
     serial = StringProperty("DEV-00001")
     device_name = StringProperty("Android Phone")
+    account_email = StringProperty("")
+    device_token = StringProperty("")
     status_text = StringProperty("Idle")
     tracking = BooleanProperty(False)
 
@@ -79,6 +92,7 @@ class ClientApp(App):
             self.log(f"GPS unavailable: {e}")
 
         self._bg_thread = None
+        self._pending_acks = []
 
     # --- API calls ---
     def register_device(self):
@@ -91,9 +105,13 @@ class ClientApp(App):
             "device_type": "Phone",
             "current_status": "active",
             "current_location": "Registered",
+            "email": self.account_email,
+            "password": self.root.ids.password.text,
         }
         try:
             r = requests.post(f"{self.server_url}/api/register_device", json=payload, timeout=8)
+            if r.ok:
+                self.device_token = r.json().get("device_token", "")
             self.log("Registered" if r.ok else f"Register failed: {r.status_code} {r.text[:120]}")
         except Exception as e:
             self.log(f"Register error: {e}")
@@ -157,16 +175,36 @@ class ClientApp(App):
             "longitude": float(lon),
             "current_status": "active"
         }
+        if self._pending_acks:
+            data["acks"] = self._pending_acks
         try:
-            r = requests.post(f"{self.server_url}/api/report_location", json=data, timeout=6)
+            r = requests.post(f"{self.server_url}/api/report_location", json=data,
+                              headers=self._auth_headers(), timeout=6)
             if r.ok:
                 self.log(f"Sent {lat:.6f}, {lon:.6f}")
+                self._pending_acks = self._run_commands()
             else:
                 self.log(f"Send fail: {r.status_code}")
         except Exception as e:
             self.log(f"Net err: {e}")
 
+    def _run_commands(self):
+        # Acks for these are piggybacked on the next location upload
+        try:
+            r = requests.get(f"{self.server_url}/api/device_commands/{self.serial}",
+                             headers=self._auth_headers(), timeout=6)
+            commands = r.json() if r.ok else []
+        except Exception as e:
+            self.log(f"Command fetch err: {e}")
+            return []
+        for command in commands:
+            self.log(f"Command: {command['type']}")
+        return [{"command_id": command["id"], "status": "executed"} for command in commands]
+
     # --- helpers ---
+    def _auth_headers(self):
+        return {"Authorization": f"Bearer {self.device_token}"} if self.device_token else {}
+
     def _base_ok(self):
         if not self.server_url or not self.serial:
             self.log("Set server URL and serial")
@@ -0,0 +1,209 @@
+"""
+Ingest-time motion filter that drops impossible jumps.
+
+Each device's last accepted point is kept in memory. A new point is an
+outlier when reaching it from that point would need a speed above
+MOTION_MAX_SPEED_KMH (small moves under MOTION_MIN_JUMP_M are always
+allowed so GPS jitter with near-zero time deltas passes). After
+MOTION_MAX_REJECTIONS consecutive outliers the filter re-anchors on the new
+position, so a device that really did move (flight, SIM swap, VPN change)
+is not stuck forever.
+
+State is per process; each gunicorn worker converges on its own after the
+first accepted point per device.
+"""
+import math
+import os
+import threading
+from datetime import timezone
+
+import numpy as np
+
+from analytics import EARTH_RADIUS_M, haversine_m
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def epoch_seconds(timestamp):
+    """Epoch seconds for a datetime; naive values are taken as UTC."""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def haversine_scalar_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class MotionFilter:
+    """Per-device speed gate with a scalar path for single points and a vectorized path for batches."""
+
+    def __init__(self, max_speed_kmh=None, min_jump_m=None, max_rejections=None):
+        self.max_speed_mps = (max_speed_kmh or _env_float("MOTION_MAX_SPEED_KMH", 300.0)) / 3.6
+        self.min_jump_m = min_jump_m if min_jump_m is not None else _env_float("MOTION_MIN_JUMP_M", 1000.0)
+        self.max_rejections = int(max_rejections or _env_float("MOTION_MAX_REJECTIONS", 5))
+        # serial -> [latitude, longitude, epoch seconds, consecutive rejections]
+        self._last = {}
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+
+    def _is_jump(self, distance, dt):
+        return distance > self.min_jump_m and distance / max(dt, 1.0) > self.max_speed_mps
+
+    def check(self, serial_number, latitude, longitude, timestamp, prior=None):
+        """
+        Return (accepted, speed_mps) for one point and update the device state.
+
+        `prior` is an optional (latitude, longitude, timestamp) used to seed a
+        device the filter has not seen yet, e.g. the stored Device position.
+        """
+        t = epoch_seconds(timestamp)
+        with self._lock:
+            state = self._last.get(serial_number)
+            if state is None and prior is not None and None not in prior:
+                state = [prior[0], prior[1], epoch_seconds(prior[2]), 0]
+            if state is None:
+                self._last[serial_number] = [latitude, longitude, t, 0]
+                self.accepted += 1
+                return True, 0.0
+            distance = haversine_scalar_m(state[0], state[1], latitude, longitude)
+            dt = t - state[2]
+            speed = distance / max(dt, 1.0)
+            if self._is_jump(distance, dt) and state[3] + 1 < self.max_rejections:
+                state[3] += 1
+                self._last[serial_number] = state
+                self.rejected += 1
+                return False, speed
+            self._last[serial_number] = [latitude, longitude, t, 0]
+            self.accepted += 1
+            return True, speed
+
+    def filter_batch(self, serials, latitudes, longitudes, timestamps, priors=None):
+        """
+        Vectorized filter for many points (any mix of devices). Returns a
+        boolean mask aligned with the input.
+
+        Points are ordered per device by time behind that device's last
+        accepted point (or its `priors` entry, as for check()). A point is
+        dropped when the jump into it is impossible and the jump out of it is
+        too (or it is the device's last point in the batch). Passes repeat
+        until nothing more is dropped, and a point that follows another
+        dropped candidate waits for the next pass, so a single spike is
+        removed without also dropping the good point after it. As in check(),
+        the max_rejections-th consecutive drop re-anchors the device there.
+        """
+        n = len(serials)
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+        t_points = np.array([epoch_seconds(ts) for ts in timestamps], dtype=np.float64)
+        names, codes = np.unique(np.asarray(serials, dtype=object), return_inverse=True)
+        priors = priors or {}
+
+        with self._lock:
+            anchors = []
+            for i, name in enumerate(names):
+                state = self._last.get(name)
+                prior = priors.get(name)
+                if state is None and prior is not None and None not in prior:
+                    state = [prior[0], prior[1], epoch_seconds(prior[2]), 0]
+                if state is not None:
+                    anchors.append((i, state))
+            anchor_states = dict(anchors)
+            a_codes = np.array([i for i, _ in anchors], dtype=np.int64)
+            a_state = np.array([state[:3] for _, state in anchors], dtype=np.float64).reshape(-1, 3)
+            rejections = np.zeros(len(names), dtype=np.int64)
+            rejections[a_codes] = [state[3] for _, state in anchors]
+
+            code = np.concatenate([a_codes, codes])
+            lat = np.concatenate([a_state[:, 0], np.asarray(latitudes, dtype=np.float64)])
+            lon = np.concatenate([a_state[:, 1], np.asarray(longitudes, dtype=np.float64)])
+            t = np.concatenate([a_state[:, 2], t_points])
+            is_anchor = np.concatenate([np.ones(len(a_codes), bool), np.zeros(n, bool)])
+            source = np.concatenate([np.full(len(a_codes), -1), np.arange(n)])
+
+            order = np.lexsort((t, ~is_anchor, code))
+            code, lat, lon, t, is_anchor, source = (a[order] for a in (code, lat, lon, t, is_anchor, source))
+
+            # Points the device re-anchors on are never dropped, like stored anchors
+            pinned = is_anchor.copy()
+            while True:
+                alive = self._drop_jumps(code, lat, lon, t, pinned)
+                counts, reanchored = self._count_rejections(code, alive, is_anchor, rejections)
+                if not reanchored:
+                    break
+                pinned[reanchored] = True
+
+            accepted = np.zeros(n, dtype=bool)
+            kept = alive & ~is_anchor
+            accepted[source[kept]] = True
+
+            # Remember the newest accepted point per device for the next request
+            kept_idx = np.flatnonzero(kept)
+            kept_codes = code[kept_idx]
+            newest = kept_idx[np.append(kept_codes[1:] != kept_codes[:-1], True)] if len(kept_idx) else kept_idx
+            for i in newest:
+                name = names[code[i]]
+                state = self._last.get(name)
+                if state is None or t[i] >= state[2]:
+                    self._last[name] = [lat[i], lon[i], t[i], 0]
+            # Consecutive drops since the last accepted point, kept for the next batch
+            for c, count in counts.items():
+                state = self._last.get(names[c]) or anchor_states.get(c)
+                if state is not None:
+                    state[3] = count
+                    self._last[names[c]] = state
+            self.accepted += int(accepted.sum())
+            self.rejected += int(n - accepted.sum())
+        return accepted
+
+    def _drop_jumps(self, code, lat, lon, t, pinned):
+        alive = np.ones(len(code), dtype=bool)
+        while True:
+            idx = np.flatnonzero(alive)
+            c = code[idx]
+            same = c[1:] == c[:-1]
+            distance = haversine_m(lat[idx[:-1]], lon[idx[:-1]], lat[idx[1:]], lon[idx[1:]])
+            dt = np.maximum(t[idx[1:]] - t[idx[:-1]], 1.0)
+            fast = same & (distance > self.min_jump_m) & (distance / dt > self.max_speed_mps)
+            fast_in = np.concatenate([[False], fast])
+            fast_out = np.concatenate([fast | ~same, [True]])
+            candidate = fast_in & fast_out & ~pinned[idx]
+            # A point right after another candidate is judged again once that one is gone
+            reject = candidate & ~np.concatenate([[False], candidate[:-1]])
+            if not reject.any():
+                return alive
+            alive[idx[reject]] = False
+
+    def _count_rejections(self, code, alive, is_anchor, rejections):
+        """
+        Walk the devices with dropped points in time order, counting
+        consecutive drops on from their stored count. Returns ({code: count at
+        the end of the batch}, [first point of each device that reaches
+        max_rejections]).
+        """
+        counts = {}
+        reanchored = []
+        for c in np.unique(code[~alive]).tolist():
+            count = int(rejections[c])
+            for i in np.flatnonzero((code == c) & ~is_anchor).tolist():
+                if alive[i]:
+                    count = 0
+                elif count + 1 < self.max_rejections:
+                    count += 1
+                else:
+                    reanchored.append(i)
+                    break
+            counts[c] = count
+        return counts, reanchored
+
+    def forget(self, serial_number):
+        with self._lock:
+            self._last.pop(serial_number, None)
@@ -0,0 +1,469 @@
+"""
+Host-wide shared-memory table of the latest position per device.
+
+One POSIX shared-memory segment per gunicorn master holds a fixed array of
+slots indexed by Device.id, so every worker on the host maps the same
+table and a map poll is answered without a database round trip. Each slot
+carries the position, last_seen, presence and the handful of device fields
+the map endpoints return. Fields are stored column by column, so a listing
+scans contiguous memory, and only up to the highest slot ever used.
+
+Writers (ingest and any committed Device change) update a slot under a
+seqlock: the slot's sequence number is made odd, the fields are written,
+then it is made even again. Readers never lock. They copy the fields
+between two reads of the sequence number and retry slots that changed
+underneath them or were mid-write. Writers exclude each other with a
+striped lock: a threading lock within the worker plus an fcntl byte-range
+lock on a lock file across workers. Position fields only move forward in
+time, so a late write carrying an older last_seen keeps the newer
+position.
+
+The store is per host. Only enable it where every writer of the database
+runs on the same host (one box, or one instance of the app); otherwise
+positions ingested elsewhere never reach it.
+"""
+import fcntl
+import glob
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_VERSION = 2
+MAGIC = 0x504F53_53544F5245  # "POSSTORE"
+EMPTY, LOADING, READY = 0, 1, 2
+ONLINE, TRUNCATED = 1, 2
+NO_TIME = np.iinfo(np.int64).min
+EPOCH = datetime(1970, 1, 1)
+LOCK_STRIPES = 64
+BOOTSTRAP_LOCK = LOCK_STRIPES  # byte offsets in the lock file
+HEADER_LOCK = LOCK_STRIPES + 1
+
+# generation changes whenever a slot gains, loses or changes its device (serial or owner)
+HEADER = np.dtype([("magic", "<u8"), ("version", "<u4"), ("capacity", "<u4"),
+                   ("state", "<u4"), ("complete", "<u4"), ("loaded_at", "<f8"),
+                   ("generation", "<u8"), ("high_water", "<u4")])
+HEADER_BYTES = 64
+
+TEXT_FIELDS = (("serial_number", 100), ("name", 100), ("make", 32), ("model", 32),
+               ("device_type", 32), ("current_status", 32), ("current_location", 100))
+SLOT = np.dtype([("seq", "<u8"), ("seen_us", "<i8"), ("latitude", "<f8"), ("longitude", "<f8"),
+                 ("user_id", "<i8"), ("flags", "u1")]
+                + [(name, f"S{width}") for name, width in TEXT_FIELDS])
+TEXT_WIDTHS = dict(TEXT_FIELDS)
+
+
+def _layout(capacity):
+    """{field: byte offset} of each column (64-byte aligned) and the segment size."""
+    offsets, offset = {}, HEADER_BYTES
+    for field in SLOT.names:
+        offsets[field] = offset
+        offset += -(-SLOT[field].itemsize * capacity // 64) * 64
+    return offsets, offset
+
+
+def to_micros(value):
+    """Naive-UTC (or aware) datetime -> int64 microseconds since the epoch; None -> NO_TIME."""
+    if value is None:
+        return NO_TIME
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value):
+    value = int(value)
+    return None if value == NO_TIME else EPOCH + timedelta(microseconds=value)
+
+
+def _float(value):
+    return float("nan") if value is None else value
+
+
+def _optional(value):
+    value = float(value)
+    return None if value != value else value
+
+
+def segment_name(key):
+    """Shared by the workers of one master (their parent pid); `key` separates apps on a host."""
+    return f"tracking-positions-{os.getppid()}-{key}"
+
+
+def _unlink_orphans(key):
+    # Segments of masters that are gone, left over in /dev/shm by earlier deploys
+    for path in glob.glob(f"/dev/shm/tracking-positions-*-{key}"):
+        try:
+            pid = int(os.path.basename(path).split("-")[2])
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            try:
+                os.unlink(path)
+                lock_path = os.path.join(tempfile.gettempdir(), os.path.basename(path) + ".lock")
+                if os.path.exists(lock_path):
+                    os.unlink(lock_path)
+            except OSError:
+                pass
+        except (ValueError, PermissionError):
+            continue
+
+
+class PositionStore:
+    def __init__(self, key, capacity=65536, name=None):
+        self.key = key
+        self.capacity = capacity
+        self.name = name
+        self._pid = None
+        self._attach_lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._header_lock = threading.Lock()
+        # Per-worker serial -> slot index, rebuilt when the segment's generation moves
+        self._serials = {}
+        self._index_generation = None
+        self.hits = 0
+        self.fallbacks = 0
+
+    # -- mapping ------------------------------------------------------------
+    def _attach(self):
+        if self._pid == os.getpid():
+            return
+        with self._attach_lock:
+            if self._pid == os.getpid():
+                return
+            name = self.name or segment_name(self.key)
+            offsets, size = _layout(self.capacity)
+            try:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+                _unlink_orphans(self.key)
+            except FileExistsError:
+                shm = shared_memory.SharedMemory(name=name)
+            # Workers come and go; the segment must outlive whichever one created it
+            resource_tracker.unregister(shm._name, "shared_memory")
+            header = np.ndarray((1,), HEADER, buffer=shm.buf)
+            if header["magic"][0] == 0:
+                header["version"][0], header["capacity"][0] = LAYOUT_VERSION, self.capacity
+                header["magic"][0] = MAGIC
+            if header["version"][0] != LAYOUT_VERSION or header["capacity"][0] != self.capacity:
+                raise RuntimeError(f"Shared segment {name} has another layout; use a new POSITION_STORE_NAME")
+            self._shm = shm
+            self._header = header
+            self._cols = {field: np.ndarray((self.capacity,), SLOT[field], buffer=shm.buf, offset=offset)
+                          for field, offset in offsets.items()}
+            self._lock_fd = os.open(os.path.join(tempfile.gettempdir(), name + ".lock"), os.O_RDWR | os.O_CREAT,
+                                    0o600)
+            self._pid = os.getpid()
+
+    def _locked(self, slot):
+        return _StripeLock(self, slot % LOCK_STRIPES)
+
+    @property
+    def ready(self):
+        self._attach()
+        return self._header["state"][0] == READY
+
+    @property
+    def complete(self):
+        return self.ready and bool(self._header["complete"][0])
+
+    def bootstrap(self, load):
+        """Fill the table from load() -> iterable of device dicts, once per segment (one worker does it)."""
+        self._attach()
+        if self._header["state"][0] == READY:
+            return
+        try:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, BOOTSTRAP_LOCK)
+        except OSError:
+            return  # another worker is loading
+        try:
+            if self._header["state"][0] == READY:
+                return
+            self._header["state"][0] = LOADING
+            self._header["complete"][0] = 1
+            started = time.monotonic()
+            count = 0
+            for device in load():
+                self.put(device)
+                count += 1
+            self._header["loaded_at"][0] = time.time()
+            self._header["state"][0] = READY
+            logger.info("Position store loaded %d devices in %.2fs", count, time.monotonic() - started)
+        except BaseException:
+            self._header["state"][0] = EMPTY  # let a later bootstrap() try again
+            raise
+        finally:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, BOOTSTRAP_LOCK)
+
+    # -- writes -------------------------------------------------------------
+    def _slot(self, device_id):
+        if device_id is None or not 0 < device_id < self.capacity:
+            if device_id is not None:
+                # A device that does not fit makes every full listing incomplete
+                self._header["complete"][0] = 0
+            return None
+        return device_id
+
+    def put(self, device):
+        """Write a whole device (dict with Device column names); positions never move back in time."""
+        self._attach()
+        slot = self._slot(device["id"])
+        if slot is None:
+            return
+        flags = ONLINE if device.get("presence") == "online" else 0
+        texts = {}
+        for field, width in TEXT_FIELDS:
+            encoded = (device.get(field) or "").encode()
+            if len(encoded) > width:
+                flags |= TRUNCATED
+            texts[field] = encoded[:width]
+        seen = to_micros(device.get("last_seen"))
+        cols = self._cols
+        with self._locked(slot):
+            moved = (cols["user_id"][slot] != device["user_id"]
+                     or cols["serial_number"][slot] != texts["serial_number"])
+            newer = seen >= cols["seen_us"][slot] or cols["user_id"][slot] != device["user_id"]
+            seq = int(cols["seq"][slot])
+            cols["seq"][slot] = seq + 1
+            if newer:
+                cols["seen_us"][slot] = seen
+                cols["latitude"][slot] = _float(device.get("latitude"))
+                cols["longitude"][slot] = _float(device.get("longitude"))
+            else:
+                flags = (flags & ~ONLINE) | (int(cols["flags"][slot]) & ONLINE)
+            cols["user_id"][slot] = device["user_id"]
+            cols["flags"][slot] = flags
+            for field, value in texts.items():
+                cols[field][slot] = value
+            cols["seq"][slot] = seq + 2
+        if moved:
+            self._moved(slot)
+
+    def _moved(self, slot):
+        # After the slot is written, so a reader that sees the new generation also sees the slot
+        with self._header_lock:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, HEADER_LOCK)
+            try:
+                header = self._header
+                header["high_water"][0] = max(int(header["high_water"][0]), slot + 1)
+                header["generation"][0] += 1
+            finally:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, HEADER_LOCK)
+
+    def update(self, device_id, **fields):
+        """
+        Partial update of an existing slot: latitude/longitude/last_seen (ignored
+        if older than the stored last_seen), online (bool) and text fields.
+        """
+        self._attach()
+        slot = self._slot(device_id)
+        if slot is None:
+            return
+        cols = self._cols
+        with self._locked(slot):
+            if cols["user_id"][slot] == 0:
+                return
+            seq = int(cols["seq"][slot])
+            cols["seq"][slot] = seq + 1
+            if "last_seen" in fields:
+                seen = to_micros(fields["last_seen"])
+                if seen >= cols["seen_us"][slot]:
+                    cols["seen_us"][slot] = seen
+                    if "latitude" in fields:
+                        cols["latitude"][slot] = _float(fields["latitude"])
+                        cols["longitude"][slot] = _float(fields["longitude"])
+            if "online" in fields:
+                cols["flags"][slot] = (int(cols["flags"][slot]) & ~ONLINE) | (ONLINE if fields["online"] else 0)
+            for field in TEXT_WIDTHS:
+                if fields.get(field) is not None:
+                    self._write_text(slot, field, fields[field])
+            cols["seq"][slot] = seq + 2
+
+    def label(self, serial_number, seen, current_location):
+        """Set a device's current_location, unless its stored position is newer than `seen`."""
+        self._attach()
+        cols = self._cols
+        encoded = serial_number.encode()
+        slot = self._find(encoded)
+        if slot is not None:
+            with self._locked(slot):
+                if cols["serial_number"][slot] != encoded or cols["seen_us"][slot] > to_micros(seen):
+                    return
+                seq = int(cols["seq"][slot])
+                cols["seq"][slot] = seq + 1
+                self._write_text(slot, "current_location", current_location)
+                cols["seq"][slot] = seq + 2
+
+    def _write_text(self, slot, field, value):
+        # Caller holds the slot's lock and has made its sequence odd
+        encoded = value.encode()
+        if len(encoded) > TEXT_WIDTHS[field]:
+            self._cols["flags"][slot] |= TRUNCATED
+        self._cols[field][slot] = encoded[:TEXT_WIDTHS[field]]
+
+    def remove(self, device_id):
+        self._attach()
+        slot = self._slot(device_id)
+        if slot is None:
+            return
+        cols = self._cols
+        with self._locked(slot):
+            if cols["user_id"][slot] == 0:
+                return
+            seq = int(cols["seq"][slot])
+            cols["seq"][slot] = seq + 1
+            cols["user_id"][slot] = 0
+            cols["flags"][slot] = 0
+            cols["seen_us"][slot] = NO_TIME
+            cols["latitude"][slot] = cols["longitude"][slot] = float("nan")
+            for field in TEXT_WIDTHS:
+                cols[field][slot] = b""
+            cols["seq"][slot] = seq + 2
+        self._moved(slot)
+
+    # -- reads --------------------------------------------------------------
+    def _read(self, slots, fields):
+        """Consistent copies of `fields` for `slots` (int array); torn slots are re-read."""
+        seq = self._cols["seq"]
+        columns = None
+        pending = np.arange(len(slots))
+        for _ in range(1000):
+            index = slots[pending]
+            before = seq[index]
+            part = {field: self._cols[field][index] for field in fields}
+            torn = (before != seq[index]) | (before & 1 == 1)
+            if columns is None:
+                columns = part
+            else:
+                for field in fields:
+                    columns[field][pending] = part[field]
+            if not torn.any():
+                return columns
+            pending = pending[torn]
+            time.sleep(0)
+        raise RuntimeError("Position store slots kept changing while being read")
+
+    def _occupied(self, column=None, test=None):
+        """Slots holding a device (and, given a column, where test(column) is true)."""
+        end = int(self._header["high_water"][0])
+        occupied = self._cols["user_id"][:end] != 0
+        if column is not None:
+            occupied &= test(self._cols[column][:end])
+        return np.flatnonzero(occupied)
+
+    def _find(self, encoded):
+        """Slot currently holding serial `encoded`, or None."""
+        slot = self._serials.get(encoded)
+        if slot is not None and self._cols["serial_number"][slot] == encoded and self._cols["user_id"][slot]:
+            return slot
+        generation = int(self._header["generation"][0])
+        if generation == self._index_generation:
+            return None
+        # Read the generation first: a change during the scan leaves the index stale and it is rebuilt again
+        slots = self._occupied()
+        self._serials = dict(zip(self._cols["serial_number"][slots].tolist(), slots.tolist()))
+        self._index_generation = generation
+        slot = self._serials.get(encoded)
+        return slot if slot is not None and self._cols["serial_number"][slot] == encoded else None
+
+    def locations(self, chunk=1000):
+        """
+        Yield lists of (serial_number, latitude, longitude, last_seen) for every
+        located device in id order, or return None if the table can't answer.
+        """
+        if not self.complete:
+            self.fallbacks += 1
+            return None
+        slots = self._occupied("latitude", lambda latitude: ~np.isnan(latitude))
+        columns = self._read(slots, ("serial_number", "latitude", "longitude", "seen_us", "flags"))
+        if (columns["flags"] & TRUNCATED).any():
+            self.fallbacks += 1
+            return None
+        self.hits += 1
+        return self._chunks(columns, chunk)
+
+    def _chunks(self, columns, chunk):
+        located = ~np.isnan(columns["latitude"]) & ~np.isnan(columns["longitude"])
+        serials = columns["serial_number"][located].tolist()
+        latitudes, longitudes = columns["latitude"][located].tolist(), columns["longitude"][located].tolist()
+        seen = columns["seen_us"][located].tolist()
+        for start in range(0, len(serials), chunk):
+            yield [(serials[i].decode(), latitudes[i], longitudes[i], from_micros(seen[i]))
+                   for i in range(start, min(start + chunk, len(serials)))]
+
+    def user_devices(self, user_id):
+        """[(id, name, serial_number, latitude, longitude, last_seen, status)] for a user, or None."""
+        if not self.complete:
+            self.fallbacks += 1
+            return None
+        slots = self._occupied("user_id", lambda owner: owner == user_id)
+        columns = self._read(slots, ("user_id", "name", "serial_number", "latitude", "longitude", "seen_us",
+                                     "flags"))
+        keep = columns["user_id"] == user_id
+        if (columns["flags"][keep] & TRUNCATED).any():
+            self.fallbacks += 1
+            return None
+        self.hits += 1
+        return [(slot, name.decode(), serial.decode(), _optional(lat), _optional(lon), from_micros(seen),
+                 "online" if flags & ONLINE else "offline")
+                for slot, name, serial, lat, lon, seen, flags in zip(
+                    *(values[keep].tolist() for values in (
+                        slots, columns["name"], columns["serial_number"], columns["latitude"],
+                        columns["longitude"], columns["seen_us"], columns["flags"])))]
+
+    def device(self, serial_number):
+        """
+        (found, fields) for one device by serial. found is None if the table
+        can't answer (not loaded, or the serial/fields don't fit its widths).
+        """
+        if not self.complete:
+            self.fallbacks += 1
+            return None, None
+        encoded = serial_number.encode()
+        if len(encoded) > TEXT_WIDTHS["serial_number"]:
+            self.fallbacks += 1
+            return None, None
+        slot = self._find(encoded)
+        if slot is None:
+            self.hits += 1
+            return False, None
+        fields = ("user_id", "flags", "latitude", "longitude", "seen_us") + tuple(TEXT_WIDTHS)
+        columns = self._read(np.array([slot]), fields)
+        if columns["flags"][0] & TRUNCATED or columns["serial_number"][0] != encoded:
+            self.fallbacks += 1
+            return None, None
+        self.hits += 1
+        device = {field: columns[field][0].decode() for field in TEXT_WIDTHS}
+        device.update(id=slot, user_id=int(columns["user_id"][0]),
+                      latitude=_optional(columns["latitude"][0]), longitude=_optional(columns["longitude"][0]),
+                      last_seen=from_micros(columns["seen_us"][0]),
+                      presence="online" if columns["flags"][0] & ONLINE else "offline")
+        return True, device
+
+    def stats(self):
+        self._attach()
+        return {"state": ("empty", "loading", "ready")[int(self._header["state"][0])],
+                "complete": bool(self._header["complete"][0]), "capacity": self.capacity,
+                "devices": len(self._occupied()), "hits": self.hits,
+                "fallbacks": self.fallbacks}
+
+
+class _StripeLock:
+    """Excludes writers of one stripe: threads of this worker, then other workers."""
+
+    def __init__(self, store, stripe):
+        self.store = store
+        self.stripe = stripe
+
+    def __enter__(self):
+        self.store._stripes[self.stripe].acquire()
+        fcntl.lockf(self.store._lock_fd, fcntl.LOCK_EX, 1, self.stripe)
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self.store._lock_fd, fcntl.LOCK_UN, 1, self.stripe)
+        self.store._stripes[self.stripe].release()
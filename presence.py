@@ -0,0 +1,194 @@
+"""
+Device presence (online/offline) driven by a hierarchical timing wheel.
+
+Every heartbeat (re)schedules the device's offline deadline in the wheel, an
+O(1) set move. A sweeper advances the wheel once per tick and only touches
+devices whose deadline actually expired, so a sweep costs O(transitions)
+rather than O(fleet). Expired devices are confirmed against the database
+(another worker may have seen a newer heartbeat) before an offline
+transition is persisted and emitted.
+
+Optional "offline for > X" alerts are scheduled in the same wheel when a
+device goes offline. They are confirmed against the database too, since the
+device may have come back through a worker that never saw the alert.
+"""
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel with `levels` wheels of 2**bits slots each.
+
+    Keys are scheduled at absolute deadlines (seconds); advance(now) returns
+    the keys whose deadline has passed. A key is stored in the lowest level
+    whose range still covers its deadline and cascades down as time passes.
+    """
+
+    def __init__(self, tick=1.0, bits=6, levels=4, now=None):
+        self.tick = tick
+        self.bits = bits
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.levels = levels
+        self.current = int((now if now is not None else time.time()) // tick)
+        self.wheels = [[set() for _ in range(self.size)] for _ in range(levels)]
+        self.where = {}  # key -> (level, slot, deadline tick)
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    def _place(self, key, deadline):
+        level = 0
+        while level < self.levels - 1 and (deadline >> (self.bits * (level + 1))) != (
+                self.current >> (self.bits * (level + 1))):
+            level += 1
+        slot = (deadline >> (self.bits * level)) & self.mask
+        self.wheels[level][slot].add(key)
+        self.where[key] = (level, slot, deadline)
+
+    def schedule(self, key, when):
+        """(Re)schedule key to expire at epoch seconds `when`."""
+        self.cancel(key)
+        deadline = max(int(math.ceil(when / self.tick)), self.current + 1)
+        self._place(key, deadline)
+
+    def cancel(self, key):
+        position = self.where.pop(key, None)
+        if position is not None:
+            self.wheels[position[0]][position[1]].discard(key)
+
+    def _cascade(self, level):
+        slot = (self.current >> (self.bits * level)) & self.mask
+        keys = self.wheels[level][slot]
+        self.wheels[level][slot] = set()
+        for key in keys:
+            deadline = self.where[key][2]
+            self._place(key, deadline)
+
+    def advance(self, now):
+        """Move time forward to `now` and return the expired keys."""
+        target = int(now // self.tick)
+        expired = []
+        while self.current < target:
+            if not self.where:
+                self.current = target
+                break
+            self.current += 1
+            # Entering a new lap of a lower wheel pulls the matching higher slot down
+            for level in range(self.levels - 1, 0, -1):
+                if self.current & ((1 << (self.bits * level)) - 1) == 0:
+                    self._cascade(level)
+            slot = self.current & self.mask
+            keys = self.wheels[0][slot]
+            if keys:
+                self.wheels[0][slot] = set()
+                for key in keys:
+                    if self.where[key][2] <= self.current:
+                        del self.where[key]
+                        expired.append(key)
+                    else:
+                        self._place(key, self.where[key][2])
+        return expired
+
+
+class PresenceTracker:
+    """
+    Tracks online devices in a TimingWheel.
+
+    `confirm_offline(serials, cutoff)` must persist offline status for the
+    serials whose last heartbeat is older than cutoff and return those it
+    actually changed; `confirm_alert(serials, cutoff)` returns the serials
+    still offline since at or before cutoff (without it every due alert is
+    emitted). Listeners receive (event, serial_number, at).
+    """
+
+    def __init__(self, confirm_offline, timeout=None, alert_after=None, tick=1.0, confirm_alert=None):
+        self.timeout = timeout or float(os.environ.get("PRESENCE_TIMEOUT_SECONDS", 300))
+        alert_after = alert_after if alert_after is not None else os.environ.get("OFFLINE_ALERT_SECONDS")
+        self.alert_after = float(alert_after) if alert_after else None
+        self.confirm_offline = confirm_offline
+        self.confirm_alert = confirm_alert
+        self.wheel = TimingWheel(tick=tick)
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._pid = None
+        self.transitions = {"online": 0, "offline": 0, "offline_alert": 0}
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def emit(self, event, serial_number, at=None):
+        self.transitions[event] = self.transitions.get(event, 0) + 1
+        at = at or time.time()
+        for listener in self.listeners:
+            try:
+                listener(event, serial_number, at)
+            except Exception:
+                logger.exception("Presence listener failed for %s %s", event, serial_number)
+
+    def heartbeat(self, serial_number, now=None):
+        """Push the device's offline deadline out by `timeout` seconds."""
+        now = now or time.time()
+        with self._lock:
+            self.wheel.cancel(("alert", serial_number))
+            self.wheel.schedule(("offline", serial_number), now + self.timeout)
+
+    def track(self, serial_number, last_seen):
+        """Schedule a device already known to be online (startup bootstrap)."""
+        with self._lock:
+            self.wheel.schedule(("offline", serial_number), last_seen + self.timeout)
+
+    def sweep(self, now=None):
+        """Expire due deadlines; returns the serials that went offline."""
+        now = now or time.time()
+        with self._lock:
+            expired = self.wheel.advance(now)
+        offline = [serial for kind, serial in expired if kind == "offline"]
+        alerts = [serial for kind, serial in expired if kind == "alert"]
+        went_offline = []
+        if offline:
+            went_offline = list(self.confirm_offline(offline, now - self.timeout))
+            with self._lock:
+                for serial in went_offline:
+                    if self.alert_after:
+                        self.wheel.schedule(("alert", serial), now + self.alert_after)
+            for serial in went_offline:
+                self.emit("offline", serial, now)
+        if alerts and self.confirm_alert is not None:
+            alerts = list(self.confirm_alert(alerts, now - self.alert_after))
+        for serial in alerts:
+            self.emit("offline_alert", serial, now)
+        return went_offline
+
+    def start(self, bootstrap=None, interval=1.0):
+        """Start the sweeper thread once per process; `bootstrap` seeds online devices."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        def loop():
+            if bootstrap is not None:
+                try:
+                    bootstrap(self)
+                except Exception:
+                    logger.exception("Presence bootstrap failed")
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception:
+                    logger.exception("Presence sweep failed")
+
+        threading.Thread(target=loop, name="presence-sweeper", daemon=True).start()
@@ -0,0 +1,120 @@
+"""
+Per-request SQL instrumentation through SQLAlchemy cursor events.
+
+While a request is being profiled every statement executed on the engine
+is counted and timed. At the end of the request:
+
+  * statements executed N_PLUS_ONE_THRESHOLD or more times with the same
+    SQL text are reported as likely N+1 patterns
+  * statements slower than SLOW_QUERY_MS are logged with their parameters
+    as they run, followed by the query plan when SLOW_QUERY_EXPLAIN=1
+    (SELECTs only; EXPLAIN on Postgres, EXPLAIN QUERY PLAN on SQLite)
+
+Profiles are kept in a ContextVar, so concurrent requests on gthread
+workers never see each other's statements. Statements executed outside a
+profiled request (background threads) are ignored.
+"""
+import contextvars
+import logging
+import os
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("query_profile", default=None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.statements = {}  # sql -> [count, total seconds]
+        self.slow = []
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+
+    def repeated(self, threshold):
+        """Statements run at least `threshold` times: [(sql, count, seconds)], most frequent first."""
+        return sorted(((sql, n, t) for sql, (n, t) in self.statements.items() if n >= threshold),
+                      key=lambda item: -item[1])
+
+    def breakdown(self, limit=10, width=200):
+        top = sorted(self.statements.items(), key=lambda item: -item[1][1])[:limit]
+        return {
+            "count": self.count,
+            "time_ms": round(self.total_time * 1000, 3),
+            "statements": [{"sql": " ".join(sql.split())[:width], "count": n, "time_ms": round(t * 1000, 3)}
+                           for sql, (n, t) in top],
+        }
+
+
+class QueryProfiler:
+    def __init__(self, slow_ms=None, n_plus_one_threshold=None, explain=None):
+        self.slow_seconds = float(slow_ms if slow_ms is not None else os.environ.get("SLOW_QUERY_MS", 200)) / 1000
+        self.n_plus_one_threshold = int(n_plus_one_threshold if n_plus_one_threshold is not None
+                                        else os.environ.get("N_PLUS_ONE_THRESHOLD", 5))
+        self.explain = explain if explain is not None else os.environ.get("SLOW_QUERY_EXPLAIN") == "1"
+        self._engines = set()
+
+    def attach(self, engine):
+        if id(engine) in self._engines:
+            return
+        self._engines.add(id(engine))
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def start(self):
+        """Begin profiling the current request; returns a token for stop()."""
+        return _current.set(RequestProfile())
+
+    def current(self):
+        return _current.get()
+
+    def stop(self, token):
+        profile = _current.get()
+        _current.reset(token)
+        return profile
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        profile = _current.get()
+        if profile is None:
+            return
+        started = conn.info.get("query_started")
+        if not started:
+            return
+        duration = time.perf_counter() - started.pop()
+        profile.record(statement, duration)
+        if duration >= self.slow_seconds:
+            profile.slow.append((statement, duration))
+            logger.warning("Slow query (%.1f ms): %s | params=%.500r",
+                           duration * 1000, " ".join(statement.split()), parameters)
+            if self.explain and not executemany and statement.lstrip().upper().startswith("SELECT"):
+                self._log_plan(conn, statement, parameters)
+
+    def _log_plan(self, conn, statement, parameters):
+        prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+        try:
+            # Raw DBAPI cursor so the EXPLAIN itself is not instrumented
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                plan = "\n".join(" ".join(str(col) for col in row) for row in cursor.fetchall())
+            finally:
+                cursor.close()
+            logger.warning("Query plan:\n%s", plan)
+        except Exception:
+            logger.exception("Could not EXPLAIN slow query")
@@ -0,0 +1,271 @@
+"""
+Token-bucket rate limiting for location ingestion.
+
+Two buckets are charged for every point: one per device serial and one per
+owning user, both sized by the owner's plan (RATE_LIMITS below, overridable
+with RATE_LIMIT_<SCOPE>_<PLAN>="rate/s,burst", e.g.
+RATE_LIMIT_DEVICE_FREE="0.5,10"). The owner and plan of a serial come from
+an in-memory PlanLookup, so a limited request is rejected without touching
+the database.
+
+A batch costs one token per point. More points for one serial than its
+device or user burst could never be charged, so too_large() reports such a
+batch for the caller to reject outright. A request is charged all or
+nothing; if any bucket rejects it, the buckets already charged for it are
+refunded.
+
+Buckets live in process memory by default, so each gunicorn worker enforces
+the limits on its own. With RATE_LIMIT_REDIS_URL set (and the redis package
+installed) they live in Redis and an atomic Lua script refills and charges
+them, so the limits hold across workers and instances.
+"""
+import logging
+import math
+import os
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # optional: only needed for a shared backend
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# (tokens per second, burst) per scope and plan
+RATE_LIMITS = {
+    "device": {"free": (1.0, 10), "basic": (2.0, 30), "pro": (5.0, 60)},
+    "user": {"free": (5.0, 50), "basic": (20.0, 200), "pro": (100.0, 1000)},
+}
+
+
+def load_limits():
+    limits = {scope: dict(plans) for scope, plans in RATE_LIMITS.items()}
+    for scope, plans in limits.items():
+        for plan in plans:
+            value = os.environ.get(f"RATE_LIMIT_{scope.upper()}_{plan.upper()}")
+            if not value:
+                continue
+            try:
+                rate, burst = value.split(",")
+                plans[plan] = (float(rate), float(burst))
+            except ValueError:
+                logger.warning("Ignoring malformed RATE_LIMIT_%s_%s=%r", scope.upper(), plan.upper(), value)
+    return limits
+
+
+class MemoryBuckets:
+    """Per-process buckets: key -> [tokens, last refill time]."""
+
+    def __init__(self, sweep_every=10000):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.sweep_every = sweep_every
+
+    def take(self, key, rate, burst, cost=1, now=None):
+        """Charge `cost` tokens; returns (allowed, seconds until it would be allowed if cost <= burst)."""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            self._calls += 1
+            if self._calls % self.sweep_every == 0:
+                self._sweep(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return True, 0.0
+            bucket[0] = tokens
+            return False, (cost - tokens) / rate
+
+    def refund(self, key, burst, cost=1):
+        """Give back tokens taken for a request that was rejected elsewhere."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(burst, bucket[0] + cost)
+
+    def _sweep(self, now):
+        # A bucket idle long enough to be full again is the same as no bucket
+        idle = [key for key, (tokens, last) in self._buckets.items() if now - last > 3600]
+        for key in idle:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisBuckets:
+    """Buckets shared through Redis; refill and charge run atomically in Lua."""
+
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  retry = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(retry)}
+"""
+
+    REFUND_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+  redis.call('HSET', KEYS[1], 'tokens', math.min(burst, tokens + tonumber(ARGV[2])))
+end
+return 1
+"""
+
+    def __init__(self, url, prefix="ratelimit:"):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+        self._refund = self.client.register_script(self.REFUND_SCRIPT)
+
+    def take(self, key, rate, burst, cost=1, now=None):
+        allowed, retry = self._script(keys=[self.prefix + key],
+                                      args=[rate, burst, now if now is not None else time.time(), cost])
+        return bool(allowed), float(retry)
+
+    def refund(self, key, burst, cost=1):
+        self._refund(keys=[self.prefix + key], args=[burst, cost])
+
+
+class PlanLookup:
+    """serial -> (user_id, plan) cached for `ttl` seconds; unknown serials are cached too."""
+
+    def __init__(self, load, ttl=None, maxsize=100000):
+        self.load = load
+        self.ttl = ttl if ttl is not None else float(os.environ.get("RATE_LIMIT_PLAN_TTL_SECONDS", 300))
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, serial_number):
+        now = time.monotonic()
+        entry = self._entries.get(serial_number)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        owner = self.load(serial_number)
+        with self._lock:
+            if len(self._entries) >= self.maxsize:
+                # Junk serials must not grow this without bound; start over
+                self._entries.clear()
+            self._entries[serial_number] = (now + self.ttl, owner)
+        return owner
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for serial_number in [s for s, (_, owner) in self._entries.items() if owner and owner[0] == user_id]:
+                del self._entries[serial_number]
+
+
+class IngestRateLimiter:
+    def __init__(self, plan_lookup, backend=None, limits=None, enabled=True):
+        self.plan_lookup = plan_lookup
+        self.backend = backend or MemoryBuckets()
+        self.limits = limits or load_limits()
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def _count(self, scope, plan, outcome, n=1):
+        key = f"{scope}.{plan}.{outcome}"
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def _scopes(self, serial_number):
+        owner = self.plan_lookup.get(serial_number)
+        user_id, plan = owner if owner else (None, "free")
+        scopes = [("device", serial_number)] + ([("user", user_id)] if user_id is not None else [])
+        return plan, scopes
+
+    def too_large(self, serial_counts):
+        """(serial_number, burst) for the first serial with more points than a bucket can ever hold, else None."""
+        if not self.enabled:
+            return None
+        for serial_number, cost in serial_counts.items():
+            if not serial_number:
+                continue
+            plan, scopes = self._scopes(serial_number)
+            burst = min((self.limits[scope].get(plan) or self.limits[scope]["free"])[1] for scope, _ in scopes)
+            if cost > burst:
+                return serial_number, int(burst)
+        return None
+
+    def _take(self, scope, key, plan, cost):
+        """Returns (allowed, retry_after, charged); charged is False when the backend failed open."""
+        rate, burst = self.limits[scope].get(plan) or self.limits[scope]["free"]
+        try:
+            allowed, retry_after = self.backend.take(f"{scope}:{key}", rate, burst, cost)
+        except Exception:
+            # A broken shared backend must not take ingestion down with it
+            logger.exception("Rate limit backend failed; allowing request")
+            self._count(scope, plan, "backend_error", cost)
+            return True, 0.0, False
+        return allowed, retry_after, allowed
+
+    def _refund(self, charges):
+        for scope, key, plan, cost in charges:
+            _, burst = self.limits[scope].get(plan) or self.limits[scope]["free"]
+            try:
+                self.backend.refund(f"{scope}:{key}", burst, cost)
+            except Exception:
+                logger.exception("Rate limit refund failed")
+
+    def check(self, serial_counts):
+        """
+        Charge {serial_number: points}; returns seconds to wait (Retry-After)
+        if any bucket is exhausted, otherwise None. A rejected request is not
+        charged anywhere.
+        """
+        if not self.enabled:
+            return None
+        charges = []
+        for serial_number, cost in serial_counts.items():
+            if not serial_number:
+                continue
+            plan, scopes = self._scopes(serial_number)
+            for scope, key in scopes:
+                allowed, retry_after, charged = self._take(scope, key, plan, cost)
+                if not allowed:
+                    self._refund(charges)
+                    self._count(scope, plan, "limited", cost)
+                    return max(1, math.ceil(retry_after))
+                if charged:
+                    charges.append((scope, key, plan, cost))
+        for scope, _, plan, cost in charges:
+            self._count(scope, plan, "allowed", cost)
+        return None
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {"backend": type(self.backend).__name__, "enabled": self.enabled,
+                "limits": self.limits, "counters": counters}
+
+
+def backend_from_env():
+    url = os.environ.get("RATE_LIMIT_REDIS_URL")
+    if not url:
+        return MemoryBuckets()
+    if redis is None:
+        logger.warning("RATE_LIMIT_REDIS_URL is set but redis is not installed; using per-process buckets")
+        return MemoryBuckets()
+    return RedisBuckets(url)
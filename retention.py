@@ -0,0 +1,234 @@
+"""
+Retention and rollup compaction for DeviceLocationHistory.
+
+Full-resolution points are kept for a per-plan window. Older points are
+folded into one DeviceLocationRollup row per device per interval (first,
+last and centroid position) and then deleted. Work is done in small batches,
+each in its own short transaction, so the hot history table is never locked
+for long.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Days of full-resolution history kept for each User.plan
+DEFAULT_RETENTION_DAYS = {"free": 7, "basic": 30, "pro": 180}
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def retention_days_for(plan):
+    """Return the raw-history window in days for a plan (unknown plans count as free)."""
+    plan = plan if plan in DEFAULT_RETENTION_DAYS else "free"
+    return _env_int(f"RETENTION_DAYS_{plan.upper()}", DEFAULT_RETENTION_DAYS[plan])
+
+
+def _naive_utc(value):
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bucket_start(timestamp, bucket_minutes):
+    """Floor a timestamp to the start of its rollup interval."""
+    timestamp = _naive_utc(timestamp)
+    seconds = bucket_minutes * 60
+    epoch = datetime(1970, 1, 1)
+    offset = int((timestamp - epoch).total_seconds()) // seconds * seconds
+    return epoch + timedelta(seconds=offset)
+
+
+def rollup_points(points, bucket_minutes):
+    """
+    Aggregate (latitude, longitude, timestamp) tuples, sorted by timestamp,
+    into a dict of bucket_start -> aggregate dict.
+    """
+    buckets = {}
+    for latitude, longitude, timestamp in points:
+        key = bucket_start(timestamp, bucket_minutes)
+        agg = buckets.get(key)
+        if agg is None:
+            buckets[key] = {
+                "point_count": 1,
+                "first_latitude": latitude, "first_longitude": longitude, "first_timestamp": timestamp,
+                "last_latitude": latitude, "last_longitude": longitude, "last_timestamp": timestamp,
+                "sum_latitude": latitude, "sum_longitude": longitude,
+            }
+        else:
+            agg["point_count"] += 1
+            agg["last_latitude"] = latitude
+            agg["last_longitude"] = longitude
+            agg["last_timestamp"] = timestamp
+            agg["sum_latitude"] += latitude
+            agg["sum_longitude"] += longitude
+    return buckets
+
+
+class RetentionJob:
+    """Rolls up and expires old location history in bounded batches."""
+
+    def __init__(self, db, history_model, rollup_model, device_model, user_model,
+                 batch_size=None, bucket_minutes=None, rollup_days=None, pause=None, analytics=None):
+        self.db = db
+        self.History = history_model
+        self.Rollup = rollup_model
+        self.Device = device_model
+        self.User = user_model
+        self.batch_size = batch_size or _env_int("RETENTION_BATCH_SIZE", 2000)
+        self.bucket_minutes = bucket_minutes or _env_int("RETENTION_ROLLUP_MINUTES", 60)
+        self.rollup_days = rollup_days or _env_int("RETENTION_ROLLUP_DAYS", 365)
+        # Seconds to sleep between batches so ingestion gets the table back
+        self.pause = pause if pause is not None else float(os.environ.get("RETENTION_PAUSE", 0.05))
+        # TripAnalytics whose cached days are dropped when their points are compacted away
+        self.analytics = analytics
+
+    def cutoff_for(self, plan, now=None):
+        """Raw points older than this are rolled up; aligned to a bucket boundary."""
+        now = _naive_utc(now or datetime.now(timezone.utc))
+        return bucket_start(now - timedelta(days=retention_days_for(plan)), self.bucket_minutes)
+
+    def serials_by_plan(self):
+        rows = (self.db.session.query(self.Device.serial_number, self.User.plan)
+                .join(self.User, self.Device.user_id == self.User.id)
+                .all())
+        # History outlives deleted devices; with no owner left it gets the free plan's window
+        orphans = (self.db.session.query(self.History.serial_number).distinct()
+                   .filter(~self.History.serial_number.in_(self.db.session.query(self.Device.serial_number)))
+                   .all())
+        self.db.session.rollback()
+        plans = {}
+        for serial_number, plan in rows:
+            plans.setdefault(plan or "free", []).append(serial_number)
+        plans.setdefault("free", []).extend(serial_number for serial_number, in orphans)
+        return plans
+
+    def run(self, now=None):
+        """Run one full pass; returns counters for logging."""
+        stats = {"rolled_up": 0, "rollups_written": 0, "rollups_expired": 0}
+        for plan, serials in self.serials_by_plan().items():
+            cutoff = self.cutoff_for(plan, now)
+            for serial_number in serials:
+                points, rollups = self.compact_device(serial_number, cutoff)
+                stats["rolled_up"] += points
+                stats["rollups_written"] += rollups
+        stats["rollups_expired"] = self.expire_rollups(now)
+        logger.info("Retention pass finished: %s", stats)
+        return stats
+
+    def compact_device(self, serial_number, cutoff):
+        """Roll up and delete one device's points older than cutoff, batch by batch."""
+        History = self.History
+        total_points = total_rollups = 0
+        while True:
+            rows = (self.db.session.query(History.id, History.latitude, History.longitude, History.timestamp,
+                                          History.is_outlier)
+                    .filter(History.serial_number == serial_number, History.timestamp < cutoff)
+                    .order_by(History.timestamp, History.id)
+                    .limit(self.batch_size)
+                    .all())
+            if not rows:
+                self.db.session.rollback()
+                break
+            try:
+                # Flagged outliers are expired with the rest but kept out of the aggregates
+                buckets = rollup_points([(r.latitude, r.longitude, r.timestamp) for r in rows
+                                         if not r.is_outlier], self.bucket_minutes)
+                for start, agg in buckets.items():
+                    self._merge_rollup(serial_number, start, agg)
+                ids = [r.id for r in rows]
+                self.db.session.query(History).filter(History.id.in_(ids)).delete(synchronize_session=False)
+                if self.analytics is not None:
+                    self.analytics.invalidate({(serial_number, _naive_utc(r.timestamp).date()) for r in rows
+                                               if not r.is_outlier}, self.db.session)
+                self.db.session.commit()
+            except Exception:
+                self.db.session.rollback()
+                raise
+            total_points += len(rows)
+            total_rollups += len(buckets)
+            if len(rows) < self.batch_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        return total_points, total_rollups
+
+    def _merge_rollup(self, serial_number, start, agg):
+        rollup = self.Rollup.query.filter_by(serial_number=serial_number, bucket_start=start).first()
+        count = agg["point_count"]
+        if rollup is None:
+            rollup = self.Rollup(
+                serial_number=serial_number,
+                bucket_start=start,
+                bucket_minutes=self.bucket_minutes,
+                point_count=count,
+                first_latitude=agg["first_latitude"],
+                first_longitude=agg["first_longitude"],
+                first_timestamp=agg["first_timestamp"],
+                last_latitude=agg["last_latitude"],
+                last_longitude=agg["last_longitude"],
+                last_timestamp=agg["last_timestamp"],
+                centroid_latitude=agg["sum_latitude"] / count,
+                centroid_longitude=agg["sum_longitude"] / count,
+            )
+            self.db.session.add(rollup)
+            return
+        # A bucket can span two batches (or two passes); fold the new points in
+        total = rollup.point_count + count
+        rollup.centroid_latitude = (rollup.centroid_latitude * rollup.point_count + agg["sum_latitude"]) / total
+        rollup.centroid_longitude = (rollup.centroid_longitude * rollup.point_count + agg["sum_longitude"]) / total
+        rollup.point_count = total
+        if _naive_utc(agg["first_timestamp"]) < _naive_utc(rollup.first_timestamp):
+            rollup.first_latitude = agg["first_latitude"]
+            rollup.first_longitude = agg["first_longitude"]
+            rollup.first_timestamp = agg["first_timestamp"]
+        if _naive_utc(agg["last_timestamp"]) >= _naive_utc(rollup.last_timestamp):
+            rollup.last_latitude = agg["last_latitude"]
+            rollup.last_longitude = agg["last_longitude"]
+            rollup.last_timestamp = agg["last_timestamp"]
+
+    def expire_rollups(self, now=None):
+        """Delete rollups past RETENTION_ROLLUP_DAYS, in batches."""
+        now = _naive_utc(now or datetime.now(timezone.utc))
+        cutoff = now - timedelta(days=self.rollup_days)
+        Rollup = self.Rollup
+        expired = 0
+        while True:
+            ids = [r.id for r in self.db.session.query(Rollup.id)
+                   .filter(Rollup.bucket_start < cutoff)
+                   .limit(self.batch_size).all()]
+            if not ids:
+                self.db.session.rollback()
+                break
+            self.db.session.query(Rollup).filter(Rollup.id.in_(ids)).delete(synchronize_session=False)
+            self.db.session.commit()
+            expired += len(ids)
+            if self.pause:
+                time.sleep(self.pause)
+        return expired
+
+
+def start_retention_worker(app, job, interval=None):
+    """Run the retention job in a daemon thread every `interval` seconds."""
+    interval = interval or _env_int("RETENTION_INTERVAL_SECONDS", 3600)
+
+    def loop():
+        while True:
+            try:
+                with app.app_context():
+                    job.run()
+            except Exception:
+                logger.exception("Retention pass failed")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="retention-worker", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,174 @@
+"""
+Offline reverse geocoding from a local gazetteer.
+
+Places are loaded once from GAZETTEER_PATH into a k-d tree over unit-sphere
+(x, y, z) vectors, so nearest-place lookups need no network and no special
+handling for the antimeridian. Results are memoised in an LRU cache keyed by
+coordinates rounded to GEOCODER_PRECISION decimals (3 decimals is ~110 m).
+
+Supported gazetteer formats (optionally gzipped):
+  * GeoNames dumps (cities1000.txt, cities5000.txt, ...), tab separated
+  * CSV with a header containing name, latitude, longitude and optionally
+    country / admin1
+"""
+import csv
+import gzip
+import logging
+import math
+import os
+from functools import lru_cache
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LEAF_SIZE = 16
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _unit_vectors(latitudes, longitudes):
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class KDTree:
+    """Implicit 3-D k-d tree; nodes live at the midpoint of their index range."""
+
+    def __init__(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        n = len(points)
+        order = np.arange(n)
+        axes = np.zeros(n, dtype=np.int8)
+        stack = [(0, n)]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            sub = order[lo:hi]
+            axis = int(np.argmax(np.ptp(points[sub], axis=0)))
+            mid = (lo + hi) // 2
+            order[lo:hi] = sub[np.argpartition(points[sub, axis], mid - lo)]
+            axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+        self.order = order
+        # Plain lists: scalar indexing is much faster than on NumPy arrays
+        self._coords = points[order].tolist()
+        self._axes = axes.tolist()
+        self.size = n
+
+    def nearest(self, query):
+        """Return (tree index, squared chord distance) of the nearest point."""
+        coords, axes = self._coords, self._axes
+        qx, qy, qz = query
+        best = [-1, math.inf]
+
+        def scan(lo, hi):
+            for i in range(lo, hi):
+                x, y, z = coords[i]
+                d = (x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2
+                if d < best[1]:
+                    best[0], best[1] = i, d
+
+        def search(lo, hi):
+            if hi - lo <= LEAF_SIZE:
+                scan(lo, hi)
+                return
+            mid = (lo + hi) // 2
+            scan(mid, mid + 1)
+            diff = query[axes[mid]] - coords[mid][axes[mid]]
+            if diff < 0:
+                search(lo, mid)
+                if diff * diff < best[1]:
+                    search(mid + 1, hi)
+            else:
+                search(mid + 1, hi)
+                if diff * diff < best[1]:
+                    search(lo, mid)
+
+        if self.size:
+            search(0, self.size)
+        return best[0], best[1]
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def load_gazetteer(path):
+    """Read a gazetteer file into (labels, latitudes, longitudes)."""
+    labels, lats, lons = [], [], []
+    with _open_text(path) as f:
+        first = f.readline()
+        f.seek(0)
+        if "\t" in first:
+            # GeoNames: 1 name, 4 latitude, 5 longitude, 8 country code
+            for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+                if len(row) > 8:
+                    labels.append(f"{row[1]}, {row[8]}" if row[8] else row[1])
+                    lats.append(float(row[4]))
+                    lons.append(float(row[5]))
+        else:
+            for row in csv.DictReader(f):
+                region = row.get("admin1") or row.get("country")
+                labels.append(f"{row['name']}, {region}" if region else row["name"])
+                lats.append(float(row["latitude"]))
+                lons.append(float(row["longitude"]))
+    return labels, lats, lons
+
+
+class ReverseGeocoder:
+    """Nearest-place lookups over a gazetteer with an LRU cache in front."""
+
+    def __init__(self, labels, latitudes, longitudes, precision=3, cache_size=100000, max_distance_km=50.0):
+        self.tree = KDTree(_unit_vectors(latitudes, longitudes))
+        # Labels in tree order so a lookup is a single list index
+        self.labels = [labels[i] for i in self.tree.order.tolist()]
+        self.precision = precision
+        self.max_distance_km = max_distance_km
+        self._cached = lru_cache(maxsize=cache_size)(self._nearest_label)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        labels, lats, lons = load_gazetteer(path)
+        logger.info("Loaded %d gazetteer places from %s", len(labels), path)
+        return cls(labels, lats, lons, **kwargs)
+
+    def _nearest_label(self, latitude, longitude):
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        query = (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+        index, chord2 = self.tree.nearest(query)
+        if index < 0:
+            return None
+        distance_km = 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(chord2) / 2, 1.0))
+        if distance_km > self.max_distance_km:
+            return None
+        return self.labels[index]
+
+    def lookup(self, latitude, longitude):
+        """Place label nearest to the point, or None if nothing is within range."""
+        if latitude is None or longitude is None:
+            return None
+        return self._cached(round(latitude, self.precision), round(longitude, self.precision))
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+
+def load_from_env():
+    """Build the geocoder from GAZETTEER_PATH, or return None when not configured."""
+    path = os.environ.get("GAZETTEER_PATH")
+    if not path:
+        return None
+    if not os.path.exists(path):
+        logger.warning("GAZETTEER_PATH %s does not exist; reverse geocoding disabled", path)
+        return None
+    return ReverseGeocoder.from_file(
+        path,
+        precision=int(os.environ.get("GEOCODER_PRECISION", 3)),
+        cache_size=int(os.environ.get("GEOCODER_CACHE_SIZE", 100000)),
+        max_distance_km=float(os.environ.get("GEOCODER_MAX_DISTANCE_KM", 50)),
+    )
@@ -1,13 +1,18 @@
+import os
 import requests
 import time
 import random
 
 SERVER_URL = "http://127.0.0.1:5000/api/report_location"
+COMMANDS_URL = "http://127.0.0.1:5000/api/device_commands/"
 SERIAL_NUMBER = "5CG63351S8"
+DEVICE_TOKEN = os.environ.get("DEVICE_TOKEN")
+HEADERS = {"Authorization": f"Bearer {DEVICE_TOKEN}"} if DEVICE_TOKEN else {}
 
 # Starting location (e.g., Nairobi)
 latitude = -1.2833
 longitude = 36.8167
+pending_acks = []
 
 while True:
     # Slightly change location
@@ -19,10 +24,18 @@ while True:
         "latitude": latitude,
         "longitude": longitude
     }
+    if pending_acks:
+        payload["acks"] = pending_acks
 
     try:
-        response = requests.post(SERVER_URL, json=payload)
+        response = requests.post(SERVER_URL, json=payload, headers=HEADERS)
         print(f"[{time.strftime('%H:%M:%S')}] Sent: {payload} | Response: {response.status_code}")
+        if response.ok:
+            # Pretend to run queued commands; acks ride along with the next upload
+            commands = requests.get(COMMANDS_URL + SERIAL_NUMBER, headers=HEADERS).json()
+            for command in commands:
+                print(f"Executing command {command['id']}: {command['type']}")
+            pending_acks = [{"command_id": command["id"], "status": "executed"} for command in commands]
     except Exception as e:
         print(f"Error sending location: {e}")
 
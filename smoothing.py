@@ -0,0 +1,156 @@
+"""
+Constant-velocity Kalman smoothing of device positions.
+
+All filter state lives in a handful of NumPy arrays indexed by a per-device
+slot number (serial -> slot is the only dict), so tens of thousands of
+devices cost a few dozen bytes each and batches are updated in vectorized
+form. Latitude and longitude are filtered as two independent 1-D
+constant-velocity models in degrees; noise terms given in metres are scaled
+to degrees at the device's latitude.
+
+Measurement noise comes from the fix's reported accuracy in metres (GPS is
+typically ~10 m, IP geolocation several km), so IP fixes barely move a track
+that has good GPS behind it.
+"""
+import os
+import threading
+
+import numpy as np
+
+from motion_filter import epoch_seconds
+
+METRES_PER_DEGREE = 111320.0
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def wrap_longitude(degrees):
+    """Longitudes (or longitude differences) into [-180, 180)."""
+    return np.mod(degrees + 180.0, 360.0) - 180.0
+
+
+class KalmanBank:
+    """Array-backed bank of per-device 2-D constant-velocity Kalman filters."""
+
+    def __init__(self, capacity=1024, accel_noise=None, default_accuracy_m=None, reset_seconds=None):
+        # Process noise: expected acceleration in m/s^2
+        self.accel_noise = accel_noise or _env_float("SMOOTHING_ACCEL_NOISE", 1.0)
+        self.default_accuracy_m = default_accuracy_m or _env_float("SMOOTHING_DEFAULT_ACCURACY_M", 50.0)
+        # Gaps longer than this restart the filter at the new fix
+        self.reset_seconds = reset_seconds or _env_float("SMOOTHING_RESET_SECONDS", 3600.0)
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2))   # lat, lon (degrees)
+        self.vel = np.zeros((capacity, 2))   # degrees / second
+        self.p00 = np.zeros((capacity, 2))   # covariance terms per axis
+        self.p01 = np.zeros((capacity, 2))
+        self.p11 = np.zeros((capacity, 2))
+        self.t = np.full(capacity, -np.inf)  # epoch seconds of the last update
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        old = (self.pos, self.vel, self.p00, self.p01, self.p11, self.t)
+        size = self.capacity
+        self._allocate(capacity)
+        for new, prev in zip((self.pos, self.vel, self.p00, self.p01, self.p11, self.t), old):
+            new[:size] = prev
+
+    def _slot_for(self, serial_number):
+        slot = self._slots.get(serial_number)
+        if slot is None:
+            slot = len(self._slots)
+            if slot >= self.capacity:
+                self._grow(slot + 1)
+            self._slots[serial_number] = slot
+        return slot
+
+    def __len__(self):
+        return len(self._slots)
+
+    def update(self, serial_number, latitude, longitude, timestamp, accuracy_m=None):
+        """Feed one fix and return the smoothed (latitude, longitude)."""
+        lat, lon = self.update_many([serial_number], [latitude], [longitude], [timestamp], [accuracy_m])
+        return float(lat[0]), float(lon[0])
+
+    def update_many(self, serials, latitudes, longitudes, timestamps, accuracies=None):
+        """
+        Feed a batch of fixes (any mix of devices) and return arrays of smoothed
+        latitudes and longitudes aligned with the input. Fixes for the same
+        device are applied in time order, one vectorized round per repeat.
+        """
+        n = len(serials)
+        z = np.column_stack([np.asarray(latitudes, dtype=np.float64), np.asarray(longitudes, dtype=np.float64)])
+        t = np.array([epoch_seconds(ts) for ts in timestamps], dtype=np.float64)
+        accuracies = accuracies if accuracies is not None else [None] * n
+        acc = np.array([a if a else self.default_accuracy_m for a in accuracies], dtype=np.float64)
+        out = np.empty((n, 2))
+
+        with self._lock:
+            slots = np.array([self._slot_for(s) for s in serials], dtype=np.int64)
+            order = np.lexsort((t, slots))
+            sorted_slots = slots[order]
+            first = np.ones(n, dtype=bool)
+            first[1:] = sorted_slots[1:] != sorted_slots[:-1]
+            group_start = np.maximum.accumulate(np.where(first, np.arange(n), 0))
+            rank = np.empty(n, dtype=np.int64)
+            rank[order] = np.arange(n) - group_start
+            for r in range(int(rank.max()) + 1 if n else 0):
+                idx = np.flatnonzero(rank == r)
+                out[idx] = self._step(slots[idx], z[idx], t[idx], acc[idx])
+        return out[:, 0], out[:, 1]
+
+    def _step(self, s, z, t, acc):
+        # Metres -> degrees for each axis at this latitude
+        scale = np.column_stack([np.full(len(s), 1.0 / METRES_PER_DEGREE),
+                                 1.0 / (METRES_PER_DEGREE * np.maximum(np.cos(np.radians(z[:, 0])), 0.01))])
+        r = (acc[:, None] * scale) ** 2
+        q = (self.accel_noise * scale) ** 2
+
+        dt = t - self.t[s]
+        reset = ~(dt <= self.reset_seconds)   # also true for new slots (t = -inf)
+        dt = np.clip(np.where(reset, 0.0, dt), 0.0, None)[:, None]
+
+        pos, vel = self.pos[s], self.vel[s]
+        p00, p01, p11 = self.p00[s], self.p01[s], self.p11[s]
+
+        # Predict
+        pos = pos + vel * dt
+        p00 = p00 + 2 * dt * p01 + dt * dt * p11 + q * dt ** 3 / 3
+        p01 = p01 + dt * p11 + q * dt ** 2 / 2
+        p11 = p11 + q * dt
+
+        # Update with the measurement; the longitude residual takes the short way round the antimeridian
+        innovation = z - pos
+        innovation[:, 1] = wrap_longitude(innovation[:, 1])
+        k0 = p00 / (p00 + r)
+        k1 = p01 / (p00 + r)
+        pos = pos + k0 * innovation
+        pos[:, 1] = wrap_longitude(pos[:, 1])
+        vel = vel + k1 * innovation
+        p11 = p11 - k1 * p01
+        p01 = (1 - k0) * p01
+        p00 = (1 - k0) * p00
+
+        # Fresh or stale devices restart at the fix with zero velocity
+        reset = reset[:, None]
+        pos = np.where(reset, z, pos)
+        vel = np.where(reset, 0.0, vel)
+        p00 = np.where(reset, r, p00)
+        p01 = np.where(reset, 0.0, p01)
+        p11 = np.where(reset, (10.0 * scale) ** 2, p11)  # prior: speeds up to ~10 m/s
+
+        self.pos[s], self.vel[s] = pos, vel
+        self.p00[s], self.p01[s], self.p11[s] = p00, p01, p11
+        self.t[s] = np.maximum(self.t[s], t)
+        return pos
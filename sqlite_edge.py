@@ -0,0 +1,175 @@
+"""
+SQLite edge mode for on-prem boxes without Postgres.
+
+Two parts:
+
+  * pragmas set on every new connection: WAL journaling so readers never
+    block the writer (and vice versa), synchronous=NORMAL (in WAL mode a
+    commit no longer fsyncs; the WAL is synced at checkpoints, so a power
+    cut can lose the last commits but never corrupts the file), a memory
+    map and a larger page cache for reads, and a busy timeout so writers
+    from other processes wait for the lock instead of failing
+  * WriteBatcher: one writer thread per process that takes write jobs from
+    request threads and runs as many as are queued (up to max_batch) in a
+    single transaction, so N concurrent ingest requests cost one lock
+    acquisition and one commit instead of N
+
+SQLite allows one writer at a time per database file. Several gunicorn
+workers still work (their writer threads queue on the busy timeout), but
+the best throughput comes from one worker with many threads, where every
+ingest write goes through a single thread and never contends.
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+EDGE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,          # ms
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,      # negative = KiB, so 64 MiB
+    "temp_store": "MEMORY",
+    "wal_autocheckpoint": 1000,    # pages
+}
+
+
+def pragmas_from_env(environ=os.environ):
+    """EDGE_PRAGMAS with SQLITE_<PRAGMA>=value overrides, e.g. SQLITE_SYNCHRONOUS=FULL."""
+    pragmas = dict(EDGE_PRAGMAS)
+    for name in pragmas:
+        value = environ.get(f"SQLITE_{name.upper()}")
+        if value:
+            pragmas[name] = value
+    return pragmas
+
+
+def apply_pragmas(engine, pragmas):
+    """Run the pragmas on every connection the engine opens from now on."""
+    statements = [f"PRAGMA {name}={value}" for name, value in pragmas.items()]
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    event.listen(engine, "connect", on_connect)
+
+
+class WriterBusy(Exception):
+    """The writer queue is full, or the job was not committed within the caller's timeout."""
+
+
+class WriteBatcher:
+    """
+    Serializes write jobs onto one thread and commits them in batches.
+
+    `transaction(jobs)` runs a list of jobs in one transaction and returns
+    their results in order (raising if anything fails). If a batch fails,
+    its jobs are retried one per transaction so a single bad job only fails
+    its own caller. Jobs must therefore be safe to re-run after a rollback.
+    """
+
+    def __init__(self, transaction, max_batch=256, max_wait=0.0, maxsize=10000):
+        self.transaction = transaction
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._pid = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.jobs = 0
+        self.failed_batches = 0
+
+    def start(self):
+        """Start the writer thread once per process (safe after fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._loop, name="sqlite-writer", daemon=True).start()
+
+    def submit(self, job):
+        """Queue job(session) -> result; returns a Future. Raises queue.Full if the writer is swamped."""
+        self.start()
+        future = Future()
+        self._queue.put((job, future), timeout=1.0)
+        return future
+
+    def run(self, job, timeout=None):
+        """
+        Submit and wait for the job's committed result; raises WriterBusy on
+        overload. WriterBusy always means the job was not (and will not be)
+        committed; a job already in a running batch is waited for instead.
+        """
+        try:
+            future = self.submit(job)
+        except queue.Full:
+            raise WriterBusy("SQLite write queue is full")
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # cancel() only succeeds before the job starts, so a cancelled job never commits later
+            if future.cancel():
+                raise WriterBusy("Timed out waiting for the SQLite writer")
+            return future.result()
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                # Jobs queued while the previous batch committed join this one; max_wait > 0
+                # trades single-request latency for larger batches
+                batch.append(self._queue.get(timeout=self.max_wait) if self.max_wait else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = [item for item in self._take_batch() if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.transaction([job for job, _ in batch])
+            except Exception as exc:
+                self.failed_batches += 1
+                if len(batch) == 1:
+                    logger.exception("SQLite write job failed")
+                    batch[0][1].set_exception(exc)
+                    continue
+                logger.warning("SQLite write batch of %d failed; retrying jobs one by one", len(batch))
+                self._run_singly(batch)
+                continue
+            self.batches += 1
+            self.jobs += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _run_singly(self, batch):
+        for job, future in batch:
+            try:
+                result = self.transaction([job])[0]
+            except Exception as exc:
+                logger.exception("SQLite write job failed")
+                future.set_exception(exc)
+            else:
+                self.batches += 1
+                self.jobs += 1
+                future.set_result(result)
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "batches": self.batches, "jobs": self.jobs,
+                "failed_batches": self.failed_batches,
+                "mean_batch": round(self.jobs / self.batches, 2) if self.batches else 0.0}
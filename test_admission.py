@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+sys.path.append('.')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from admission import AdmissionController, RouteClass, StaleCache
+
+
+def _controller():
+    return AdmissionController([
+        RouteClass("ingest", shed_at=1.0, latency_target=0.25, critical=True),
+        RouteClass("longpoll", max_share=0.25, latency_target=None),
+        RouteClass("reads", shed_at=0.6, latency_target=0.5),
+    ], capacity=8)
+
+
+def test_low_priority_work_is_shed_first_as_concurrency_rises():
+    admission = _controller()
+    for _ in range(4):
+        assert admission.try_admit("reads", now=0.0)
+    assert not admission.try_admit("reads", now=0.0)    # 5/8 > 0.6
+    assert admission.try_admit("longpoll", now=0.0)
+    assert admission.try_admit("longpoll", now=0.0)
+    assert not admission.try_admit("longpoll", now=0.0)  # own cap: 2 of 8
+    assert admission.try_admit("ingest", now=0.0)
+    assert admission.try_admit("ingest", now=0.0)
+    assert not admission.try_admit("ingest", now=0.0)    # worker full
+    admission.release("reads", 0.01, now=0.0)
+    assert admission.try_admit("ingest", now=0.0)
+    assert admission.stats()["classes"]["reads"]["shed"] == 1
+
+
+def test_slow_ingest_sheds_reads_but_not_ingest_until_it_recovers():
+    admission = _controller()
+    for _ in range(20):
+        assert admission.try_admit("ingest", now=0.0)
+        admission.release("ingest", 1.0, now=0.0)
+    # Slow but idle: latency alone never sheds
+    assert admission.try_admit("reads", now=1.0)
+    assert admission.try_admit("ingest", now=1.0)     # 2 of 8 in flight: the latency signal counts
+    assert not admission.try_admit("reads", now=1.0)
+    assert admission.try_admit("ingest", now=1.0)
+    admission.release("ingest", 1.0, now=1.0)
+    # No ingest completions for a while: the latency signal ages out
+    assert admission.try_admit("reads", now=10.0)
+
+
+def test_naturally_slow_class_is_not_shed_on_an_idle_worker():
+    admission = _controller()
+    for i in range(50):
+        assert admission.try_admit("reads", now=float(i))
+        admission.release("reads", 2.0, now=float(i))   # 4x its latency target
+    assert admission.stats()["pressure"] == 0.0
+
+
+def test_stale_cache_expires():
+    cache = StaleCache(max_age=5, maxsize=1)
+    cache.put("a", b"[]", "application/json", now=0.0)
+    assert cache.get("a", now=3.0) == (3.0, b"[]", "application/json")
+    assert cache.get("a", now=6.0) is None
+    cache.put("b", b"{}", "application/json", now=0.0)
+    assert cache.get("a", now=0.0) is None
+
+
+def test_streamed_map_poll_is_served_stale_when_shed():
+    import tracking_software
+    from tracking_software import app, db, Device, User
+    with app.app_context():
+        db.create_all()
+        user = User(username='stale-map', email='stale-map@example.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Device(serial_number='STALE-MAP-1', name='Map', make='Test', model='M1',
+                              latitude=1.5, longitude=36.8, user_id=user.id))
+        db.session.commit()
+    client = app.test_client()
+    fresh = client.get('/api/live_locations')
+    assert fresh.status_code == 200 and b'STALE-MAP-1' in fresh.data
+
+    try_admit = tracking_software.admission.try_admit
+    tracking_software.admission.try_admit = lambda name: False
+    try:
+        shed = client.get('/api/live_locations')
+        uncached = client.get('/api/all_devices')
+    finally:
+        tracking_software.admission.try_admit = try_admit
+    assert shed.status_code == 200 and shed.data == fresh.data and 'X-Stale-Age' in shed.headers
+    assert uncached.status_code == 503
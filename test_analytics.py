@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append('.')
+
+import numpy as np
+
+from analytics import haversine_m, summarize
+
+
+def test_haversine_one_degree_of_latitude():
+    assert abs(haversine_m(0.0, 0.0, 1.0, 0.0) - 111195.0) < 5.0
+    assert np.allclose(haversine_m([0.0, 10.0], [0.0, 10.0], [0.0, 10.0], [0.0, 10.0]), 0.0)
+
+
+def test_summarize_groups_by_device_and_day():
+    day = 86400.0
+    # Device 0: drives 1 km north in 100 s, then parks for 10 minutes (one stop)
+    # Device 1: one point today, one point the next day (no segments)
+    codes = np.array([0, 0, 0, 1, 1])
+    lat = np.array([0.0, 0.008993, 0.008993, 5.0, 6.0])
+    lon = np.array([0.0, 0.0, 0.0, 5.0, 5.0])
+    t = np.array([day, day + 100, day + 700, day + 10, 2 * day + 10])
+
+    group_codes, group_days, stats = summarize(codes, lat, lon, t)
+
+    assert group_codes.tolist() == [0, 1, 1]
+    assert group_days.tolist() == [1, 1, 2]
+    assert stats['point_count'].tolist() == [3, 1, 1]
+    assert abs(stats['distance_m'][0] - 1000.0) < 1.0
+    assert stats['moving_seconds'][0] == 100
+    assert abs(stats['max_speed_mps'][0] - 10.0) < 0.01
+    assert abs(stats['avg_speed_mps'][0] - 10.0) < 0.01
+    assert stats['stop_count'].tolist() == [1, 0, 0]
+    assert stats['distance_m'][1] == 0 and stats['distance_m'][2] == 0
+
+
+def test_cached_days_tolerate_races_and_can_be_invalidated():
+    import os
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    from datetime import date
+    from tracking_software import app, db, DeviceDailySummary, trip_analytics
+
+    serial = 'ANALYTICS-CACHE-001'
+    day = date(2025, 3, 1)
+    with app.app_context():
+        db.create_all()
+        DeviceDailySummary.query.filter_by(serial_number=serial).delete()
+        db.session.commit()
+        summaries = trip_analytics.daily([serial], day, day, today=date(2025, 3, 2))
+        assert summaries[(serial, day)]['point_count'] == 0
+        # A concurrent request storing the same day again is not an error
+        trip_analytics._store([{'serial_number': serial, 'day': day, **summaries[(serial, day)]}])
+        assert DeviceDailySummary.query.filter_by(serial_number=serial).count() == 1
+
+        trip_analytics.invalidate([(serial, day), (serial, date(2025, 3, 5))])
+        assert DeviceDailySummary.query.filter_by(serial_number=serial).count() == 0
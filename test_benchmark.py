@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append('.')
+
+from benchmark import compare, database_url, summarize
+
+
+def result(commit, **medians):
+    return {"meta": {"git": {"commit": commit, "dirty": False}},
+            "results": {name: {"median_ms": median, "iqr_ms": 0.5} for name, median in medians.items()}}
+
+
+def test_summary_is_in_milliseconds():
+    summary = summarize([0.001 * i for i in range(1, 101)])
+    assert summary['samples'] == 100
+    assert summary['min_ms'] == 1.0 and summary['median_ms'] == 50.5
+    assert summary['p95_ms'] == 95.0
+    assert summary['ops_per_s'] == round(1 / 0.0505, 2)
+
+
+def test_compare_ignores_changes_within_threshold_or_noise():
+    old = result("a", api_devices=10.0, live_locations=20.0, export=1.0, gone=5.0)
+    new = result("b", api_devices=12.0, live_locations=15.0, export=1.2, added=5.0)
+    rows = {row['name']: row for row in compare(old, new, threshold=0.05)}
+    assert set(rows) == {'api_devices', 'live_locations', 'export'}
+    assert rows['api_devices']['verdict'] == 'slower' and rows['api_devices']['change'] == 0.2
+    assert rows['live_locations']['verdict'] == 'faster'
+    # 20% slower, but only 0.2 ms against 0.5 ms of IQR noise
+    assert rows['export']['verdict'] == 'same'
+
+
+def test_database_url_accepts_paths():
+    assert database_url('postgres://u@h/db') == 'postgresql://u@h/db'
+    assert database_url('/tmp/bench.db') == 'sqlite:////tmp/bench.db'
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import threading
+import time
+sys.path.append('.')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from types import SimpleNamespace
+
+from command_notify import BROADCAST, CommandNotifier
+from device_tokens import DeviceTokenSigner
+from tracking_software import app, db, Device, User, device_tokens
+
+SERIAL = 'NOTIFY-TEST-001'
+device_tokens.signer = DeviceTokenSigner('test-device-token-secret')
+
+
+class FakeListenConnection:
+    """psycopg2-like connection whose notifications arrive through a pipe."""
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.notifies = []
+        self.statements = []
+        self.autocommit = False
+
+    def fileno(self):
+        return self.read_fd
+
+    def cursor(self):
+        return SimpleNamespace(execute=self.statements.append)
+
+    def poll(self):
+        for payload in os.read(self.read_fd, 4096).decode().split():
+            self.notifies.append(SimpleNamespace(payload=payload))
+
+    def send(self, payload):
+        os.write(self.write_fd, payload.encode() + b' ')
+
+
+def test_notifications_wake_only_matching_waiters():
+    notifier = CommandNotifier(SimpleNamespace(engine=SimpleNamespace(dialect=SimpleNamespace(name='sqlite'))))
+    with notifier.subscribe('A') as a, notifier.subscribe('B') as b:
+        assert notifier.waiting() == 2
+        threading.Timer(0.05, notifier.notify_local, ('A',)).start()
+        assert a.wait(2) and not b.is_set()
+        notifier.notify_local(BROADCAST)
+        assert b.is_set()
+    assert notifier.waiting() == 0
+
+
+def test_listener_reconnects_and_forwards_notifications():
+    connection = FakeListenConnection()
+    attempts = []
+
+    def raw_connection():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError('database restarting')
+        return SimpleNamespace(driver_connection=connection, invalidate=lambda: None)
+
+    engine = SimpleNamespace(dialect=SimpleNamespace(name='postgresql'), raw_connection=raw_connection)
+    notifier = CommandNotifier(SimpleNamespace(engine=engine))
+    with notifier.subscribe('SN-1') as woken:
+        deadline = time.monotonic() + 5
+        while not connection.statements and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert len(attempts) == 2 and connection.statements == ['LISTEN device_commands']
+        assert connection.autocommit
+        connection.send('SN-1')
+        assert woken.wait(2)
+
+
+def test_long_poll_honours_short_and_zero_timeouts():
+    with app.app_context():
+        db.create_all()
+        user = User.query.filter_by(username='notify-user').first()
+        if not user:
+            user = User(username='notify-user', email='notify@example.com', password='x')
+            db.session.add(user)
+            db.session.commit()
+        if not Device.query.filter_by(serial_number=SERIAL).first():
+            db.session.add(Device(serial_number=SERIAL, name='Notify', make='Test', model='T1', user_id=user.id))
+            db.session.commit()
+        headers = {'X-Device-Token': device_tokens.issue(SERIAL)}
+
+    client = app.test_client()
+    for timeout, low, high in (('0', 0.0, 0.5), ('0.3', 0.3, 1.0)):
+        started = time.monotonic()
+        response = client.get(f'/api/device_commands/{SERIAL}/wait?timeout={timeout}', headers=headers)
+        elapsed = time.monotonic() - started
+        assert response.status_code == 200 and response.get_json() == []
+        assert low <= elapsed < high
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append('.')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from datetime import timedelta
+
+from tracking_software import app, db, Device, DeviceCommand, User
+from command_queue import CommandQueue, utcnow
+
+SERIAL = 'QUEUE-TEST-001'
+
+
+def _queue():
+    db.create_all()
+    DeviceCommand.query.filter_by(serial_number=SERIAL).delete()
+    db.session.commit()
+    return CommandQueue(db, DeviceCommand, ttl=3600, visibility=60, max_deliveries=2)
+
+
+def test_claim_is_exclusive_and_redelivers_after_visibility_timeout():
+    with app.app_context():
+        queue = _queue()
+        first = queue.enqueue(SERIAL, 'lock', {'pin': '1234'})
+        second = queue.enqueue(SERIAL, 'ring')
+        now = utcnow()
+
+        claimed = queue.claim(SERIAL, now=now)
+        assert [row.id for row in claimed] == [first, second]
+        assert queue.claim(SERIAL, now=now) == []
+
+        assert queue.ack(first)
+        assert not queue.ack(first)
+
+        # Not acknowledged within the visibility timeout: delivered again
+        later = now + timedelta(seconds=61)
+        redelivered = queue.claim(SERIAL, now=later)
+        assert [(row.id, row.delivery_count) for row in redelivered] == [(second, 2)]
+
+        # Delivery budget used up
+        assert queue.claim(SERIAL, now=later + timedelta(seconds=61)) == []
+        assert queue.expire(now=later + timedelta(seconds=61)) == (0, 1)
+        assert db.session.get(DeviceCommand, second).status == 'failed'
+
+
+def test_expired_commands_are_not_delivered():
+    with app.app_context():
+        queue = _queue()
+        command_id = queue.enqueue(SERIAL, 'wipe', ttl=10)
+        assert queue.claim(SERIAL, now=utcnow() + timedelta(seconds=11)) == []
+        assert queue.expire(now=utcnow() + timedelta(seconds=11)) == (1, 0)
+        assert db.session.get(DeviceCommand, command_id).status == 'expired'
+        assert queue.depth(SERIAL) == 0
+
+
+def test_bulk_command_fans_out_to_group_and_reports_progress():
+    with app.app_context():
+        db.create_all()
+        user = User.query.filter_by(username='bulk-user').first()
+        if not user:
+            user = User(username='bulk-user', email='bulk@example.com', password='x', plan='pro')
+            db.session.add(user)
+            db.session.commit()
+        serials = ['BULK-TEST-%d' % i for i in range(5)]
+        DeviceCommand.query.filter(DeviceCommand.serial_number.in_(serials)).delete()
+        for serial in serials:
+            if not Device.query.filter_by(serial_number=serial).first():
+                db.session.add(Device(serial_number=serial, name=serial, make='Test', model='T1',
+                                      device_type='Tracker' if serial != serials[-1] else 'Phone',
+                                      user_id=user.id))
+        db.session.commit()
+        user_id = user.id
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+
+    group = client.post('/api/groups', json={'name': 'bulk-%s' % utcnow().timestamp(),
+                                             'serial_numbers': serials[:4] + ['NOT-MINE']})
+    assert group.status_code == 201
+    group_id = group.get_json()['id']
+
+    # Filters that would silently match the whole fleet are refused
+    for bad in ({'typo': 'x'}, {'make': ''}, {'model': None}, ['make']):
+        response = client.post('/api/bulk_command', json={'command_type': 'wipe', 'filter': bad})
+        assert response.status_code == 400
+
+    job = client.post('/api/bulk_command', json={
+        'command_type': 'ring', 'group_id': group_id, 'filter': {'device_type': 'Tracker'}})
+    assert job.status_code == 202
+    job_id = job.get_json()['job_id']
+    assert job.get_json()['total'] == 4
+
+    with app.app_context():
+        command = DeviceCommand.query.filter_by(job_id=job_id, serial_number=serials[0]).one()
+        CommandQueue(db, DeviceCommand).ack(command.id)
+
+    progress = client.get('/api/command_jobs/%d' % job_id).get_json()
+    assert progress['total'] == 4
+    assert progress['counts'] == {'executed': 1, 'pending': 3}
+    assert progress['progress'] == 0.25
+
+
+def test_ack_many_reports_per_command_results():
+    with app.app_context():
+        queue = _queue()
+        first = queue.enqueue(SERIAL, 'lock')
+        second = queue.enqueue(SERIAL, 'ring')
+        other = queue.enqueue('QUEUE-TEST-OTHER', 'ring')
+        queue.claim(SERIAL)
+        assert queue.ack(second)
+        executed_at = utcnow() - timedelta(seconds=30)
+
+        results = queue.ack_many([(first, 'failed', executed_at), (second, 'executed', None),
+                                  (other, 'executed', None), (999999, 'executed', None)],
+                                 serial_number=SERIAL)
+        assert results == {first: 'acknowledged', second: 'already_closed',
+                           other: 'not_found', 999999: 'not_found'}
+        command = db.session.get(DeviceCommand, first)
+        assert command.status == 'failed'
+        assert command.executed_at == executed_at
+        assert db.session.get(DeviceCommand, other).status == 'pending'
+        DeviceCommand.query.filter_by(serial_number='QUEUE-TEST-OTHER').delete()
+        db.session.commit()
+
+
+def test_single_ack_rejects_unknown_statuses_and_bad_ids():
+    with app.app_context():
+        queue = _queue()
+        command_id = queue.enqueue(SERIAL, 'lock')
+        queue.claim(SERIAL)
+    client = app.test_client()
+    for body in ({'command_id': command_id, 'status': 'pending'}, {'command_id': command_id, 'status': 'bogus'},
+                 {'status': 'executed'}, {'command_id': 'abc'}, [command_id]):
+        assert client.post('/api/command_ack', json=body).status_code == 400
+    with app.app_context():
+        assert db.session.get(DeviceCommand, command_id).status == 'sent'
+    response = client.post('/api/command_ack', json={'command_id': str(command_id), 'status': 'failed'})
+    assert response.get_json() == {'message': 'Command acknowledged'}
+    with app.app_context():
+        assert db.session.get(DeviceCommand, command_id).status == 'failed'
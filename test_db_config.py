@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append('.')
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select
+
+from db_config import REPLICA_BIND, ReplicaMonitor, RoutingSession, bound_engines, engine_options_from_env
+
+
+def test_pool_options_only_for_server_databases():
+    assert engine_options_from_env('sqlite:///x.db') == {}
+    options = engine_options_from_env('postgresql://db/app', {'DB_POOL_SIZE': '4', 'DB_POOL_PRE_PING': '0'})
+    assert options['pool_size'] == 4 and options['max_overflow'] == 22
+    assert options['pool_pre_ping'] is False and options['pool_recycle'] == 1800
+
+
+def test_monitor_enforces_staleness_bound_and_backs_off_after_errors():
+    lags = [0.5, 30.0, RuntimeError('replica down'), 0.1]
+
+    def measure():
+        value = lags.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    monitor = ReplicaMonitor(measure, max_lag=5, check_interval=1, retry_after=10)
+    assert monitor.usable(now=100) is True
+    assert monitor.usable(now=100.5) is True  # cached until the next check
+    assert monitor.usable(now=101) is False  # 30s behind
+    assert monitor.usable(now=102) is False and monitor.lag is None  # error
+    assert monitor.usable(now=105) is False  # still backing off
+    assert monitor.usable(now=112) is True
+
+
+def test_selects_go_to_replica_and_writes_to_primary(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: f"sqlite:///{tmp_path / 'replica.db'}"}
+    db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+
+    class Item(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(20))
+
+    with app.app_context():
+        db.create_all()
+        Item.__table__.create(db.engines[REPLICA_BIND])
+        with db.engines[REPLICA_BIND].begin() as conn:
+            conn.execute(Item.__table__.insert(), {"id": 1, "name": "from replica"})
+        db.session.add(Item(id=1, name="from primary"))
+        db.session.commit()
+
+        assert db.session.scalar(select(Item.name)) == "from primary"
+        db.session.info["use_replica"] = True
+        db.session.expunge_all()
+        assert db.session.scalar(select(Item.name)) == "from replica"
+        db.session.add(Item(id=2, name="new"))
+        db.session.commit()
+        db.session.info.pop("use_replica")
+        assert db.session.scalar(select(Item.name).where(Item.id == 2)) == "new"
+
+
+def test_bound_engines_include_the_replica_when_configured(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    with app.app_context():
+        assert list(bound_engines(SQLAlchemy(app))) == ["primary"]
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: f"sqlite:///{tmp_path / 'replica.db'}"}
+    db = SQLAlchemy(app)
+    with app.app_context():
+        engines = bound_engines(db)
+        assert engines == {"primary": db.engine, REPLICA_BIND: db.engines[REPLICA_BIND]}
+        assert engines["primary"] is not engines[REPLICA_BIND]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append('.')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from device_tokens import DeviceTokenSigner, DeviceTokens, RevocationList, secret_from_env
+from werkzeug.security import generate_password_hash
+
+from tracking_software import app, db, Device, User, device_tokens, revoke_device_tokens
+
+SERIAL = 'TOKEN-TEST-001'
+# The suite runs without DEVICE_TOKEN_SECRET/SECRET_KEY, which leaves tokens disabled
+device_tokens.signer = DeviceTokenSigner('test-device-token-secret')
+
+
+def test_tokens_verify_and_reject_tampering():
+    signer = DeviceTokenSigner('secret')
+    token = signer.issue('SN/ü 1', issued_at_ms=1000)
+    assert signer.verify(token) == ('SN/ü 1', 1000)
+    assert signer.verify(token[:-2] + ('AA' if not token.endswith('AA') else 'BB')) is None
+    assert signer.verify(token.replace('.1000.', '.2000.')) is None
+    assert DeviceTokenSigner('other').verify(token) is None
+    assert signer.verify('garbage') is None
+    assert signer.verify('v1.é.1.x') is None
+
+
+def test_no_tokens_without_a_configured_secret():
+    assert secret_from_env({'SECRET_KEY': 'key', 'DEVICE_TOKEN_SECRET': 'token'}) == 'token'
+    assert secret_from_env({'SECRET_KEY': 'key'}) == 'key'
+    assert secret_from_env({}) is None
+    forged = DeviceTokenSigner('fallback-secret').issue('A', issued_at_ms=1)
+    tokens = DeviceTokens(DeviceTokenSigner(secret_from_env({})), RevocationList(list, refresh_every=60))
+    assert not tokens.enabled
+    assert tokens.issue('A') is None and tokens.verify(forged) is None
+
+
+def test_revoked_tokens_are_rejected_until_reissued():
+    revocations = RevocationList(lambda: [('A', 2000)], refresh_every=60)
+    tokens = DeviceTokens(DeviceTokenSigner('secret'), revocations)
+    assert tokens.verify(tokens.issue('A', issued_at_ms=1999)) is None
+    assert tokens.verify(tokens.issue('A', issued_at_ms=2000)) == 'A'
+    revocations.revoke('A', 3000)
+    assert tokens.verify(tokens.issue('A', issued_at_ms=2500)) is None
+    assert tokens.verify(tokens.issue('B', issued_at_ms=1)) == 'B'
+
+
+def test_device_endpoints_check_the_token():
+    with app.app_context():
+        db.create_all()
+        user = User.query.filter_by(username='token-user').first()
+        if not user:
+            user = User(username='token-user', email='token@example.com', password='x')
+            db.session.add(user)
+            db.session.commit()
+        if not Device.query.filter_by(serial_number=SERIAL).first():
+            db.session.add(Device(serial_number=SERIAL, name='Token', make='Test', model='T1', user_id=user.id))
+            db.session.commit()
+        token = device_tokens.issue(SERIAL)
+        other = device_tokens.issue('TOKEN-TEST-OTHER')
+
+    client = app.test_client()
+    point = {'serial_number': SERIAL, 'latitude': -1.28, 'longitude': 36.82}
+    ok = client.post('/api/report_location', json=point, headers={'Authorization': f'Bearer {token}'})
+    assert ok.status_code == 200
+    assert client.post('/api/report_location', json=point,
+                       headers={'Authorization': 'Bearer nope'}).status_code == 401
+    assert client.post('/api/report_location', json=point,
+                       headers={'X-Device-Token': other}).status_code == 403
+    assert client.get(f'/api/device_commands/{SERIAL}', headers={'X-Device-Token': other}).status_code == 403
+
+    with app.app_context():
+        revoke_device_tokens(SERIAL)
+    assert client.post('/api/report_location', json=point,
+                       headers={'Authorization': f'Bearer {token}'}).status_code == 401
+
+
+def test_owner_can_re_register_for_a_fresh_token():
+    with app.app_context():
+        db.create_all()
+        for username in ('owner-user', 'stranger-user'):
+            if not User.query.filter_by(username=username).first():
+                db.session.add(User(username=username, email=f'{username}@example.com',
+                                    password=generate_password_hash('secret')))
+        db.session.commit()
+
+    client = app.test_client()
+    body = {'serial_number': 'TOKEN-REREG-001', 'name': 'Rereg', 'make': 'Test', 'model': 'T1',
+            'email': 'owner-user@example.com', 'password': 'secret'}
+    first = client.post('/api/register_device', json=body)
+    assert first.status_code == 200
+    again = client.post('/api/register_device', json=body)
+    assert again.status_code == 200 and again.get_json()['device_token'] != first.get_json()['device_token']
+
+    point = {'serial_number': body['serial_number'], 'latitude': -1.28, 'longitude': 36.82}
+    assert client.post('/api/report_location', json=point,
+                       headers={'X-Device-Token': again.get_json()['device_token']}).status_code == 200
+    assert client.post('/api/report_location', json=point,
+                       headers={'X-Device-Token': first.get_json()['device_token']}).status_code == 401
+    stranger = dict(body, email='stranger-user@example.com')
+    assert client.post('/api/register_device', json=stranger).status_code == 409
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import sys
+import threading
+sys.path.append('.')
+
+from enrichment import Pipeline, Stage
+
+
+def test_full_queue_drops_and_counts_instead_of_blocking():
+    stage = Stage("geocode", lambda items: items, maxsize=2)  # workers never started
+    assert [stage.put(i) for i in range(4)] == [True, True, False, False]
+    stats = stage.stats()
+    assert (stats["queue_depth"], stats["received"], stats["dropped"]) == (2, 2, 2)
+
+
+def test_items_are_batched_and_forwarded_to_the_next_stage():
+    batches, written = [], []
+    gate = threading.Event()
+
+    def double(items):
+        gate.wait(2)
+        batches.append(len(items))
+        return [item * 2 for item in items]
+
+    pipeline = Pipeline([Stage("double", double, batch_size=10, max_wait=0.2),
+                         Stage("write", written.extend, batch_size=100, max_wait=0.01)])
+    assert all(pipeline.submit(i) for i in range(25))
+    gate.set()
+    assert pipeline.wait_idle(5)
+    assert sorted(written) == [i * 2 for i in range(25)]
+    assert max(batches) <= 10 and sum(batches) == 25 and len(batches) < 25
+    stats = pipeline.stats()
+    assert stats["double"]["processed"] == stats["write"]["received"] == 25
+    assert stats["write"]["latency_max_ms"] >= stats["write"]["latency_p50_ms"] > 0
+
+
+def test_failed_batches_are_counted_and_workers_keep_going():
+    seen = []
+
+    def flaky(items):
+        if "bad" in items:
+            raise ValueError("geocoder down")
+        seen.extend(items)
+
+    pipeline = Pipeline([Stage("flaky", flaky, batch_size=1, max_wait=0)])
+    pipeline.submit("bad")
+    pipeline.submit("good")
+    assert pipeline.wait_idle(5)
+    stats = pipeline.stats()["flaky"]
+    assert (seen, stats["failed"], stats["processed"], stats["in_flight"]) == (["good"], 1, 2, 0)
+
+
+def test_wait_idle_drains_before_shutdown_and_times_out_when_stuck():
+    release = threading.Event()
+    pipeline = Pipeline([Stage("slow", lambda items: release.wait(5), batch_size=1, max_wait=0)])
+    pipeline.submit("point")
+    assert not pipeline.wait_idle(0.1)
+    release.set()
+    assert pipeline.wait_idle(5)
+    assert pipeline.stats()["slow"]["queue_depth"] == 0
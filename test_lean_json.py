@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+from datetime import datetime
+sys.path.append('.')
+
+import lean_json
+
+KEYS = ('serial_number', 'latitude', 'longitude', 'last_seen')
+ROWS = [('A1', -1.28, 36.81, datetime(2026, 3, 1, 8, 5, 9, 120000)),
+        ('B2', 0.5, 30.0, datetime(2026, 3, 1, 8, 5, 9)),
+        ('C3', 1.0, 2.0, None)]
+
+
+def encode_both(formats):
+    fast = lean_json.dumps(lean_json.records(KEYS, ROWS, formats))
+    orjson, lean_json.orjson = lean_json.orjson, None
+    try:
+        slow = lean_json.dumps(lean_json.records(KEYS, ROWS, formats))
+    finally:
+        lean_json.orjson = orjson
+    return json.loads(fast), json.loads(slow)
+
+
+def test_iso_matches_isoformat_with_and_without_orjson():
+    expected = [{'serial_number': s, 'latitude': lat, 'longitude': lon,
+                 'last_seen': seen.isoformat() if seen else None} for s, lat, lon, seen in ROWS]
+    fast, slow = encode_both({'last_seen': lean_json.ISO})
+    assert fast == slow == expected
+
+
+def test_seconds_matches_strftime():
+    fast, slow = encode_both({'last_seen': lean_json.seconds})
+    assert fast == slow
+    assert [row['last_seen'] for row in fast] == [
+        seen.strftime('%Y-%m-%d %H:%M:%S') if seen else None for _, _, _, seen in ROWS]
+
+
+def test_iter_array_streams_chunks_as_one_document():
+    chunks = [ROWS[:2], [], ROWS[2:]]
+    parts = list(lean_json.iter_array(KEYS, iter(chunks), {'last_seen': lean_json.ISO}))
+    assert parts[0] == b'['
+    assert json.loads(b''.join(parts)) == json.loads(lean_json.dumps(lean_json.records(KEYS, ROWS, {'last_seen': lean_json.ISO})))
+    assert b''.join(lean_json.iter_array(KEYS, iter([]))) == b'[]'
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+
+import sys
+import random
+sys.path.append('.')
+
+from load_generator import METERS_PER_DEGREE, EndpointStats, Motion, percentile
+
+
+def test_percentiles_and_error_rate():
+    stats = EndpointStats()
+    for i in range(1, 101):
+        stats.record(i / 1000, 200 if i <= 98 else 503)
+    stats.record(5.0, error='timeout')
+    summary = stats.summary(elapsed=10)
+    assert summary['latency_ms']['p50'] == 51.0
+    assert summary['latency_ms']['p99'] == 100.0
+    assert summary['error_rate'] == round(3 / 101, 4)
+    assert summary['errors'] == {'timeout': 1} and summary['statuses']['503'] == 2
+    assert percentile([], 50) is None
+
+
+def test_walk_moves_at_walking_speed():
+    motion = Motion('walk', 0.0, 0.0, random.Random(3))
+    lat, lon = motion.step(10)
+    meters = ((lat * METERS_PER_DEGREE) ** 2 + (lon * METERS_PER_DEGREE) ** 2) ** 0.5
+    assert abs(meters - 14.0) < 0.01
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import threading
+sys.path.append('.')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from metrics import Metrics
+
+
+def test_counters_from_many_threads_are_summed():
+    metrics = Metrics()
+    metrics.counter("points_total", "Points.")
+
+    def work():
+        for _ in range(1000):
+            metrics.inc("points_total", labels=(("outcome", "accepted"),))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 'points_total{outcome="accepted"} 8000' in metrics.render()
+
+
+def test_histogram_buckets_are_cumulative(tmp_path):
+    metrics = Metrics()
+    metrics.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        metrics.observe("latency_seconds", value, (("endpoint", "x"),))
+    metrics.gauge("depth", "Depth.")
+    metrics.collector(lambda: [("depth", (), 7)])
+    text = metrics.render(str(tmp_path))
+    assert 'latency_seconds_bucket{endpoint="x",le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{endpoint="x",le="1.0"} 3' in text
+    assert 'latency_seconds_bucket{endpoint="x",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{endpoint="x"} 4' in text
+    assert '# TYPE depth gauge' in text and '\ndepth 7\n' in text
+
+
+def test_component_counters_are_summed_across_workers(tmp_path):
+    other = Metrics()
+    other.counter("shed_total", "Shed.")
+    other.counter_collector(lambda: [("shed_total", (("class", "reads"),), 5)])
+    other.flush(str(tmp_path))
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / "1.json")  # as written by another worker
+
+    metrics = Metrics()
+    metrics.counter("shed_total", "Shed.")
+    metrics.counter_collector(lambda: [("shed_total", (("class", "reads"),), 3)])
+    assert 'shed_total{class="reads"} 8' in metrics.render(str(tmp_path))
+    assert 'shed_total{class="reads"} 3' in metrics.render()
+
+
+def test_metrics_and_diagnostics_endpoints():
+    from tracking_software import app, db
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    client.get('/api/pipeline_stats')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'tracking_http_request_duration_seconds_count{endpoint="pipeline_stats",method="GET",status="200"}' in text
+    assert 'tracking_command_queue_depth' in text
+    assert client.get('/diagnostics').get_json()['database_connection'] == 'OK'
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append('.')
+
+from datetime import datetime, timedelta
+
+from motion_filter import MotionFilter
+
+T0 = datetime(2025, 1, 1, 12, 0)
+
+
+def test_single_point_jump_is_rejected_then_reanchored():
+    f = MotionFilter(max_speed_kmh=300, min_jump_m=1000, max_rejections=3)
+    assert f.check('A', -1.2833, 36.8167, T0)[0]
+    # ~500 km away one minute later (IP geolocation jump)
+    assert not f.check('A', -4.05, 39.66, T0 + timedelta(minutes=1))[0]
+    assert not f.check('A', -4.05, 39.66, T0 + timedelta(minutes=2))[0]
+    # Small move from the anchor is fine
+    assert f.check('A', -1.2840, 36.8170, T0 + timedelta(minutes=3))[0]
+    # A device that keeps reporting the far position is eventually re-anchored
+    results = [f.check('A', -4.05, 39.66, T0 + timedelta(minutes=4 + i))[0] for i in range(3)]
+    assert results == [False, False, True]
+
+
+def test_prior_seeds_unknown_device():
+    f = MotionFilter(max_speed_kmh=300, min_jump_m=1000)
+    prior = (-1.2833, 36.8167, T0)
+    assert not f.check('B', 40.0, -74.0, T0 + timedelta(minutes=1), prior=prior)[0]
+
+
+def test_batch_drops_spike_but_keeps_following_point():
+    f = MotionFilter(max_speed_kmh=300, min_jump_m=1000)
+    serials = ['C', 'C', 'C', 'D', 'D']
+    lats = [-1.2833, -4.05, -1.2835, 10.0, 10.001]
+    lons = [36.8167, 39.66, 36.8169, 10.0, 10.0]
+    times = [T0, T0 + timedelta(minutes=1), T0 + timedelta(minutes=2), T0, T0 + timedelta(minutes=1)]
+    assert f.filter_batch(serials, lats, lons, times).tolist() == [True, False, True, True, True]
+
+    # The next batch is judged against the last accepted point of each device
+    mask = f.filter_batch(['C', 'D'], [-4.05, 10.002], [39.66, 10.0],
+                          [T0 + timedelta(minutes=3), T0 + timedelta(minutes=2)])
+    assert mask.tolist() == [False, True]
+
+
+def test_batches_reanchor_after_max_rejections():
+    f = MotionFilter(max_speed_kmh=300, min_jump_m=1000, max_rejections=3)
+    assert f.filter_batch(['E'], [-1.2833], [36.8167], [T0]).tolist() == [True]
+    # A device that really moved and uploads one point per batch
+    results = [f.filter_batch(['E'], [-4.05], [39.66], [T0 + timedelta(minutes=1 + i)]).tolist()
+               for i in range(4)]
+    assert results == [[False], [False], [True], [True]]
+
+
+def test_batch_priors_seed_unknown_devices():
+    f = MotionFilter(max_speed_kmh=300, min_jump_m=1000)
+    priors = {'G': (-1.2833, 36.8167, T0), 'H': (None, None, None)}
+    mask = f.filter_batch(['G', 'H'], [40.0, 40.0], [-74.0, -74.0], [T0 + timedelta(minutes=1)] * 2,
+                          priors=priors)
+    assert mask.tolist() == [False, True]
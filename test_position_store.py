@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+sys.path.append('.')
+
+import pytest
+
+from position_store import PositionStore
+
+NOW = datetime(2026, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def name():
+    name = f"test-positions-{uuid.uuid4().hex[:8]}"
+    yield name
+    for path in (f"/dev/shm/{name}", os.path.join(tempfile.gettempdir(), name + ".lock")):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def device(id, user_id=1, **fields):
+    return dict(dict(id=id, user_id=user_id, serial_number=f"SN-{id}", name=f"Device {id}",
+                     latitude=float(id), longitude=36.8, last_seen=NOW, presence="online"), **fields)
+
+
+def test_reads_come_from_the_loaded_table(name):
+    store = PositionStore("test", capacity=64, name=name)
+    store.bootstrap(lambda: [device(1), device(2, user_id=2, latitude=None, longitude=None), device(3)])
+
+    found, fields = store.device("SN-3")
+    assert found and fields["id"] == 3 and fields["latitude"] == 3.0 and fields["presence"] == "online"
+    assert store.device("SN-404") == (False, None)
+    assert [row[0] for row in store.user_devices(1)] == [1, 3]
+    assert [row[:3] for rows in store.locations(chunk=1) for row in rows] == [
+        ("SN-1", 1.0, 36.8), ("SN-3", 3.0, 36.8)]
+
+
+def test_positions_never_move_back_in_time(name):
+    store = PositionStore("test", capacity=64, name=name)
+    store.bootstrap(lambda: [device(1)])
+    store.update(1, latitude=-1.0, longitude=-1.0, last_seen=NOW - timedelta(seconds=5))
+    store.put(device(1, latitude=-2.0, last_seen=NOW - timedelta(seconds=5)))
+    store.update(1, online=False)
+    fields = store.device("SN-1")[1]
+    assert (fields["latitude"], fields["last_seen"], fields["presence"]) == (1.0, NOW, "offline")
+
+    store.label("SN-1", NOW - timedelta(seconds=1), "Stale place")
+    store.label("SN-1", NOW, "Nairobi")
+    assert store.device("SN-1")[1]["current_location"] == "Nairobi"
+
+
+def test_other_workers_see_new_removed_and_renamed_devices(name):
+    writer = PositionStore("test", capacity=64, name=name)
+    writer.bootstrap(lambda: [device(1), device(2)])
+    reader = PositionStore("test", capacity=64, name=name)
+    assert reader.device("SN-2")[0]
+
+    writer.put(device(40))
+    writer.remove(2)
+    writer.put(device(1, serial_number="SN-1b"))
+    assert reader.device("SN-40")[0]
+    assert reader.device("SN-2") == (False, None)
+    assert reader.device("SN-1") == (False, None)
+    assert reader.device("SN-1b")[1]["id"] == 1
+
+
+def test_unrepresentable_devices_fall_back_to_the_database(name):
+    store = PositionStore("test", capacity=8, name=name)
+    store.bootstrap(lambda: [device(1), device(2, name="x" * 101)])
+    assert store.device("SN-1")[0]
+    assert store.device("SN-2") == (None, None)
+    assert store.user_devices(1) is None
+
+    store.put(device(8))  # beyond capacity: listings can no longer be complete
+    assert store.locations() is None
+    assert store.stats()["fallbacks"] == 3
+
+
+def test_readers_wait_out_a_write_in_progress(name):
+    store = PositionStore("test", capacity=8, name=name)
+    store.bootstrap(lambda: [device(1)])
+    seq = store._cols["seq"]
+    seq[1] += 1  # a writer is half-way through slot 1
+
+    def finish():
+        time.sleep(0.05)
+        store._cols["latitude"][1] = 9.0
+        seq[1] += 1
+
+    threading.Thread(target=finish).start()
+    assert store.device("SN-1")[1]["latitude"] == 9.0
+
+
+def test_a_failed_load_can_be_retried(name):
+    def broken():
+        yield device(1)
+        raise ConnectionError("database went away")
+
+    store = PositionStore("test", capacity=64, name=name)
+    with pytest.raises(ConnectionError):
+        store.bootstrap(broken)
+    assert not store.ready
+
+    store.bootstrap(lambda: [device(1), device(2)])
+    assert store.ready and store.device("SN-2")[0]
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append('.')
+
+import random
+
+from presence import PresenceTracker, TimingWheel
+
+
+def test_timing_wheel_matches_brute_force():
+    rng = random.Random(7)
+    wheel = TimingWheel(tick=1.0, bits=3, levels=3, now=1000)
+    deadlines = {}
+    now = 1000
+    for step in range(3000):
+        for _ in range(rng.randint(0, 3)):
+            key = rng.randint(0, 200)
+            # Include deadlines beyond the top wheel's range (8 ** 3 ticks)
+            when = now + rng.choice([1, 5, 60, 300, 900, 5000])
+            wheel.schedule(key, when)
+            deadlines[key] = when
+        if rng.random() < 0.1 and deadlines:
+            key = rng.choice(list(deadlines))
+            wheel.cancel(key)
+            del deadlines[key]
+        now += rng.choice([1, 1, 2, 7])
+        expired = set(wheel.advance(now))
+        due = {k for k, when in deadlines.items() if when <= now}
+        assert expired == due, step
+        for key in due:
+            del deadlines[key]
+    assert len(wheel) == len(deadlines)
+
+
+def test_tracker_goes_offline_once_and_alerts():
+    events = []
+    confirmed = []
+
+    def confirm(serials, cutoff):
+        confirmed.append(sorted(serials))
+        return serials
+
+    tracker = PresenceTracker(confirm, timeout=300, alert_after=600)
+    tracker.wheel = TimingWheel(now=0)
+    tracker.subscribe(lambda event, serial, at: events.append((event, serial)))
+
+    tracker.heartbeat('A', now=10)
+    tracker.heartbeat('B', now=10)
+    tracker.heartbeat('A', now=200)
+    assert tracker.sweep(now=320) == ['B']
+    assert tracker.sweep(now=400) == []
+    assert tracker.sweep(now=510) == ['A']
+    # Coming back cancels A's pending alert; it expires again at 900
+    tracker.heartbeat('A', now=600)
+    assert tracker.sweep(now=1000) == ['A']
+    assert confirmed == [['B'], ['A'], ['A']]
+    assert ('offline_alert', 'B') in events and ('offline_alert', 'A') not in events
+
+
+def test_offline_confirmation_uses_server_heartbeat_time_not_device_clock():
+    import os
+    import time
+    from datetime import datetime, timedelta, timezone
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    from tracking_software import app, db, Device, User, _confirm_offline
+
+    with app.app_context():
+        db.create_all()
+        Device.query.filter(Device.serial_number.in_(['SKEW-1', 'SKEW-2'])).delete()
+        user = User.query.filter_by(username='presence-user').first()
+        if not user:
+            user = User(username='presence-user', email='presence@example.com', password='x')
+            db.session.add(user)
+            db.session.commit()
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        # SKEW-1's clock runs an hour behind but it reported a moment ago; SKEW-2 went quiet
+        db.session.add(Device(serial_number='SKEW-1', name='Skewed', make='T', model='T', user_id=user.id,
+                              presence='online', last_seen=now - timedelta(hours=1), last_heartbeat_at=now))
+        db.session.add(Device(serial_number='SKEW-2', name='Quiet', make='T', model='T', user_id=user.id,
+                              presence='online', last_seen=now, last_heartbeat_at=now - timedelta(hours=1)))
+        db.session.commit()
+
+    assert _confirm_offline(['SKEW-1', 'SKEW-2'], time.time() - 300) == ['SKEW-2']
+
+
+def test_offline_alert_is_dropped_when_the_device_came_back_through_another_worker():
+    rows = {}  # serial -> [presence, changed_at, heard_at], shared like the database
+
+    def confirm_offline(serials, cutoff):
+        changed = [s for s in serials if rows[s][0] == 'online' and rows[s][2] < cutoff]
+        for serial in changed:
+            rows[serial][:2] = ['offline', cutoff + 300]
+        return changed
+
+    def confirm_alert(serials, cutoff):
+        return [s for s in serials if rows[s][0] == 'offline' and rows[s][1] <= cutoff]
+
+    def worker():
+        tracker = PresenceTracker(confirm_offline, timeout=300, alert_after=600, confirm_alert=confirm_alert)
+        tracker.wheel = TimingWheel(now=0)
+        tracker.subscribe(lambda event, serial, at: events.append((event, serial)))
+        return tracker
+
+    events = []
+    first, second = worker(), worker()
+    for serial in ('A', 'B'):
+        rows[serial] = ['online', 0, 10]
+        first.heartbeat(serial, now=10)
+    assert sorted(first.sweep(now=320)) == ['A', 'B']
+    # A reports again through the other worker before first's alert is due
+    rows['A'][0], rows['A'][2] = 'online', 700
+    second.heartbeat('A', now=700)
+    first.sweep(now=930)
+    assert ('offline_alert', 'B') in events and ('offline_alert', 'A') not in events
+
+
+def test_alert_confirmation_reads_presence_from_the_database():
+    import os
+    import time
+    from datetime import datetime, timedelta, timezone
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    from tracking_software import app, db, Device, User, _confirm_alert
+
+    with app.app_context():
+        db.create_all()
+        serials = ['ALERT-1', 'ALERT-2', 'ALERT-3']
+        Device.query.filter(Device.serial_number.in_(serials)).delete()
+        user = User.query.filter_by(username='presence-user').first()
+        if not user:
+            user = User(username='presence-user', email='presence@example.com', password='x')
+            db.session.add(user)
+            db.session.commit()
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        for serial, presence, changed in (('ALERT-1', 'offline', now - timedelta(hours=1)),
+                                          ('ALERT-2', 'online', now - timedelta(hours=1)),
+                                          ('ALERT-3', 'offline', now)):
+            db.session.add(Device(serial_number=serial, name=serial, make='T', model='T', user_id=user.id,
+                                  presence=presence, presence_changed_at=changed))
+        db.session.commit()
+
+    assert _confirm_alert(serials, time.time() - 600) == ['ALERT-1']
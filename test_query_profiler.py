@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append('.')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import create_engine, text
+
+from query_profiler import QueryProfiler
+
+
+def test_profile_counts_statements_and_flags_repeats():
+    engine = create_engine('sqlite://')
+    profiler = QueryProfiler(slow_ms=0, n_plus_one_threshold=3, explain=True)
+    profiler.attach(engine)
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))  # not profiled
+        token = profiler.start()
+        for i in range(3):
+            conn.execute(text('SELECT :i'), {'i': i})
+        conn.execute(text('SELECT 2'))
+        profile = profiler.stop(token)
+    assert profile.count == 4
+    assert [(sql, n) for sql, n, _ in profile.repeated(3)] == [('SELECT ?', 3)]
+    assert profile.breakdown()['statements'][0]['count'] in (1, 3)
+    assert len(profile.slow) == 4
+
+
+def test_debug_header_reports_query_count():
+    import tracking_software
+    from tracking_software import app, db
+    with app.app_context():
+        db.create_all()
+    tracking_software.QUERY_DEBUG_HEADER = True
+    try:
+        response = app.test_client().get('/diagnostics', headers={'X-Debug-Queries': '1'})
+    finally:
+        tracking_software.QUERY_DEBUG_HEADER = False
+    assert response.headers['X-Query-Count'] == '1'
+    assert 'CURRENT_TIMESTAMP' in response.headers['X-Query-Breakdown']
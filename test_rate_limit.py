@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append('.')
+
+from rate_limit import IngestRateLimiter, MemoryBuckets, PlanLookup
+
+
+def test_bucket_refills_at_rate_up_to_burst():
+    buckets = MemoryBuckets()
+    assert buckets.take('k', rate=1.0, burst=2, now=0.0) == (True, 0.0)
+    assert buckets.take('k', rate=1.0, burst=2, now=0.0) == (True, 0.0)
+    allowed, retry_after = buckets.take('k', rate=1.0, burst=2, now=0.25)
+    assert not allowed and retry_after == 0.75
+    assert buckets.take('k', rate=1.0, burst=2, now=1.0)[0]
+    # Idle time never adds more than the burst
+    assert buckets.take('k', rate=1.0, burst=2, cost=2, now=100.0)[0]
+    assert not buckets.take('k', rate=1.0, burst=2, now=100.0)[0]
+
+
+def test_limits_follow_plan_and_user_bucket_is_shared():
+    owners = {'FREE-1': (1, 'free'), 'FREE-2': (1, 'free'), 'PRO-1': (2, 'pro')}
+    limits = {'device': {'free': (0.001, 2), 'pro': (0.001, 5)},
+              'user': {'free': (0.001, 3), 'pro': (0.001, 100)}}
+    limiter = IngestRateLimiter(PlanLookup(owners.get, ttl=60), limits=limits)
+
+    assert limiter.check({'FREE-1': 2}) is None
+    assert limiter.check({'FREE-1': 1}) >= 1         # device bucket empty
+    assert limiter.check({'FREE-2': 1}) is None      # user bucket has one left
+    assert limiter.check({'FREE-2': 1}) >= 1         # user bucket empty
+    assert limiter.check({'PRO-1': 5}) is None
+    assert limiter.check({'UNKNOWN': 2}) is None     # unknown serials get free device limits
+    counters = limiter.stats()['counters']
+    assert counters['device.free.limited'] == 1 and counters['user.free.limited'] == 1
+    assert counters['device.pro.allowed'] == 5
+
+
+def test_batches_are_charged_in_full_and_larger_than_the_burst_never_fit():
+    limits = {'device': {'free': (1.0, 10), 'pro': (5.0, 60)}, 'user': {'free': (100.0, 40), 'pro': (100.0, 1000)}}
+    limiter = IngestRateLimiter(PlanLookup({'A': (1, 'free'), 'P': (2, 'pro')}.get, ttl=60), limits=limits)
+    assert limiter.too_large({'A': 10, 'P': 60}) is None
+    assert limiter.too_large({'A': 11}) == ('A', 10)
+    assert limiter.too_large({'P': 5000}) == ('P', 60)
+    assert limiter.check({'A': 8}) is None
+    assert limiter.check({'A': 8}) >= 1              # only 2 tokens left, the batch is not capped
+    buckets = MemoryBuckets()
+    assert not buckets.take('k', rate=1.0, burst=10, cost=50, now=0.0)[0]
+    assert not buckets.take('k', rate=1.0, burst=10, cost=50, now=1000.0)[0]
+    buckets.refund('k', burst=10, cost=50)
+    assert buckets.take('k', rate=1.0, burst=10, cost=10, now=1000.0)[0]
+
+
+def test_rejected_requests_are_refunded_everywhere():
+    owners = {'A': (1, 'free'), 'B': (1, 'free'), 'C': (2, 'free')}
+    limits = {'device': {'free': (0.001, 5)}, 'user': {'free': (0.001, 6)}}
+    limiter = IngestRateLimiter(PlanLookup(owners.get, ttl=60), limits=limits)
+
+    # B's device bucket and user 1's bucket can't take 5 more after A's 2...
+    assert limiter.check({'A': 2, 'B': 5}) >= 1
+    # ...so neither A's device bucket nor the user bucket was charged for that request
+    assert limiter.check({'A': 5}) is None
+    assert limiter.check({'B': 1}) is None
+    assert limiter.check({'C': 3, 'A': 1}) >= 1      # A's device bucket is empty
+    assert limiter.check({'C': 5}) is None           # C was refunded
+    counters = limiter.stats()['counters']
+    assert counters['device.free.allowed'] == counters['user.free.allowed'] == 11
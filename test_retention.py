@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append('.')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from datetime import datetime, timedelta
+
+from tracking_software import (app, db, Device, User, DeviceDailySummary, DeviceLocationHistory,
+                               DeviceLocationRollup, trip_analytics)
+from retention import RetentionJob, bucket_start, retention_days_for
+
+SERIAL = 'RETENTION-TEST-001'
+
+
+def _setup():
+    db.create_all()
+    DeviceLocationHistory.query.filter_by(serial_number=SERIAL).delete()
+    DeviceLocationRollup.query.filter_by(serial_number=SERIAL).delete()
+    Device.query.filter_by(serial_number=SERIAL).delete()
+    user = User.query.filter_by(username='retention-user').first()
+    if not user:
+        user = User(username='retention-user', email='retention@example.com', password='x', plan='free')
+        db.session.add(user)
+        db.session.commit()
+    db.session.add(Device(serial_number=SERIAL, name='Retention', make='Test', model='T1', user_id=user.id))
+    db.session.commit()
+
+
+def test_bucket_start_floors_to_interval():
+    assert bucket_start(datetime(2025, 1, 1, 10, 59, 59), 60) == datetime(2025, 1, 1, 10, 0)
+    assert bucket_start(datetime(2025, 1, 1, 10, 59, 59), 15) == datetime(2025, 1, 1, 10, 45)
+    assert retention_days_for(None) == retention_days_for('free')
+
+
+def test_old_points_are_rolled_up_and_expired():
+    with app.app_context():
+        _setup()
+        now = datetime(2025, 6, 1, 12, 0)
+        old = datetime(2025, 5, 20, 8, 0)
+        # Two hours of old points, 5 per hour, plus one recent point
+        for hour in range(2):
+            for i in range(5):
+                db.session.add(DeviceLocationHistory(
+                    serial_number=SERIAL, latitude=1.0 + hour, longitude=36.0 + i,
+                    timestamp=old + timedelta(hours=hour, minutes=i * 10)))
+        db.session.add(DeviceLocationHistory(serial_number=SERIAL, latitude=9.0, longitude=9.0,
+                                             timestamp=now - timedelta(hours=1)))
+        DeviceDailySummary.query.filter_by(serial_number=SERIAL).delete()
+        db.session.add(DeviceDailySummary(serial_number=SERIAL, day=old.date(), point_count=10))
+        db.session.commit()
+
+        # Small batches force buckets to be merged across transactions
+        job = RetentionJob(db, DeviceLocationHistory, DeviceLocationRollup, Device, User,
+                           batch_size=3, pause=0, analytics=trip_analytics)
+        stats = job.run(now=now)
+        assert DeviceDailySummary.query.filter_by(serial_number=SERIAL).count() == 0
+
+        assert stats['rolled_up'] == 10
+        remaining = DeviceLocationHistory.query.filter_by(serial_number=SERIAL).all()
+        assert [p.latitude for p in remaining] == [9.0]
+
+        rollups = DeviceLocationRollup.query.filter_by(serial_number=SERIAL).order_by(
+            DeviceLocationRollup.bucket_start).all()
+        assert len(rollups) == 2
+        first = rollups[0]
+        assert first.point_count == 5
+        assert first.first_longitude == 36.0 and first.last_longitude == 40.0
+        assert abs(first.centroid_longitude - 38.0) < 1e-9
+        assert first.first_timestamp == old and first.last_timestamp == old + timedelta(minutes=40)
+
+
+def test_history_of_deleted_devices_gets_free_plan_retention():
+    with app.app_context():
+        _setup()
+        orphan = 'RETENTION-ORPHAN-001'
+        DeviceLocationHistory.query.filter_by(serial_number=orphan).delete()
+        now = datetime(2025, 6, 1, 12, 0)
+        db.session.add(DeviceLocationHistory(serial_number=orphan, latitude=1.0, longitude=2.0,
+                                             timestamp=now - timedelta(days=retention_days_for('free') + 1)))
+        db.session.commit()
+
+        job = RetentionJob(db, DeviceLocationHistory, DeviceLocationRollup, Device, User, pause=0)
+        assert orphan in job.serials_by_plan()['free']
+        job.run(now=now)
+        assert DeviceLocationHistory.query.filter_by(serial_number=orphan).count() == 0
+        assert DeviceLocationRollup.query.filter_by(serial_number=orphan).count() == 1
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append('.')
+
+import numpy as np
+
+from reverse_geocoder import KDTree, ReverseGeocoder, _unit_vectors
+
+
+def test_kdtree_matches_brute_force():
+    rng = np.random.default_rng(42)
+    lats = rng.uniform(-90, 90, 5000)
+    lons = rng.uniform(-180, 180, 5000)
+    points = _unit_vectors(lats, lons)
+    tree = KDTree(points)
+    for q in _unit_vectors(rng.uniform(-90, 90, 200), rng.uniform(-180, 180, 200)):
+        index, _ = tree.nearest(q.tolist())
+        assert tree.order[index] == np.argmin(((points - q) ** 2).sum(axis=1))
+
+
+def test_lookup_uses_nearest_place_and_cache():
+    geocoder = ReverseGeocoder(['Nairobi, KE', 'Mombasa, KE', 'Suva, FJ'],
+                               [-1.2864, -4.0435, -18.1416], [36.8172, 39.6682, 178.4419],
+                               max_distance_km=50)
+    assert geocoder.lookup(-1.30, 36.80) == 'Nairobi, KE'
+    assert geocoder.lookup(-1.3001, 36.8001) == 'Nairobi, KE'
+    # Across the antimeridian from Suva
+    assert geocoder.lookup(-18.14, -179.9) is None
+    assert geocoder.lookup(-18.2, 178.5) == 'Suva, FJ'
+    assert geocoder.lookup(40.0, -74.0) is None
+    assert geocoder.cache_info().hits == 1
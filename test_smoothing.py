@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append('.')
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from smoothing import KalmanBank, wrap_longitude
+
+T0 = datetime(2025, 1, 1, 12, 0)
+
+
+def test_noisy_fixes_converge_on_a_parked_device():
+    bank = KalmanBank()
+    rng = np.random.default_rng(7)
+    noise = rng.normal(0.0, 0.0002, size=(60, 2))  # ~20 m
+    smoothed = np.array([bank.update('A', -1.2833 + dlat, 36.8167 + dlon, T0 + timedelta(seconds=i), 20.0)
+                         for i, (dlat, dlon) in enumerate(noise)])
+    error = smoothed - [-1.2833, 36.8167]
+    # Once settled the track is much steadier than the raw fixes
+    assert np.sqrt((error[30:] ** 2).mean()) < 0.6 * np.sqrt((noise[30:] ** 2).mean())
+    assert len(bank) == 1
+
+
+def test_coarse_fixes_barely_move_a_good_track():
+    bank = KalmanBank()
+    for i in range(10):
+        bank.update('B', -1.2833, 36.8167, T0 + timedelta(seconds=10 * i), 5.0)
+    # IP geolocation ~5 km off, reported as such
+    lat, lon = bank.update('B', -1.33, 36.8167, T0 + timedelta(seconds=100), 5000.0)
+    assert abs(lat + 1.2833) < 0.001
+    # Without any accuracy the default applies, and huge values don't break the maths
+    lat, lon = bank.update('B', -1.2833, 36.8167, T0 + timedelta(seconds=110), 1e9)
+    assert np.isfinite([lat, lon]).all()
+
+
+def test_antimeridian_crossing_stays_near_the_date_line():
+    bank = KalmanBank()
+    lons = [179.9990, 179.9995, -179.9999, -179.9994, -179.9989]
+    smoothed = [bank.update('C', -17.0, lon, T0 + timedelta(seconds=5 * i), 10.0)[1]
+                for i, lon in enumerate(lons)]
+    assert all(abs(abs(lon) - 180.0) < 0.01 for lon in smoothed)
+    assert all(-180.0 <= lon < 180.0 for lon in smoothed)
+    assert wrap_longitude(np.array([180.0, -190.0, 359.0])).tolist() == [-180.0, 170.0, -1.0]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import sys
+import threading
+import time
+sys.path.append('.')
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from sqlite_edge import WriteBatcher, WriterBusy, apply_pragmas, pragmas_from_env
+
+
+def test_pragmas_applied_to_every_connection(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'edge.db'}")
+    apply_pragmas(engine, pragmas_from_env({"SQLITE_BUSY_TIMEOUT": "1234"}))
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+
+
+def test_concurrent_jobs_share_transactions_and_failures_stay_isolated():
+    transactions = []
+    gate = threading.Event()
+
+    def transaction(jobs):
+        gate.wait()
+        transactions.append(len(jobs))
+        return [job(None) for job in jobs]
+
+    def bad(session):
+        raise ValueError("bad row")
+
+    writer = WriteBatcher(transaction, max_wait=0.05)
+    futures = [writer.submit(lambda session, i=i: i * 2) for i in range(5)]
+    failing = writer.submit(bad)
+    gate.set()
+    assert [future.result(2) for future in futures] == [0, 2, 4, 6, 8]
+    with pytest.raises(ValueError):
+        failing.result(2)
+    # The batch holding the bad job failed once; its jobs were retried one per transaction
+    assert writer.stats()["jobs"] == 5 and writer.stats()["failed_batches"] == 1
+
+
+def test_timed_out_job_is_cancelled():
+    started = threading.Event()
+
+    def transaction(jobs):
+        started.set()
+        time.sleep(0.3)
+        return [job(None) for job in jobs]
+
+    ran = []
+    writer = WriteBatcher(transaction, max_wait=0)
+    writer.submit(lambda session: None)
+    started.wait(1)
+    with pytest.raises(WriterBusy):
+        writer.run(lambda session: ran.append(1), timeout=0.05)
+    time.sleep(0.5)
+    assert ran == []
+
+
+def test_job_already_running_at_timeout_returns_its_result():
+    started = threading.Event()
+
+    def transaction(jobs):
+        started.set()
+        time.sleep(0.3)
+        return [job(None) for job in jobs]
+
+    writer = WriteBatcher(transaction, max_wait=0)
+    # The job is in the running batch when the caller's timeout fires: it will commit,
+    # so reporting "busy" would make the client retry and write it twice
+    assert writer.run(lambda session: 'committed', timeout=0.05) == 'committed'
+    assert started.is_set()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import sys
+import gzip
+import json
+import time
+sys.path.append('.')
+
+from datetime import datetime, timedelta, timezone
+
+from traffic_trace import Sanitizer, TraceRecorder, read_trace, recorder_from_env, restamp, serial_of
+
+
+def test_sanitizer_pseudonymises_and_shifts_consistently():
+    sanitizer = Sanitizer('salt', offset=(1.0, -2.0))
+    arrived = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+    body = sanitizer.body({'serial_number': 'REAL-1', 'latitude': -1.5, 'longitude': 36.5, 'name': 'secret',
+                           'last_seen': '2025-01-01T11:59:30Z', 'acks': [{'command_id': 4, 'status': 'executed',
+                                                                           'note': 'x'}]}, arrived)
+    assert body['serial_number'] == sanitizer.serial('REAL-1') != 'REAL-1'
+    assert (body['latitude'], body['longitude']) == (-0.5, 34.5)
+    assert body['ls_ms'] == -30000 and 'name' not in body
+    assert body['acks'] == [{'command_id': 4, 'status': 'executed'}]
+
+    now = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    assert restamp(body, now)['last_seen'] == (now - timedelta(seconds=30)).isoformat()
+    assert 'ls_ms' in body  # restamp does not modify the stored record
+
+
+def test_recorder_writes_and_replay_merges_files_in_order(tmp_path):
+    recorder = TraceRecorder(str(tmp_path / 'trace'), Sanitizer('salt'))
+    recorder.record('GET', '/api/device_commands/DEV-1', 'DEV-1', None, path_serial='DEV-1')
+    recorder.record('POST', '/api/report_location', 'DEV-1', {'serial_number': 'DEV-1', 'latitude': 1,
+                                                              'longitude': 2})
+    deadline = time.time() + 5
+    while recorder.written < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    other = tmp_path / 'trace.other.jsonl.gz'
+    with gzip.open(other, 'wt') as f:
+        f.write(json.dumps({'t': 0, 'm': 'POST', 'p': '/api/report_location', 'b': {}}) + '\n')
+
+    entries = list(read_trace(sorted(str(p) for p in tmp_path.glob('trace.*.jsonl.gz'))))
+    assert [entry['t'] for entry in entries] == sorted(entry['t'] for entry in entries)
+    assert entries[0]['t'] == 0
+    pseudonym = Sanitizer('salt').serial('DEV-1')
+    assert entries[1]['p'] == f'/api/device_commands/{pseudonym}'
+    assert serial_of(entries[1]) == serial_of(entries[2]) == pseudonym
+
+
+def test_workers_sharing_a_salt_sanitize_identically(monkeypatch):
+    # Each gunicorn worker builds its own Sanitizer; the trace only merges if they agree
+    first, second = Sanitizer('shared-secret'), Sanitizer('shared-secret')
+    assert first.offset == second.offset and first.offset != Sanitizer('other').offset
+    assert -20 <= first.offset[0] <= 20 and -40 <= first.offset[1] <= 40
+    point = {'latitude': -1.28, 'longitude': 36.82}
+    arrived = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    assert first.point(point, arrived) == second.point(point, arrived)
+    assert [first.keep(f'D{i}', 0.5) for i in range(20)] == [second.keep(f'D{i}', 0.5) for i in range(20)]
+
+    monkeypatch.setenv('TRACE_CAPTURE_PATH', '/tmp/unused-trace')
+    monkeypatch.delenv('TRACE_SALT', raising=False)
+    assert recorder_from_env() is None
+
+
+def test_capture_tolerates_bodies_the_view_rejects():
+    import os
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    import tracking_software
+    from tracking_software import app, db
+
+    class Recorder:
+        calls = []
+
+        def record(self, method, path, serial_number, body, path_serial=None):
+            self.calls.append((path, serial_number))
+
+    with app.app_context():
+        db.create_all()
+    recorder, tracking_software.trace_recorder = tracking_software.trace_recorder, Recorder()
+    try:
+        client = app.test_client()
+        assert client.post('/api/command_ack', json=[1, 2]).status_code == 400
+        assert client.post('/api/command_acks', json={'points': ['SN-1'], 'acks': []}).status_code == 200
+    finally:
+        tracking_software.trace_recorder = recorder
+    assert Recorder.calls == [('/api/command_ack', None), ('/api/command_acks', None)]
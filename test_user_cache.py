@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append('.')
+
+from types import SimpleNamespace
+
+from user_cache import UserCache, UserSnapshot
+
+
+def test_cache_hits_until_invalidated():
+    rows = {1: SimpleNamespace(id=1, username='alice', email='a@example.com', plan='free')}
+    loads = []
+
+    def load(user_id):
+        loads.append(user_id)
+        return rows.get(user_id)
+
+    cache = UserCache(load, ttl=60)
+    assert cache.get(1).plan == 'free'
+    assert cache.get(1).is_authenticated
+    assert loads == [1]
+
+    rows[1].plan = 'pro'
+    assert cache.get(1).plan == 'free'
+    cache.invalidate(1)
+    assert cache.get(1).plan == 'pro'
+    assert cache.get(2) is None
+    assert loads == [1, 1, 2]
+
+
+def test_expired_entries_are_reloaded_and_snapshots_are_read_only():
+    cache = UserCache(lambda user_id: SimpleNamespace(id=user_id, username='u', email='e', plan=None), ttl=0)
+    snapshot = cache.get(5)
+    assert snapshot.get_id() == '5' and snapshot.plan == 'free'
+    cache.get(5)
+    assert cache.stats()['misses'] == 2
+    try:
+        snapshot.plan = 'pro'
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError('snapshot should be read-only')
+    assert isinstance(snapshot, UserSnapshot)
@@ -1,3 +1,4 @@
+import os
 import requests
 import subprocess
 import platform
@@ -8,6 +9,10 @@ from datetime import datetime
 
 # ========== CONFIG ==========
 SERVER_URL = "http://localhost:5000/api/report_location"  # Change if using public server
+COMMANDS_URL = "http://localhost:5000/api/device_commands/{serial}"
+# Token returned by /api/register_device for this device
+DEVICE_TOKEN = os.environ.get("DEVICE_TOKEN")
+HEADERS = {"Authorization": f"Bearer {DEVICE_TOKEN}"} if DEVICE_TOKEN else {}
 PING_INTERVAL = 60  # seconds
 
 # ========== SETUP LOGGING ==========
@@ -44,10 +49,27 @@ def get_ip_location():
         logging.warning(f"Failed to get IP location: {e}")
     return None, None
 
+# ========== COMMANDS ==========
+def fetch_commands(serial_number):
+    """Run queued commands; returns acks to send with the next location upload."""
+    try:
+        response = requests.get(COMMANDS_URL.format(serial=serial_number), headers=HEADERS, timeout=10)
+        commands = response.json() if response.status_code == 200 else []
+    except (requests.exceptions.RequestException, ValueError) as err:
+        logging.warning(f"Could not fetch commands: {err}")
+        return []
+    acks = []
+    for command in commands:
+        logging.info(f"⚙️ Command {command['id']}: {command['type']} {command.get('data') or ''}")
+        acks.append({"command_id": command["id"], "status": "executed",
+                     "executed_at": datetime.utcnow().isoformat() + "Z"})
+    return acks
+
 # ========== MAIN LOOP ==========
 def main():
     serial_number = get_serial_number()
     logging.info(f"🛰️ Starting tracker for device serial: {serial_number}")
+    pending_acks = []
 
     while True:
         latitude, longitude = get_ip_location()
@@ -59,11 +81,15 @@ def main():
                 "latitude": latitude,
                 "longitude": longitude
             }
+            if pending_acks:
+                # Acknowledge commands run since the last upload in the same request
+                payload["acks"] = pending_acks
             logging.info(f"→ Sending: {payload}")
             try:
-                response = requests.post(SERVER_URL, json=payload, timeout=10)
+                response = requests.post(SERVER_URL, json=payload, headers=HEADERS, timeout=10)
                 if response.status_code == 200:
                     logging.info("✓ Location updated.")
+                    pending_acks = fetch_commands(serial_number)
                 else:
                     logging.warning(f"Server responded with {response.status_code}: {response.text}")
             except requests.exceptions.RequestException as err:
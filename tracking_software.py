@@ -3,13 +3,14 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from flask_login import LoginManager, current_user
 from models import Device, User, db  
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import json
+import time
 import stripe
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'fallback-secret')
@@ -28,11 +29,70 @@ else:
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+from db_config import (REPLICA_BIND, ReplicaMonitor, RoutingSession, bound_engines, engine_options_from_env,
+                       measure_lag)
+
+# Pool sizing from DB_POOL_* and an optional read replica, see db_config.py
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
+replica_url = os.environ.get('DATABASE_REPLICA_URL')
+if replica_url:
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: replica_url.replace("postgres://", "postgresql://", 1)}
+
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
 migrate = Migrate(app, db)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+# ===================== SQLITE EDGE MODE =====================
+import sqlite_edge
+
+# On by default for the local SQLite fallback; SQLITE_EDGE=0 restores stock SQLite behaviour
+SQLITE_EDGE = (app.config['SQLALCHEMY_DATABASE_URI'].startswith("sqlite")
+               and ":memory:" not in app.config['SQLALCHEMY_DATABASE_URI']
+               and os.environ.get("SQLITE_EDGE", "1") != "0")
+SQLITE_WRITE_TIMEOUT = float(os.environ.get("SQLITE_WRITE_TIMEOUT", 10))
+
+
+def _edge_transaction(jobs):
+    with app.app_context():
+        try:
+            results = [job(db.session) for job in jobs]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return results
+
+
+edge_writer = None
+if SQLITE_EDGE:
+    with app.app_context():
+        sqlite_edge.apply_pragmas(db.engine, sqlite_edge.pragmas_from_env())
+    edge_writer = sqlite_edge.WriteBatcher(_edge_transaction,
+                                           max_batch=int(os.environ.get("SQLITE_WRITE_BATCH", 256)))
+
+
+def run_write(job):
+    """
+    Run job(session) and commit: batched on the edge writer thread when
+    enabled, otherwise in this request's session. Jobs load what they
+    modify through the session they are given (session.get by id is free
+    in the request session), since the writer's session is a different one.
+    """
+    if edge_writer is None:
+        result = job(db.session)
+        db.session.commit()
+        return result
+    return edge_writer.run(job, SQLITE_WRITE_TIMEOUT)
+
+
+@app.errorhandler(sqlite_edge.WriterBusy)
+def sqlite_writer_busy(exc):
+    response = jsonify({"error": str(exc)})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
 @app.context_processor
 def inject_user():
     return dict(current_user=current_user)
@@ -64,13 +124,22 @@ class Device(db.Model):
     # Tracking info
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    smoothed_latitude = db.Column(db.Float)
+    smoothed_longitude = db.Column(db.Float)
     last_updated = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     last_seen = db.Column(db.DateTime)
+    # Written only on online/offline transitions by the presence tracker
+    presence = db.Column(db.String(10), nullable=False, default="offline", server_default="offline")
+    presence_changed_at = db.Column(db.DateTime)
+    # Server clock at the last report; last_seen is the device's own clock and may be skewed
+    last_heartbeat_at = db.Column(db.DateTime)
 
     # Relationship
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
-
+    __table_args__ = (
+        db.Index('ix_device_presence_changed_at', 'presence', 'presence_changed_at'),
+    )
 
     def to_dict(self):
         return {
@@ -90,38 +159,259 @@ class DeviceLocationHistory(db.Model):
     serial_number = db.Column(db.String(100), nullable=False, index=True)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
+    smoothed_latitude = db.Column(db.Float)
+    smoothed_longitude = db.Column(db.Float)
+    place_name = db.Column(db.String(100))
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    is_outlier = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    __table_args__ = (
+        db.Index('ix_device_location_history_serial_timestamp', 'serial_number', 'timestamp'),
+    )
+
+class DeviceLocationRollup(db.Model):
+    """Per-interval summary of history points that aged out of the retention window."""
+    id = db.Column(db.Integer, primary_key=True)
+    serial_number = db.Column(db.String(100), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    bucket_minutes = db.Column(db.Integer, nullable=False, default=60)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    first_latitude = db.Column(db.Float, nullable=False)
+    first_longitude = db.Column(db.Float, nullable=False)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    last_latitude = db.Column(db.Float, nullable=False)
+    last_longitude = db.Column(db.Float, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    centroid_latitude = db.Column(db.Float, nullable=False)
+    centroid_longitude = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('serial_number', 'bucket_start', name='uq_device_location_rollup_bucket'),
+        db.Index('ix_device_location_rollup_bucket_start', 'bucket_start'),
+    )
+
+class DeviceDailySummary(db.Model):
+    """Cached per-device, per-day trip analytics for completed days."""
+    id = db.Column(db.Integer, primary_key=True)
+    serial_number = db.Column(db.String(100), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    distance_m = db.Column(db.Float, nullable=False, default=0.0)
+    moving_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    max_speed_mps = db.Column(db.Float, nullable=False, default=0.0)
+    avg_speed_mps = db.Column(db.Float, nullable=False, default=0.0)
+    stop_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('serial_number', 'day', name='uq_device_daily_summary_day'),
+    )
 
 class DeviceCommand(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     serial_number = db.Column(db.String(100), nullable=False)
     command_type = db.Column(db.String(50), nullable=False)
     command_data = db.Column(db.Text)
-    status = db.Column(db.String(20), default='pending')
+    status = db.Column(db.String(20), default='pending')  # pending, sent, executed, failed, expired
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     executed_at = db.Column(db.DateTime)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    # Queue bookkeeping, see command_queue.py
+    visible_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime)
+    delivery_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    job_id = db.Column(db.Integer, db.ForeignKey('command_job.id'), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_device_command_claim', 'serial_number', 'status', 'visible_at', 'expires_at'),
+        db.Index('ix_device_command_status_expires_at', 'status', 'expires_at'),
+        db.Index('ix_device_command_job_status', 'job_id', 'status'),
+    )
+
+class DeviceTokenRevocation(db.Model):
+    """Device tokens issued before revoked_before_ms (epoch milliseconds) are rejected."""
+    serial_number = db.Column(db.String(100), primary_key=True)
+    revoked_before_ms = db.Column(db.BigInteger, nullable=False)
+
+class DeviceGroup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='uq_device_group_user_name'),
+    )
+
+class DeviceGroupMember(db.Model):
+    group_id = db.Column(db.Integer, db.ForeignKey('device_group.id', ondelete='CASCADE'), primary_key=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('device.id', ondelete='CASCADE'), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_device_group_member_device_id', 'device_id'),
+    )
+
+class CommandJob(db.Model):
+    """A bulk command fanned out to many devices; progress is aggregated from its DeviceCommand rows."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    command_type = db.Column(db.String(50), nullable=False)
+    target = db.Column(db.Text)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+# ===================== RETENTION =====================
+from analytics import TripAnalytics
+from retention import RetentionJob, start_retention_worker
+
+trip_analytics = TripAnalytics(db, DeviceLocationHistory, DeviceDailySummary)
+retention_job = RetentionJob(db, DeviceLocationHistory, DeviceLocationRollup, Device, User,
+                             analytics=trip_analytics)
+
+@app.cli.command("retention")
+def retention_command():
+    """Roll up and expire old location history once."""
+    stats = retention_job.run()
+    print(f"Retention: {stats}")
+    expired, failed = command_queue.expire()
+    print(f"Commands: {expired} expired, {failed} failed")
+
+# Only one process should run the in-app worker; others rely on the CLI/cron job
+if os.environ.get("RETENTION_WORKER") == "1":
+    start_retention_worker(app, retention_job)
 
 # ===================== LOGIN =====================
+from sqlalchemy import update
+from user_cache import UserCache
+
+user_cache = UserCache(lambda user_id: db.session.get(User, user_id))
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    try:
+        return user_cache.get(int(user_id))
+    except (TypeError, ValueError):
+        return None
+
+# ===================== DEVICE AUTH =====================
+from functools import wraps
+from flask import g
+from device_tokens import DeviceTokenSigner, DeviceTokens, RevocationList, now_ms, secret_from_env
+
+# "optional" accepts requests without a token (still rejecting bad ones) while
+# existing devices are re-registered; "required" rejects them
+DEVICE_AUTH_MODE = os.environ.get("DEVICE_AUTH", "optional")
+
+device_tokens = DeviceTokens(
+    DeviceTokenSigner(secret_from_env()),
+    RevocationList(lambda: db.session.query(DeviceTokenRevocation.serial_number,
+                                            DeviceTokenRevocation.revoked_before_ms).all()))
+if DEVICE_AUTH_MODE == "required" and not device_tokens.enabled:
+    raise RuntimeError("DEVICE_AUTH=required needs DEVICE_TOKEN_SECRET or SECRET_KEY")
+
+
+def _device_token():
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        return header[7:].strip()
+    return request.headers.get("X-Device-Token")
+
+
+def device_auth(view):
+    """
+    Authenticate a device endpoint by its token. The serial it names (URL or
+    JSON body) must match the token; g.device_serial is the authenticated
+    serial, or None when an unauthenticated request is allowed.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = _device_token()
+        g.device_serial = None
+        if not token:
+            if DEVICE_AUTH_MODE == "required":
+                return jsonify({"error": "Device token required"}), 401
+            return view(*args, **kwargs)
+        serial_number = device_tokens.verify(token)
+        if serial_number is None:
+            return jsonify({"error": "Invalid or revoked device token"}), 401
+        claimed = kwargs.get("serial_number") or (request.get_json(silent=True) or {}).get("serial_number")
+        if claimed and claimed != serial_number:
+            return jsonify({"error": "Token does not match device"}), 403
+        g.device_serial = serial_number
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def revoke_device_tokens(serial_number, commit=True):
+    """Invalidate every token issued so far for the device; returns the cut-off."""
+    revoked_before = now_ms()
+    row = db.session.get(DeviceTokenRevocation, serial_number)
+    if row is None:
+        db.session.add(DeviceTokenRevocation(serial_number=serial_number, revoked_before_ms=revoked_before))
+    else:
+        row.revoked_before_ms = revoked_before
+    if commit:
+        db.session.commit()
+    device_tokens.revocations.revoke(serial_number, revoked_before)
+    return revoked_before
+
+
+# ===================== READ REPLICA =====================
+from sqlalchemy.exc import OperationalError
+
+replica_monitor = None
+if replica_url:
+    replica_monitor = ReplicaMonitor(lambda: measure_lag(db.engines[REPLICA_BIND]),
+                                     max_lag=float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 5)),
+                                     retry_after=float(os.environ.get("REPLICA_RETRY_SECONDS", 10)))
+
+
+def read_replica(view):
+    """
+    Serve a read-only view's SELECTs from the replica while it is within
+    REPLICA_MAX_LAG_SECONDS of the primary, otherwise from the primary. If
+    the replica fails during the view, it is marked down and the view is
+    re-run against the primary (streamed bodies have passed that point).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if replica_monitor is None:
+            return view(*args, **kwargs)
+        if not replica_monitor.usable():
+            metrics.inc("tracking_db_read_requests_total", labels=(("target", "primary"),))
+            return view(*args, **kwargs)
+        db.session.info["use_replica"] = True
+        try:
+            response = view(*args, **kwargs)
+        except OperationalError:
+            app.logger.exception("Replica read failed; retrying on the primary")
+            replica_monitor.mark_failed()
+            db.session.rollback()
+            db.session.info.pop("use_replica", None)
+            metrics.inc("tracking_db_read_requests_total", labels=(("target", "primary"),))
+            return view(*args, **kwargs)
+        metrics.inc("tracking_db_read_requests_total", labels=(("target", "replica"),))
+        return response
+    return wrapper
+
 
 # ===================== ROUTES =====================
 @app.route('/')
 @login_required
 def index():
     query = request.args.get('query', '').lower()
-    devices = Device.query.filter_by(user_id=current_user.id).all()
+    devices = Device.query.filter_by(user_id=current_user.id)
     if query:
-        devices = [d for d in devices if query in d.serial_number.lower()]
-    return render_template('index.html', devices=devices)
+        # Filter in SQL rather than loading every device and filtering in Python
+        devices = devices.filter(func.lower(Device.serial_number).contains(query, autoescape=True))
+    return render_template('index.html', devices=devices.all())
 
 import csv
 from flask import Response
 
 @app.route('/export/<serial_number>', methods=['GET'])
 @login_required
+@read_replica
 def export_device_history(serial_number):
     # Fetch device to confirm user owns it
     device = Device.query.filter_by(serial_number=serial_number, user_id=current_user.id).first()
@@ -180,8 +470,11 @@ def checkout(plan):
 @app.route("/payment_success/<plan>")
 @login_required
 def payment_success(plan):
-    current_user.plan = plan
+    # current_user is a cached read-only snapshot, so update the row itself
+    db.session.execute(update(User).where(User.id == current_user.id).values(plan=plan))
     db.session.commit()
+    user_cache.invalidate(current_user.id)
+    ingest_limiter.plan_lookup.invalidate_user(current_user.id)
     flash(f"✅ Payment successful! You are now on the {plan.capitalize()} Plan.")
     return redirect(url_for("dashboard"))
 
@@ -204,6 +497,7 @@ def register():
 
 @app.route('/live_map/<serial_number>')
 @login_required
+@read_replica
 def live_map(serial_number):
     device = Device.query.filter_by(serial_number=serial_number, user_id=current_user.id).first()
     if not device:
@@ -247,7 +541,29 @@ def edit_device(device_id):
 
 @app.route("/api/register_device", methods=["POST"])
 def api_register_device():
-    data = request.json
+    """
+    Register a device for the logged-in user, or for the account named by
+    "email"/"password" in the body (device clients). Returns the device token.
+    Registering a serial the account already owns revokes its old tokens and
+    returns a new one; a serial owned by another account is a 409.
+    """
+    data = request.json or {}
+    if current_user.is_authenticated:
+        user_id = current_user.id
+    else:
+        user = User.query.filter_by(email=data.get("email")).first()
+        if not user or not check_password_hash(user.password, data.get("password") or ""):
+            return jsonify({"error": "Login or account credentials required"}), 401
+        user_id = user.id
+    existing = Device.query.filter_by(serial_number=data.get("serial_number")).first()
+    if existing:
+        if existing.user_id != user_id:
+            return jsonify({"error": "Device already registered"}), 409
+        # The owner re-registering (e.g. a reinstalled client) gets a fresh token; older ones stop working
+        revoked_before = revoke_device_tokens(existing.serial_number)
+        return jsonify({"message": "Device already registered; token reissued",
+                        "device_token": device_tokens.issue(existing.serial_number,
+                                                            issued_at_ms=revoked_before)}), 200
     try:
         serial_number = data.get("serial_number")
         name = data.get("name")
@@ -258,7 +574,6 @@ def api_register_device():
         current_location = data.get("current_location")
         latitude = data.get("latitude")
         longitude = data.get("longitude")
-        user_id = data.get("user_id")
 
         timestamp = datetime.now(timezone.utc)
 
@@ -279,48 +594,53 @@ def api_register_device():
         db.session.add(new_device)
         db.session.commit()
 
-        return jsonify({"message": "Device registered successfully"}), 200
+        return jsonify({"message": "Device registered successfully",
+                        "device_token": device_tokens.issue(serial_number)}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-    # Create new device
-    new_device = Device(
-        serial_number=serial_number,
-        make=make,
-        model=model,
-        device_type=device_type,
-        os_version=os_version,
-        app_version=app_version,
-        last_seen=timestamp
-    )
-    db.session.add(new_device)
-    db.session.commit()
-    return jsonify({"message": "Device registered successfully"}), 201
+@app.route("/api/devices/<serial_number>/token", methods=["POST"])
+@login_required
+def rotate_device_token(serial_number):
+    """Revoke the device's existing tokens and issue a new one."""
+    device = Device.query.filter_by(serial_number=serial_number, user_id=current_user.id).first()
+    if not device:
+        return jsonify({"error": "Device not found"}), 404
+    if not device_tokens.enabled:
+        return jsonify({"error": "Device tokens are not configured"}), 503
+    revoked_before = revoke_device_tokens(serial_number)
+    return jsonify({"device_token": device_tokens.issue(serial_number, issued_at_ms=revoked_before)})
 
 @app.route('/api/device_location/<serial_number>', methods=['GET'])
 @login_required
+@read_replica
 def get_device_location_api(serial_number):
     """
     Returns the latest location and info of a device by serial_number.
     """
-    device = Device.query.filter_by(serial_number=serial_number, user_id=current_user.id).first()
-    
-    if not device or device.latitude is None or device.longitude is None:
+    found, device = position_store.device(serial_number) if position_store is not None else (None, None)
+    if found is None:
+        device = Device.query.filter_by(serial_number=serial_number, user_id=current_user.id).first()
+        device = device and {name: getattr(device, name) for name in STORE_FIELDS}
+    elif device and device['user_id'] != current_user.id:
+        device = None
+
+    if not device or device['latitude'] is None or device['longitude'] is None:
         return jsonify({'error': 'Device not found or no location available'}), 404
 
     return jsonify({
-        'name': device.name,
-        'serial_number': device.serial_number,
-        'make': device.make,
-        'model': device.model,
-        'device_type': device.device_type,
-        'current_status': device.current_status,
-        'current_location': device.current_location,
-        'latitude': device.latitude,
-        'longitude': device.longitude,
-        'last_seen': device.last_seen.isoformat() if device.last_seen else None
+        'name': device['name'],
+        'serial_number': device['serial_number'],
+        'make': device['make'],
+        'model': device['model'],
+        'device_type': device['device_type'],
+        'current_status': device['current_status'],
+        'current_location': device['current_location'],
+        'latitude': device['latitude'],
+        'longitude': device['longitude'],
+        'last_seen': device['last_seen'].isoformat() if device['last_seen'] else None
     })
 
 
@@ -333,6 +653,7 @@ def delete_device(device_id):
         return redirect(url_for('index'))
 
     db.session.delete(device)
+    revoke_device_tokens(device.serial_number, commit=False)
     db.session.commit()
     flash("Device deleted.")
     return redirect(url_for('index'))
@@ -408,94 +729,608 @@ def search_device():
 @app.route('/map')
 @login_required
 def map_view():
-    devices = Device.query.filter_by(user_id=current_user.id).all()
-    return render_template('map.html', devices=devices)
+    # map.html never reads a device list, so don't query one
+    return render_template('map.html')
+
+# ===================== POSITION STORE =====================
+import hashlib
+import threading
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import object_session
+from position_store import PositionStore
+
+# Latest device rows in host-wide shared memory for the map endpoints; only for
+# deployments where every writer runs on this host (see position_store.py)
+POSITION_STORE_ENABLED = os.environ.get("POSITION_STORE") == "1"
+STORE_FIELDS = ("id", "user_id", "serial_number", "name", "make", "model", "device_type", "current_status",
+                "current_location", "latitude", "longitude", "last_seen", "presence")
+STORE_RELOAD, STORE_DELETE = "reload", "delete"
+
+position_store = None
+if POSITION_STORE_ENABLED:
+    position_store = PositionStore(hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12],
+                                   capacity=int(os.environ.get("POSITION_STORE_SLOTS", 65536)),
+                                   name=os.environ.get("POSITION_STORE_NAME"))
+POSITION_STORE_RETRY_SECONDS = float(os.environ.get("POSITION_STORE_RETRY_SECONDS", 10))
+_position_loader_pid = None
+_position_loader_retry_at = 0.0
+_position_loader_lock = threading.Lock()
+
+
+def _store_rows(where=None):
+    query = select(*(getattr(Device, name) for name in STORE_FIELDS))
+    if where is not None:
+        query = query.where(where)
+    with db.engine.connect() as conn:
+        for row in conn.execute(query.execution_options(yield_per=5000)):
+            yield dict(zip(STORE_FIELDS, row))
+
+
+def _bootstrap_position_store():
+    global _position_loader_pid, _position_loader_retry_at
+    try:
+        with app.app_context():
+            position_store.bootstrap(_store_rows)
+    except Exception:
+        app.logger.exception("Position store load failed; retrying in %.0fs", POSITION_STORE_RETRY_SECONDS)
+    if not position_store.ready:
+        # Failed here, or another worker is still loading (and may fail): check again later
+        with _position_loader_lock:
+            _position_loader_pid = None
+            _position_loader_retry_at = time.monotonic() + POSITION_STORE_RETRY_SECONDS
+
+
+@app.before_request
+def start_position_store():
+    global _position_loader_pid
+    if position_store is None or _position_loader_pid == os.getpid():
+        return
+    with _position_loader_lock:
+        if _position_loader_pid == os.getpid() or time.monotonic() < _position_loader_retry_at:
+            return
+        _position_loader_pid = os.getpid()
+    if not position_store.ready:
+        threading.Thread(target=_bootstrap_position_store, name="position-store-load", daemon=True).start()
+
+
+def _remember_device(mapper, connection, target):
+    values = sa_inspect(target).dict
+    change = ({name: values[name] for name in STORE_FIELDS}
+              if all(name in values for name in STORE_FIELDS) else STORE_RELOAD)
+    object_session(target).info.setdefault("position_store", {})[target.id] = change
+
+
+def _forget_device(mapper, connection, target):
+    object_session(target).info.setdefault("position_store", {})[target.id] = STORE_DELETE
+
+
+def _publish_device_changes(session):
+    """After a commit, copy the Device rows it changed into the store (ingest included)."""
+    changes = session.info.pop("position_store", None)
+    if not changes:
+        return
+    reload = []
+    for device_id, change in changes.items():
+        if change == STORE_DELETE:
+            position_store.remove(device_id)
+        elif change == STORE_RELOAD:
+            reload.append(device_id)
+        else:
+            position_store.put(change)
+    if reload:
+        for row in _store_rows(Device.id.in_(reload)):
+            position_store.put(row)
+
+
+def _discard_device_changes(session):
+    session.info.pop("position_store", None)
+
+
+if position_store is not None:
+    event.listen(Device, "after_insert", _remember_device)
+    event.listen(Device, "after_update", _remember_device)
+    event.listen(Device, "after_delete", _forget_device)
+    event.listen(RoutingSession, "after_commit", _publish_device_changes)
+    event.listen(RoutingSession, "after_rollback", _discard_device_changes)
+
 
 # ===================== API ROUTES ====================
 
+import lean_json
+from flask import stream_with_context
+from sqlalchemy import func, select
+
+
+def lean_jsonify(payload):
+    """jsonify() for large row lists built with lean_json.records()."""
+    return app.response_class(lean_json.dumps(payload), mimetype="application/json")
+
+
+MAP_DEVICE_KEYS = ("id", "name", "serial_number", "latitude", "longitude", "last_seen", "status")
+
 @app.route('/api/devices')
 @login_required
+@read_replica
 def api_devices():
-    devices = Device.query.all()
-
-    def get_status(device):
-        if device.last_seen:
-            # Make last_seen timezone-aware
-            last_seen_utc = device.last_seen
-            if device.last_seen.tzinfo is None:
-                last_seen_utc = device.last_seen.replace(tzinfo=timezone.utc)
-
-            if datetime.now(timezone.utc) - last_seen_utc <= timedelta(minutes=5):
-                return "online"
-        return "offline"
-
-    devices_data = []
-    for d in devices:
-        devices_data.append({
-            "id": d.id,
-            "name": d.name,
-            "serial_number": d.serial_number,
-            "latitude": d.latitude,
-            "longitude": d.longitude,
-            "last_seen": d.last_seen.isoformat() if d.last_seen else None,
-            "status": get_status(d)
-        })
-
-    return jsonify(devices_data)
+    rows = position_store.user_devices(current_user.id) if position_store is not None else None
+    if rows is not None:
+        return lean_jsonify(lean_json.records(MAP_DEVICE_KEYS, rows, {"last_seen": lean_json.ISO}))
+    # Only the caller's devices, and only the columns the map needs, as plain tuples
+    rows = db.session.execute(
+        select(Device.id, Device.name, Device.serial_number, Device.latitude, Device.longitude,
+               Device.last_seen,
+               # Maintained by the presence tracker on transitions only
+               func.coalesce(Device.presence, "offline"))
+        .where(Device.user_id == current_user.id)
+    ).all()
+    return lean_jsonify(lean_json.records(MAP_DEVICE_KEYS, rows, {"last_seen": lean_json.ISO}))
+
+
+MAX_ANALYTICS_DAYS = 92
+
+@app.route('/api/analytics/daily')
+@login_required
+def api_daily_analytics():
+    """
+    Per-device, per-day distance, moving time, speeds and stops for the
+    caller's devices. Query params: start, end (YYYY-MM-DD), serial (optional).
+    """
+    today = datetime.now(timezone.utc).date()
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else today
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=6)
+    except ValueError:
+        return jsonify({'error': 'start and end must be YYYY-MM-DD'}), 400
+    if start > end or (end - start).days >= MAX_ANALYTICS_DAYS:
+        return jsonify({'error': f'Range must be between 1 and {MAX_ANALYTICS_DAYS} days'}), 400
+
+    query = db.session.query(Device.serial_number).filter(Device.user_id == current_user.id)
+    if request.args.get('serial'):
+        query = query.filter(Device.serial_number == request.args['serial'])
+    serials = [row[0] for row in query.all()]
+
+    summaries = trip_analytics.daily(serials, start, end, today=today)
+    data = [
+        {'serial_number': serial, 'day': day.isoformat(), **summary}
+        for (serial, day), summary in sorted(summaries.items())
+    ]
+    return jsonify(data)
+
+
+from motion_filter import MotionFilter
+
+motion_filter = MotionFilter()
+# "reject" drops implausible points; "flag" keeps them in history marked is_outlier
+MOTION_FILTER_MODE = os.environ.get("MOTION_FILTER_MODE", "reject")
+
+from smoothing import KalmanBank
+
+# Optional Kalman smoothing; smoothed coordinates are stored next to the raw ones
+SMOOTHING_ENABLED = os.environ.get("SMOOTHING_ENABLED") == "1"
+kalman_bank = KalmanBank()
+
+import reverse_geocoder
+
+# Offline place names for reported points (None unless GAZETTEER_PATH is set)
+place_geocoder = reverse_geocoder.load_from_env()
+
+
+def place_name(latitude, longitude):
+    """Local reverse-geocoded label that fits Device.current_location, or None."""
+    if place_geocoder is None:
+        return None
+    label = place_geocoder.lookup(latitude, longitude)
+    return label[:100] if label else None
+
+# ===================== ENRICHMENT PIPELINE =====================
+from sqlalchemy import bindparam, insert, update
+from enrichment import Pipeline, Stage
+
+
+def _geocode_stage(points):
+    for point in points:
+        point["place_name"] = place_name(point["latitude"], point["longitude"])
+    return [point for point in points if point["place_name"]]
+
+
+def _write_stage(points):
+    with app.app_context():
+        db.session.execute(update(DeviceLocationHistory),
+                           [{"id": p["id"], "place_name": p["place_name"]} for p in points])
+        # Only label the device if this point is still its latest one
+        device_rows = [{"b_serial": p["serial_number"], "b_seen": p["timestamp"], "b_place": p["place_name"]}
+                       for p in points if p["update_device"]]
+        if device_rows:
+            device = Device.__table__
+            db.session.execute(
+                update(device)
+                .where(device.c.serial_number == bindparam("b_serial"), device.c.last_seen <= bindparam("b_seen"))
+                .values(current_location=bindparam("b_place")),
+                device_rows)
+        db.session.commit()
+    if position_store is not None:
+        for row in device_rows:
+            position_store.label(row["b_serial"], row["b_seen"], row["b_place"])
+    return points
+
+
+# Ingest only persists raw points; place names are filled in by these workers
+enrichment_pipeline = Pipeline([
+    Stage("geocode", _geocode_stage, workers=int(os.environ.get("ENRICHMENT_WORKERS", 2)),
+          batch_size=int(os.environ.get("ENRICHMENT_BATCH_SIZE", 200)),
+          maxsize=int(os.environ.get("ENRICHMENT_QUEUE_SIZE", 50000))),
+    Stage("write", _write_stage, workers=1, batch_size=500, max_wait=0.2,
+          maxsize=int(os.environ.get("ENRICHMENT_QUEUE_SIZE", 50000))),
+])
+ENRICHMENT_ENABLED = place_geocoder is not None
+
+
+def enqueue_enrichment(point_id, serial_number, latitude, longitude, timestamp, update_device):
+    if ENRICHMENT_ENABLED:
+        enrichment_pipeline.submit({"id": point_id, "serial_number": serial_number, "latitude": latitude,
+                                    "longitude": longitude, "timestamp": timestamp,
+                                    "update_device": update_device})
+
+
+def past_days(points):
+    """(serial_number, UTC day) of points from before today, whose cached analytics they change."""
+    today = datetime.now(timezone.utc).date()
+    days = {(serial_number, timestamp.astimezone(timezone.utc).date()) for serial_number, timestamp in points}
+    return {key for key in days if key[1] < today}
+
+
+def parse_timestamp(value):
+    """Parse a client ISO timestamp as UTC, falling back to now."""
+    if value:
+        try:
+            timestamp = datetime.fromisoformat(value)
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            return timestamp
+        except (TypeError, ValueError):
+            pass
+    return datetime.now(timezone.utc)
+
+
+# ===================== RATE LIMITING =====================
+from collections import Counter
+from rate_limit import IngestRateLimiter, PlanLookup, backend_from_env
+
+
+def _device_owner(serial_number):
+    row = (db.session.query(Device.user_id, User.plan)
+           .join(User, User.id == Device.user_id)
+           .filter(Device.serial_number == serial_number).first())
+    return (row[0], row[1] or "free") if row else None
+
+
+ingest_limiter = IngestRateLimiter(PlanLookup(_device_owner), backend_from_env(),
+                                   enabled=os.environ.get("RATE_LIMIT_ENABLED", "1") != "0")
+
+
+def rate_limited(serial_counts):
+    """429 response if ingesting {serial: points} would exceed a device or user limit, else None."""
+    retry_after = ingest_limiter.check(serial_counts)
+    if retry_after is None:
+        return None
+    response = jsonify({"error": "Rate limit exceeded", "retry_after": retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+@app.route('/api/rate_limit_stats')
+def rate_limit_stats():
+    """Allowed/limited point counts per scope and plan in this worker."""
+    return jsonify(ingest_limiter.stats())
 
 
 @app.route("/api/report_location", methods=["POST"])
+@device_auth
 def api_report_location():
     data = request.json
     serial_number = data.get("serial_number")
-    latitude = data.get("latitude")
-    longitude = data.get("longitude")
-    last_seen = data.get("last_seen")
+    limited = rate_limited({serial_number: 1})
+    if limited:
+        return limited
+    latitude = parse_float(data.get("latitude"))
+    longitude = parse_float(data.get("longitude"))
+    last_seen = parse_timestamp(data.get("last_seen"))
     current_location = data.get("current_location")
     current_status = data.get("current_status")
 
+    if latitude is None or longitude is None:
+        return jsonify({"error": "latitude and longitude are required"}), 400
+
     device = Device.query.filter_by(serial_number=serial_number).first()
-    if device:
-        device.latitude = latitude
-        device.longitude = longitude
-        device.last_seen = datetime.fromisoformat(last_seen)
-        device.current_location = current_location
-        device.current_status = current_status
-        db.session.commit()
-        return jsonify({"message": "Location updated"}), 200
-    else:
+    if not device:
         return jsonify({"error": "Device not found"}), 404
 
+    accepted, _ = motion_filter.check(serial_number, latitude, longitude, last_seen,
+                                      prior=(device.latitude, device.longitude, device.last_seen))
+    if not accepted and MOTION_FILTER_MODE != "flag":
+        metrics.inc("tracking_ingested_points_total", labels=(("outcome", "rejected"),))
+        response = {"message": "Location ignored (implausible jump)", "accepted": False}
+        if data.get("acks"):
+            response["acks"] = apply_acks(data["acks"], serial_number)
+        return jsonify(response), 200
+
+    smoothed_latitude = smoothed_longitude = None
+    if accepted and SMOOTHING_ENABLED:
+        smoothed_latitude, smoothed_longitude = kalman_bank.update(
+            serial_number, latitude, longitude, last_seen, parse_float(data.get("accuracy")))
+
+    device_id = device.id
+
+    def write(session):
+        device = session.get(Device, device_id)
+        entry = DeviceLocationHistory(serial_number=serial_number, latitude=latitude,
+                                      longitude=longitude, timestamp=last_seen,
+                                      smoothed_latitude=smoothed_latitude,
+                                      smoothed_longitude=smoothed_longitude,
+                                      is_outlier=not accepted)
+        session.add(entry)
+        # Outliers never move the device, so the map shows no "Moved!" alert for them
+        if accepted:
+            device.latitude = latitude
+            device.longitude = longitude
+            device.smoothed_latitude = smoothed_latitude
+            device.smoothed_longitude = smoothed_longitude
+            device.current_location = current_location or device.current_location
+            device.current_status = current_status or device.current_status
+        device.last_seen = last_seen
+        came_online = mark_online(device)
+        if accepted:
+            trip_analytics.invalidate(past_days([(serial_number, last_seen)]), session)
+        session.flush()
+        return entry.id, came_online
+
+    entry_id, came_online = run_write(write)
+    metrics.inc("tracking_ingested_points_total", labels=(("outcome", "accepted" if accepted else "outlier"),))
+    if came_online:
+        presence_tracker.emit("online", serial_number)
+    if accepted:
+        enqueue_enrichment(entry_id, serial_number, latitude, longitude, last_seen,
+                           update_device=not current_location)
+    response = {"message": "Location updated", "accepted": accepted}
+    if data.get("acks"):
+        response["acks"] = apply_acks(data["acks"], serial_number)
+    return jsonify(response), 200
+
+
+MAX_POINTS_PER_BATCH = 1000
+
+
+@app.route("/api/report_locations", methods=["POST"])
+@device_auth
+def api_report_locations():
+    """
+    Batch ingest: {"points": [{"serial_number", "latitude", "longitude", "last_seen", "accuracy"}, ...],
+    "serial_number", "acks": [...]}. Points for unknown devices or without coordinates are skipped,
+    as are points for other devices when the request carries a device token;
+    piggybacked acks are applied as by /api/command_acks. A batch of more than MAX_POINTS_PER_BATCH
+    points, or with more points for one device than its rate limit burst, is rejected with 413.
+    """
+    payload = request.json or {}
+    points = payload.get("points") or []
+    if len(points) > MAX_POINTS_PER_BATCH:
+        return jsonify({"error": f"At most {MAX_POINTS_PER_BATCH} points per request"}), 413
+    if g.device_serial:
+        points = [point if point.get("serial_number") == g.device_serial else {} for point in points]
+    serial_counts = Counter(point["serial_number"] for point in points if point.get("serial_number"))
+    too_large = ingest_limiter.too_large(serial_counts)
+    if too_large:
+        serial_number, burst = too_large
+        return jsonify({"error": f"At most {burst} points per request for {serial_number}", "max_points": burst}), 413
+    limited = rate_limited(serial_counts)
+    if limited:
+        return limited
+    response = _ingest_points(points)
+    if payload.get("acks"):
+        response["acks"] = apply_acks(payload["acks"], g.device_serial or payload.get("serial_number"))
+    return jsonify(response), 200
+
+
+def _ingest_points(points):
+    rows = []
+    for point in points:
+        latitude = parse_float(point.get("latitude"))
+        longitude = parse_float(point.get("longitude"))
+        if point.get("serial_number") and latitude is not None and longitude is not None:
+            rows.append((point["serial_number"], latitude, longitude, parse_timestamp(point.get("last_seen")),
+                         parse_float(point.get("accuracy"))))
+    if not rows:
+        return {"accepted": 0, "rejected": 0, "skipped": len(points)}
+
+    serials = {r[0] for r in rows}
+    devices = {d.serial_number: d for d in Device.query.filter(Device.serial_number.in_(serials)).all()}
+    rows = [r for r in rows if r[0] in devices]
+    if not rows:
+        return {"accepted": 0, "rejected": 0, "skipped": len(points)}
+
+    serial_col, lat_col, lon_col, ts_col, acc_col = zip(*rows)
+    priors = {serial_number: (device.latitude, device.longitude, device.last_seen)
+              for serial_number, device in devices.items()}
+    mask = motion_filter.filter_batch(serial_col, lat_col, lon_col, ts_col, priors=priors).tolist()
+
+    smoothed = {}
+    if SMOOTHING_ENABLED:
+        keep = [i for i, accepted in enumerate(mask) if accepted]
+        if keep:
+            sm_lat, sm_lon = kalman_bank.update_many(
+                [serial_col[i] for i in keep], [lat_col[i] for i in keep], [lon_col[i] for i in keep],
+                [ts_col[i] for i in keep], [acc_col[i] for i in keep])
+            smoothed = dict(zip(keep, zip(sm_lat.tolist(), sm_lon.tolist())))
+
+    history = []
+    latest = {}
+    for i, ((serial_number, latitude, longitude, timestamp, _), accepted) in enumerate(zip(rows, mask)):
+        smoothed_latitude, smoothed_longitude = smoothed.get(i, (None, None))
+        if accepted or MOTION_FILTER_MODE == "flag":
+            history.append({"serial_number": serial_number, "latitude": latitude, "longitude": longitude,
+                            "smoothed_latitude": smoothed_latitude, "smoothed_longitude": smoothed_longitude,
+                            "timestamp": timestamp, "is_outlier": not accepted})
+        if accepted and (serial_number not in latest or timestamp >= latest[serial_number][2]):
+            latest[serial_number] = (latitude, longitude, timestamp, smoothed_latitude, smoothed_longitude)
+    device_ids = {serial_number: device.id for serial_number, device in devices.items()}
+    late_days = past_days((point["serial_number"], point["timestamp"]) for point in history
+                          if not point["is_outlier"])
+
+    def write(session):
+        history_ids = []
+        if history:
+            history_ids = session.execute(
+                insert(DeviceLocationHistory).returning(DeviceLocationHistory.id, sort_by_parameter_order=True),
+                history).scalars().all()
+            trip_analytics.invalidate(late_days, session)
+        came_online = []
+        for serial_number, (latitude, longitude, timestamp, smoothed_latitude, smoothed_longitude) in latest.items():
+            device = session.get(Device, device_ids[serial_number])
+            device.latitude = latitude
+            device.longitude = longitude
+            device.smoothed_latitude = smoothed_latitude
+            device.smoothed_longitude = smoothed_longitude
+            device.last_seen = timestamp
+            if mark_online(device):
+                came_online.append(serial_number)
+        return history_ids, came_online
+
+    history_ids, came_online = run_write(write)
+    for serial_number in came_online:
+        presence_tracker.emit("online", serial_number)
+
+    for point_id, point in zip(history_ids, history):
+        if not point["is_outlier"]:
+            enqueue_enrichment(point_id, point["serial_number"], point["latitude"], point["longitude"],
+                               point["timestamp"], update_device=True)
+
+    accepted_count = sum(mask)
+    metrics.inc("tracking_ingested_points_total", accepted_count, (("outcome", "accepted"),))
+    if len(rows) - accepted_count:
+        outcome = "outlier" if MOTION_FILTER_MODE == "flag" else "rejected"
+        metrics.inc("tracking_ingested_points_total", len(rows) - accepted_count, (("outcome", outcome),))
+    return {"accepted": accepted_count, "rejected": len(rows) - accepted_count,
+            "skipped": len(points) - len(rows)}
+
+
+# ===================== PRESENCE =====================
+from presence import PresenceTracker
+
+
+def _naive_utc_from_epoch(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+def _confirm_offline(serials, cutoff):
+    """Flip expired devices to offline unless another worker saw a newer heartbeat."""
+    device = Device.__table__
+    with app.app_context():
+        result = db.session.execute(
+            update(device)
+            .where(device.c.serial_number.in_(serials), device.c.presence == "online",
+                   (device.c.last_heartbeat_at == None)  # noqa: E711
+                   | (device.c.last_heartbeat_at < _naive_utc_from_epoch(cutoff)))
+            .values(presence="offline", presence_changed_at=datetime.now(timezone.utc))
+            .returning(device.c.serial_number, device.c.id))
+        rows = result.all()
+        db.session.commit()
+    changed = [serial_number for serial_number, _ in rows]
+    if position_store is not None:
+        for _, device_id in rows:
+            position_store.update(device_id, online=False)
+    return changed
+
+
+def _confirm_alert(serials, cutoff):
+    """Serials still offline since before cutoff; one that came back through another worker is skipped."""
+    with app.app_context():
+        rows = (db.session.query(Device.serial_number)
+                .filter(Device.serial_number.in_(serials), Device.presence == "offline",
+                        Device.presence_changed_at <= _naive_utc_from_epoch(cutoff)).all())
+        db.session.rollback()
+    return [serial_number for serial_number, in rows]
+
+
+def _bootstrap_presence(tracker):
+    with app.app_context():
+        rows = (db.session.query(Device.serial_number, Device.last_heartbeat_at)
+                .filter(Device.presence == "online").all())
+        db.session.rollback()
+    for serial_number, heard_at in rows:
+        seen = heard_at.replace(tzinfo=heard_at.tzinfo or timezone.utc).timestamp() if heard_at else 0
+        tracker.track(serial_number, seen)
+
+
+def _log_presence(event, serial_number, at):
+    app.logger.info("Device %s is %s", serial_number, event)
+
+
+presence_tracker = PresenceTracker(_confirm_offline, confirm_alert=_confirm_alert)
+presence_tracker.subscribe(_log_presence)
+
+
+@app.before_request
+def start_presence_sweeper():
+    if os.environ.get("PRESENCE_SWEEPER", "1") == "1":
+        presence_tracker.start(bootstrap=_bootstrap_presence)
+
+
+def mark_online(device):
+    """Record a heartbeat; returns True if the device just came online (caller commits, then emits)."""
+    presence_tracker.heartbeat(device.serial_number)
+    now = datetime.now(timezone.utc)
+    device.last_heartbeat_at = now
+    if device.presence == "online":
+        return False
+    device.presence = "online"
+    device.presence_changed_at = now
+    return True
+
+
+@app.route('/api/pipeline_stats')
+def pipeline_stats():
+    """Queue depth, throughput and latency per enrichment stage in this worker."""
+    return jsonify({"enabled": ENRICHMENT_ENABLED, "stages": enrichment_pipeline.stats()})
+
+
+LOCATION_KEYS = ("serial_number", "latitude", "longitude", "last_seen")
+STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", 1000))
+
+
+def _located_device_chunks():
+    # yield_per streams from a server-side cursor (Postgres) or fetchmany (SQLite),
+    # so only one chunk of rows is held at a time
+    result = db.session.execute(
+        select(Device.serial_number, Device.latitude, Device.longitude, Device.last_seen)
+        .where(Device.latitude.is_not(None), Device.longitude.is_not(None))
+        .execution_options(yield_per=STREAM_CHUNK_ROWS))
+    yield from result.partitions()
+
+
+def stream_locations(formats):
+    """Fleet-sized array streamed chunk by chunk; memory stays flat however many devices match."""
+    chunks = position_store.locations(STREAM_CHUNK_ROWS) if position_store is not None else None
+    body = lean_json.iter_array(LOCATION_KEYS, chunks or _located_device_chunks(), formats)
+    return Response(stream_with_context(body), mimetype="application/json")
+
 
 @app.route('/api/live_locations')
+@read_replica
 def live_locations():
-    devices = Device.query.all()
-    data = [
-        {
-            'serial_number': d.serial_number,
-            'latitude': d.latitude,
-            'longitude': d.longitude,
-            'last_seen': d.last_seen.strftime('%Y-%m-%d %H:%M:%S') if d.last_seen else None
-        }
-        for d in devices
-        if d.latitude is not None and d.longitude is not None
-    ]
-    return jsonify(data)
+    return stream_locations({"last_seen": lean_json.seconds})
 
 @app.route("/api/all_devices")
+@read_replica
 def all_devices():
-    devices = Device.query.all()
-    data = []
-    for d in devices:
-        if d.latitude is not None and d.longitude is not None:
-            data.append({
-                "serial_number": d.serial_number,
-                "latitude": d.latitude,
-                "longitude": d.longitude,
-                "last_seen": d.last_seen.isoformat() if d.last_seen else None
-            })
-    return jsonify(data)
+    return stream_locations({"last_seen": lean_json.ISO})
+
 
+from command_queue import CommandQueue
+from command_notify import CommandNotifier
+
+command_queue = CommandQueue(db, DeviceCommand)
+command_notifier = CommandNotifier(db)
+LONGPOLL_MAX_SECONDS = 30
 
 @app.route('/api/send_command', methods=['POST'])
 @login_required
@@ -504,30 +1339,202 @@ def send_command():
     device = Device.query.filter_by(serial_number=data.get('serial_number'), user_id=current_user.id).first()
     if not device:
         return jsonify({'error': 'Device not found'}), 404
-    command = DeviceCommand(
+    command_id = command_queue.enqueue(
         serial_number=data.get('serial_number'),
         command_type=data.get('command_type'),
-        command_data=json.dumps(data.get('command_data', {})),
-        user_id=current_user.id
+        command_data=data.get('command_data', {}),
+        user_id=current_user.id,
+        ttl=parse_float(data.get('ttl_seconds')),
+        commit=False,
     )
-    db.session.add(command)
+    command_notifier.publish(device.serial_number)
     db.session.commit()
-    return jsonify({'message': 'Command sent', 'command_id': command.id})
+    command_notifier.notify_local(device.serial_number)
+    return jsonify({'message': 'Command sent', 'command_id': command_id})
+
+
+def serialize_commands(rows):
+    return [{
+        'id': row.id,
+        'type': row.command_type,
+        'data': json.loads(row.command_data or '{}'),
+        'created_at': row.created_at.isoformat(),
+        'attempt': row.delivery_count,
+    } for row in rows]
+
 
 @app.route('/api/device_commands/<serial_number>', methods=['GET'])
+@device_auth
 def get_device_commands(serial_number):
-    commands = DeviceCommand.query.filter_by(serial_number=serial_number, status='pending').all()
-    result = []
-    for cmd in commands:
-        result.append({
-            'id': cmd.id,
-            'type': cmd.command_type,
-            'data': json.loads(cmd.command_data or '{}'),
-            'created_at': cmd.created_at.isoformat()
-        })
-        cmd.status = 'sent'
+    """Claim this device's deliverable commands; unacknowledged ones are redelivered after a timeout."""
+    return jsonify(serialize_commands(command_queue.claim(serial_number)))
+
+
+@app.route('/api/device_commands/<serial_number>/wait', methods=['GET'])
+@device_auth
+def wait_device_commands(serial_number):
+    """
+    Long-poll variant of get_device_commands: holds the request until a
+    command is queued for the device or `timeout` seconds (max 30) pass.
+    """
+    timeout = parse_float(request.args.get('timeout'))
+    timeout = min(max(timeout if timeout is not None else 25, 0.0), LONGPOLL_MAX_SECONDS)
+    deadline = time.monotonic() + timeout
+    # Subscribe before the first claim so a command sent in between is not missed
+    with command_notifier.subscribe(serial_number) as woken:
+        while True:
+            rows = command_queue.claim(serial_number)
+            remaining = deadline - time.monotonic()
+            if rows or remaining <= 0:
+                return jsonify(serialize_commands(rows))
+            woken.wait(min(remaining, command_notifier.recheck_interval()))
+            woken.clear()
+
+
+# ===================== GROUPS & BULK COMMANDS =====================
+from sqlalchemy import delete, func, select
+from command_notify import BROADCAST
+
+BULK_FILTER_FIELDS = ('device_type', 'current_status', 'presence', 'make', 'model')
+
+
+def _owned_device_ids(serial_numbers):
+    return select(Device.id).where(Device.user_id == current_user.id,
+                                   Device.serial_number.in_(serial_numbers))
+
+
+def _add_group_members(group_id, serial_numbers):
+    if not serial_numbers:
+        return
+    existing = select(DeviceGroupMember.device_id).where(DeviceGroupMember.group_id == group_id)
+    db.session.execute(insert(DeviceGroupMember).from_select(
+        ['group_id', 'device_id'],
+        select(db.literal(group_id), Device.id).where(
+            Device.id.in_(_owned_device_ids(serial_numbers)), Device.id.not_in(existing))))
+
+
+@app.route('/api/groups', methods=['GET', 'POST'])
+@login_required
+def device_groups():
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        name = (data.get('name') or '').strip()
+        if not name:
+            return jsonify({'error': 'name is required'}), 400
+        if DeviceGroup.query.filter_by(user_id=current_user.id, name=name).first():
+            return jsonify({'error': 'Group already exists'}), 409
+        group = DeviceGroup(name=name, user_id=current_user.id)
+        db.session.add(group)
+        db.session.flush()
+        _add_group_members(group.id, data.get('serial_numbers') or [])
+        db.session.commit()
+        return jsonify({'id': group.id, 'name': group.name}), 201
+
+    rows = (db.session.query(DeviceGroup.id, DeviceGroup.name, func.count(DeviceGroupMember.device_id))
+            .outerjoin(DeviceGroupMember, DeviceGroupMember.group_id == DeviceGroup.id)
+            .filter(DeviceGroup.user_id == current_user.id)
+            .group_by(DeviceGroup.id, DeviceGroup.name)
+            .all())
+    return jsonify([{'id': gid, 'name': name, 'members': members} for gid, name, members in rows])
+
+
+@app.route('/api/groups/<int:group_id>', methods=['PATCH', 'DELETE'])
+@login_required
+def device_group(group_id):
+    group = DeviceGroup.query.filter_by(id=group_id, user_id=current_user.id).first()
+    if not group:
+        return jsonify({'error': 'Group not found'}), 404
+    if request.method == 'DELETE':
+        db.session.execute(delete(DeviceGroupMember).where(DeviceGroupMember.group_id == group.id))
+        db.session.delete(group)
+        db.session.commit()
+        return jsonify({'message': 'Group deleted'})
+
+    data = request.get_json() or {}
+    _add_group_members(group.id, data.get('add') or [])
+    if data.get('remove'):
+        db.session.execute(delete(DeviceGroupMember).where(
+            DeviceGroupMember.group_id == group.id,
+            DeviceGroupMember.device_id.in_(_owned_device_ids(data['remove']))))
+    db.session.commit()
+    members = db.session.query(func.count()).filter(DeviceGroupMember.group_id == group.id).scalar()
+    return jsonify({'id': group.id, 'name': group.name, 'members': members})
+
+
+@app.route('/api/bulk_command', methods=['POST'])
+@login_required
+def bulk_command():
+    """
+    Send one command to every device in a group and/or matching a filter:
+    {"command_type", "command_data", "group_id", "filter": {"device_type", "current_status",
+    "presence", "make", "model", "serial_prefix"}, "ttl_seconds"}.
+    All command rows are written with a single INSERT ... SELECT.
+    """
+    data = request.get_json() or {}
+    if not data.get('command_type'):
+        return jsonify({'error': 'command_type is required'}), 400
+    filters = data.get('filter') or {}
+    group_id = data.get('group_id')
+    if not isinstance(filters, dict):
+        return jsonify({'error': 'filter must be an object'}), 400
+    unknown = sorted(set(filters) - set(BULK_FILTER_FIELDS) - {'serial_prefix'})
+    if unknown:
+        return jsonify({'error': f"Unknown filter fields: {', '.join(unknown)}"}), 400
+    # A predicate that is silently skipped would widen a lock or wipe to more devices
+    empty = sorted(field for field, value in filters.items() if not isinstance(value, str) or not value)
+    if empty:
+        return jsonify({'error': f"Filter values must be non-empty strings: {', '.join(empty)}"}), 400
+    if not group_id and not filters:
+        return jsonify({'error': 'group_id or filter is required'}), 400
+
+    targets = select(Device.serial_number).where(Device.user_id == current_user.id)
+    if group_id:
+        if not DeviceGroup.query.filter_by(id=group_id, user_id=current_user.id).first():
+            return jsonify({'error': 'Group not found'}), 404
+        targets = targets.join(DeviceGroupMember, DeviceGroupMember.device_id == Device.id).where(
+            DeviceGroupMember.group_id == group_id)
+    for field in BULK_FILTER_FIELDS:
+        if field in filters:
+            targets = targets.where(getattr(Device, field) == filters[field])
+    if 'serial_prefix' in filters:
+        targets = targets.where(Device.serial_number.startswith(filters['serial_prefix'], autoescape=True))
+
+    job = CommandJob(user_id=current_user.id, command_type=data['command_type'],
+                     target=json.dumps({'group_id': group_id, 'filter': filters}))
+    db.session.add(job)
+    db.session.flush()
+    job.total = command_queue.enqueue_for_devices(
+        targets, data['command_type'], data.get('command_data'), user_id=current_user.id,
+        job_id=job.id, ttl=parse_float(data.get('ttl_seconds')))
+    job_id, total = job.id, job.total
+    command_notifier.publish(BROADCAST)
     db.session.commit()
-    return jsonify(result)
+    command_notifier.notify_local(BROADCAST)
+    return jsonify({'job_id': job_id, 'total': total}), 202
+
+
+@app.route('/api/command_jobs/<int:job_id>')
+@login_required
+def command_job_progress(job_id):
+    """Progress of a bulk command, aggregated from its commands' statuses."""
+    job = CommandJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    counts = dict(db.session.query(DeviceCommand.status, func.count())
+                  .filter(DeviceCommand.job_id == job.id)
+                  .group_by(DeviceCommand.status).all())
+    finished = sum(counts.get(status, 0) for status in ('executed', 'failed', 'expired'))
+    return jsonify({
+        'job_id': job.id,
+        'command_type': job.command_type,
+        'total': job.total,
+        'counts': counts,
+        'finished': finished,
+        'progress': round(finished / job.total, 4) if job.total else 1.0,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+    })
+
+
 @app.route('/lost_device', methods=['GET', 'POST'])
 def lost_device():
     if request.method == 'POST':
@@ -552,6 +1559,7 @@ def pricing():
 
 @app.route("/device_map/<serial_number>")
 @login_required
+@read_replica
 def device_map(serial_number):
     device = Device.query.filter_by(serial_number=serial_number, user_id=current_user.id).first()
     if not device:
@@ -560,16 +1568,76 @@ def device_map(serial_number):
     return render_template("device_map.html", device=device)
 
 
+ACK_STATUSES = ('executed', 'failed')
+MAX_ACK_BATCH = 500
+
+
 @app.route('/api/command_ack', methods=['POST'])
+@device_auth
 def command_ack():
     data = request.get_json()
-    cmd = DeviceCommand.query.get(data.get('command_id'))
-    if not cmd:
-        return jsonify({'error': 'Command not found'}), 404
-    cmd.status = data.get('status', 'executed')
-    cmd.executed_at = datetime.now(timezone.utc)
-    db.session.commit()
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        command_id = int(data.get('command_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'command_id must be an integer'}), 400
+    status = data.get('status') or 'executed'
+    if status not in ACK_STATUSES:
+        return jsonify({'error': f"status must be one of {', '.join(ACK_STATUSES)}"}), 400
+    if not command_queue.ack(command_id, status, serial_number=g.device_serial):
+        command = db.session.get(DeviceCommand, command_id)
+        if not command or (g.device_serial and command.serial_number != g.device_serial):
+            return jsonify({'error': 'Command not found'}), 404
+        return jsonify({'message': 'Command already closed'})
     return jsonify({'message': 'Command acknowledged'})
+
+
+def apply_acks(items, serial_number=None, commit=True):
+    """
+    Acknowledge [{"command_id", "status", "executed_at"}, ...] in one update;
+    returns per-command results in request order.
+    """
+    if not isinstance(items, list):
+        return []
+    acks, results = [], []
+    for item in items[:MAX_ACK_BATCH]:
+        try:
+            command_id = int(item.get('command_id'))
+        except (AttributeError, TypeError, ValueError):
+            results.append({'command_id': item.get('command_id') if isinstance(item, dict) else None,
+                            'result': 'invalid'})
+            continue
+        status = item.get('status') or 'executed'
+        if status not in ACK_STATUSES:
+            results.append({'command_id': command_id, 'result': 'invalid'})
+            continue
+        executed_at = parse_timestamp(item.get('executed_at')).replace(tzinfo=None)
+        acks.append((command_id, status, executed_at))
+        results.append({'command_id': command_id, 'result': None})
+    outcome = command_queue.ack_many(acks, serial_number, commit=commit)
+    for result in results:
+        if result['result'] is None:
+            result['result'] = outcome[result['command_id']]
+    return results
+
+
+@app.route('/api/command_acks', methods=['POST'])
+@device_auth
+def command_acks():
+    """
+    Batched acknowledgements: {"serial_number", "acks": [{"command_id", "status", "executed_at"}, ...]}.
+    When serial_number is given only that device's commands are acknowledged.
+    """
+    data = request.get_json() or {}
+    items = data.get('acks') or []
+    if not isinstance(items, list):
+        return jsonify({'error': 'acks must be a list'}), 400
+    if len(items) > MAX_ACK_BATCH:
+        return jsonify({'error': f'At most {MAX_ACK_BATCH} acks per request'}), 400
+    return jsonify({'results': apply_acks(items, g.device_serial or data.get('serial_number'))})
+
+
 @app.route("/diagnostics")
 def diagnostics():
     info = {}
@@ -581,7 +1649,8 @@ def diagnostics():
     try:
         from sqlalchemy import text
         with db.engine.connect() as conn:
-            result = conn.execute(text("SELECT NOW()")).scalar()
+            # CURRENT_TIMESTAMP works on both Postgres and SQLite (NOW() is Postgres only)
+            result = conn.execute(text("SELECT CURRENT_TIMESTAMP")).scalar()
         info["database_connection"] = "OK"
         info["current_time_in_db"] = str(result)
     except Exception as e:
@@ -589,6 +1658,293 @@ def diagnostics():
 
     return jsonify(info)
 
+# ===================== METRICS =====================
+from metrics import Metrics
+
+metrics = Metrics()
+metrics.histogram("tracking_http_request_duration_seconds", "Request latency by endpoint, method and status.")
+metrics.counter("tracking_ingested_points_total", "Location points received, by outcome.")
+metrics.histogram("tracking_db_pool_checkout_seconds", "Time spent waiting for a pooled DB connection.")
+metrics.gauge("tracking_db_pool_connections", "Pooled DB connections by bind and state.")
+metrics.gauge("tracking_command_queue_depth", "Open (pending or sent) device commands.")
+metrics.counter("tracking_cache_requests_total", "Cache lookups by cache and result.")
+metrics.gauge("tracking_enrichment_queue_depth", "Items waiting per enrichment stage.")
+metrics.counter("tracking_enrichment_dropped_total", "Items dropped per enrichment stage.")
+metrics.counter("tracking_presence_transitions_total", "Presence events by kind.")
+metrics.counter("tracking_rate_limit_points_total", "Rate-limited ingestion decisions by scope, plan and outcome.")
+metrics.gauge("tracking_admission_in_flight", "Admitted requests in flight per route class.")
+metrics.counter("tracking_admission_shed_total", "Requests shed per route class.")
+metrics.gauge("tracking_db_replica_lag_seconds", "Replication lag of the read replica at the last check.")
+metrics.counter("tracking_db_read_requests_total", "Read-only requests by the database that served them.")
+metrics.gauge("tracking_sqlite_write_queue_depth", "Write jobs waiting for the SQLite edge writer.")
+metrics.counter("tracking_sqlite_write_batches_total", "Transactions committed by the SQLite edge writer.")
+metrics.counter("tracking_sqlite_write_jobs_total", "Write jobs committed by the SQLite edge writer.")
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+_instrumented_pools = {}
+
+
+def _instrument_pool():
+    """Time pool checkouts on every bound engine by wrapping its pool's connect (re-applied if a pool is recreated)."""
+    for bind, engine in bound_engines(db).items():
+        pool = engine.pool
+        if _instrumented_pools.get(bind) is pool:
+            continue
+        connect = pool.connect
+
+        def timed_connect(connect=connect, labels=(("bind", bind),)):
+            started = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                metrics.observe("tracking_db_pool_checkout_seconds", time.perf_counter() - started, labels=labels)
+
+        pool.connect = timed_connect
+        _instrumented_pools[bind] = pool
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    _instrument_pool()
+    if METRICS_DIR:
+        metrics.start_flusher(METRICS_DIR, float(os.environ.get("METRICS_FLUSH_SECONDS", 5)))
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        metrics.observe("tracking_http_request_duration_seconds", time.perf_counter() - started,
+                        (("endpoint", request.endpoint or "unmatched"), ("method", request.method),
+                         ("status", response.status_code)))
+    return response
+
+
+@metrics.collector
+def _collect_components():
+    yield "tracking_command_queue_depth", (), command_queue.depth()
+    for bind, engine in bound_engines(db).items():
+        for state, attr in (("checked_out", "checkedout"), ("idle", "checkedin"), ("overflow", "overflow")):
+            if hasattr(engine.pool, attr):
+                yield ("tracking_db_pool_connections", (("bind", bind), ("state", state)),
+                       getattr(engine.pool, attr)())
+    for name, stage in enrichment_pipeline.stats().items():
+        yield "tracking_enrichment_queue_depth", (("stage", name),), stage["queue_depth"]
+    for name, route_class in admission.stats()["classes"].items():
+        yield "tracking_admission_in_flight", (("class", name),), route_class["in_flight"]
+    if replica_monitor is not None and replica_monitor.lag is not None:
+        yield "tracking_db_replica_lag_seconds", (), replica_monitor.lag
+    if edge_writer is not None:
+        yield "tracking_sqlite_write_queue_depth", (), edge_writer.stats()["queued"]
+
+
+@metrics.counter_collector
+def _count_components():
+    # Per-worker running totals; written to METRICS_DIR with the worker's own counters
+    user_stats = user_cache.stats()
+    yield "tracking_cache_requests_total", (("cache", "user"), ("result", "hit")), user_stats["hits"]
+    yield "tracking_cache_requests_total", (("cache", "user"), ("result", "miss")), user_stats["misses"]
+    if place_geocoder is not None:
+        info = place_geocoder.cache_info()
+        yield "tracking_cache_requests_total", (("cache", "geocoder"), ("result", "hit")), info.hits
+        yield "tracking_cache_requests_total", (("cache", "geocoder"), ("result", "miss")), info.misses
+    yield "tracking_cache_requests_total", (("cache", "stale_reads"), ("result", "hit")), stale_reads.served
+    if position_store is not None:
+        yield "tracking_cache_requests_total", (("cache", "positions"), ("result", "hit")), position_store.hits
+        yield "tracking_cache_requests_total", (("cache", "positions"), ("result", "miss")), position_store.fallbacks
+    for name, stage in enrichment_pipeline.stats().items():
+        yield "tracking_enrichment_dropped_total", (("stage", name),), stage["dropped"]
+    for event, count in presence_tracker.transitions.items():
+        yield "tracking_presence_transitions_total", (("event", event),), count
+    for key, count in ingest_limiter.stats()["counters"].items():
+        scope, plan, outcome = key.split(".")
+        yield "tracking_rate_limit_points_total", (("scope", scope), ("plan", plan), ("outcome", outcome)), count
+    for name, route_class in admission.stats()["classes"].items():
+        yield "tracking_admission_shed_total", (("class", name),), route_class["shed"]
+    if edge_writer is not None:
+        writer = edge_writer.stats()
+        yield "tracking_sqlite_write_batches_total", (), writer["batches"]
+        yield "tracking_sqlite_write_jobs_total", (), writer["jobs"]
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition; requires METRICS_TOKEN as a bearer token when it is set."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(METRICS_DIR), mimetype="text/plain; version=0.0.4")
+
+
+# ===================== QUERY PROFILING =====================
+from query_profiler import QueryProfiler
+
+QUERY_PROFILING = os.environ.get("QUERY_PROFILING", "1") != "0"
+# The breakdown exposes SQL, so the request header only works when explicitly allowed
+QUERY_DEBUG_HEADER = app.debug or os.environ.get("QUERY_DEBUG_HEADER") == "1"
+
+query_profiler = QueryProfiler()
+metrics.histogram("tracking_db_queries_per_request", "SQL statements executed per request.",
+                  buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200))
+metrics.histogram("tracking_db_time_per_request_seconds", "Time spent in SQL per request.")
+metrics.counter("tracking_db_n_plus_one_total", "Requests that repeated a statement N_PLUS_ONE_THRESHOLD times.")
+
+
+@app.before_request
+def start_query_profile():
+    if QUERY_PROFILING:
+        for engine in bound_engines(db).values():
+            query_profiler.attach(engine)
+        g.query_profile_token = query_profiler.start()
+
+
+@app.after_request
+def add_query_debug_headers(response):
+    profile = query_profiler.current()
+    if profile is not None and QUERY_DEBUG_HEADER and request.headers.get("X-Debug-Queries"):
+        response.headers["X-Query-Count"] = str(profile.count)
+        response.headers["X-Query-Time-Ms"] = f"{profile.total_time * 1000:.3f}"
+        response.headers["Server-Timing"] = f'db;dur={profile.total_time * 1000:.3f};desc="{profile.count} queries"'
+        response.headers["X-Query-Breakdown"] = json.dumps(profile.breakdown())
+    return response
+
+
+@app.teardown_request
+def finish_query_profile(exc):
+    token = g.pop("query_profile_token", None)
+    if token is None:
+        return
+    profile = query_profiler.stop(token)
+    endpoint = request.endpoint or "unmatched"
+    metrics.observe("tracking_db_queries_per_request", profile.count, (("endpoint", endpoint),))
+    metrics.observe("tracking_db_time_per_request_seconds", profile.total_time, (("endpoint", endpoint),))
+    repeated = profile.repeated(query_profiler.n_plus_one_threshold)
+    if repeated:
+        metrics.inc("tracking_db_n_plus_one_total", labels=(("endpoint", endpoint),))
+        sql, count, seconds = repeated[0]
+        app.logger.warning("Possible N+1 in %s: statement ran %d times (%.1f ms): %s",
+                           endpoint, count, seconds * 1000, " ".join(sql.split())[:300])
+
+
+# ===================== TRAFFIC CAPTURE =====================
+import traffic_trace
+
+trace_recorder = traffic_trace.recorder_from_env()
+TRACED_ENDPOINTS = {"api_report_location", "api_report_locations", "get_device_commands",
+                    "wait_device_commands", "command_ack", "command_acks"}
+
+
+@app.before_request
+def capture_trace():
+    # Registered before admission control so shed requests are captured too
+    if trace_recorder is None or request.endpoint not in TRACED_ENDPOINTS:
+        return
+    body = request.get_json(silent=True)
+    # Any JSON value can arrive here; malformed bodies are the view's to reject
+    fields = body if isinstance(body, dict) else {}
+    path_serial = (request.view_args or {}).get("serial_number")
+    serial_number = path_serial or fields.get("serial_number")
+    points = fields.get("points")
+    if not serial_number and isinstance(points, list) and points and isinstance(points[0], dict):
+        serial_number = points[0].get("serial_number")
+    trace_recorder.record(request.method, request.path, serial_number, body, path_serial=path_serial)
+
+
+# ===================== ADMISSION CONTROL =====================
+from admission import AdmissionController, RouteClass, StaleCache
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_CONTROL", "1") != "0"
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", 2))
+
+ROUTE_CLASSES = {
+    "api_report_location": "ingest",
+    "api_report_locations": "ingest",
+    "command_ack": "ingest",
+    "command_acks": "ingest",
+    "get_device_commands": "commands",
+    "send_command": "commands",
+    "bulk_command": "commands",
+    "wait_device_commands": "longpoll",
+    "live_locations": "reads",
+    "all_devices": "reads",
+    "api_devices": "reads",
+    "get_device_location_api": "reads",
+    "api_daily_analytics": "reads",
+    "command_job_progress": "reads",
+}
+
+admission = AdmissionController([
+    RouteClass("ingest", shed_at=1.0, latency_target=0.25, critical=True),
+    RouteClass("commands", shed_at=0.8, latency_target=0.25),
+    RouteClass("longpoll", shed_at=0.9, max_share=0.25, latency_target=None),
+    RouteClass("reads", shed_at=0.6, latency_target=0.5),
+], capacity=int(os.environ.get("ADMISSION_CAPACITY", 32)),
+    latency_gate=float(os.environ.get("ADMISSION_LATENCY_GATE", 0.25)))
+stale_reads = StaleCache(max_age=float(os.environ.get("ADMISSION_STALE_SECONDS", 60)))
+
+
+def _stale_key():
+    return request.full_path, current_user.get_id() if current_user.is_authenticated else None
+
+
+@app.before_request
+def admit_request():
+    name = ROUTE_CLASSES.get(request.endpoint) if ADMISSION_ENABLED else None
+    if name is None:
+        return None
+    if admission.try_admit(name):
+        g.admission = (name, time.monotonic())
+        return None
+    if name == "reads":
+        stale = stale_reads.get(_stale_key())
+        if stale is not None:
+            age, body, mimetype = stale
+            return Response(body, mimetype=mimetype, headers={"X-Stale-Age": str(int(age))})
+    response = jsonify({"error": "Server busy, retry later"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(ADMISSION_RETRY_AFTER)
+    return response
+
+
+def _remember_streamed(key, body, mimetype):
+    """Pass a streamed body through, keeping a copy for stale_reads once it has been sent in full."""
+    parts = []
+    try:
+        for part in body:
+            parts.append(part)
+            yield part
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    stale_reads.put(key, b"".join(parts), mimetype)
+
+
+@app.after_request
+def remember_read(response):
+    admitted = g.get("admission")
+    if admitted and admitted[0] == "reads" and response.status_code == 200 and response.is_json:
+        if response.is_streamed:
+            # The fleet map polls stream; they need their stale copy most of all
+            response.response = _remember_streamed(_stale_key(), response.response, response.mimetype)
+        else:
+            stale_reads.put(_stale_key(), response.get_data(), response.mimetype)
+    return response
+
+
+@app.teardown_request
+def release_admission(exc):
+    admitted = g.pop("admission", None)
+    if admitted:
+        admission.release(admitted[0], time.monotonic() - admitted[1])
+
+
+@app.route('/api/admission_stats')
+def admission_stats():
+    """In-flight requests, latency and shed counts per route class in this worker."""
+    return jsonify(dict(admission.stats(), stale_served=stale_reads.served))
+
+
 # ===================== RUN =====================
 if __name__ == '__main__':
     with app.app_context():
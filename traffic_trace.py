@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Capture device traffic to a compact trace and replay it at accelerated speed.
+
+Capture (in the app): with TRACE_CAPTURE_PATH set, requests to the device
+endpoints are sanitized and appended by a background thread to
+<TRACE_CAPTURE_PATH>.<pid>.jsonl.gz, one short JSON record per request:
+
+    {"t": arrival epoch ms, "m": method, "p": path, "b": body}
+
+Sanitizing keeps the traffic's shape and drops identities:
+  * serials become stable pseudonyms (keyed hash with TRACE_SALT)
+  * coordinates are shifted by one constant offset derived from TRACE_SALT,
+    so clusters and distances are preserved but real places are not
+  * only known fields are kept; device tokens and headers are never written
+  * last_seen is stored as its offset from arrival ("ls_ms"), so replays
+    can restamp it and still reproduce late or duplicated uploads
+TRACE_SAMPLE keeps that fraction of devices (whole device streams, so
+reconnect bursts and retries stay intact). TRACE_SALT is required: every
+gunicorn worker must derive the same pseudonyms, offset and sample, or the
+merged per-worker files would split devices and shift them differently.
+
+Replay (command line):
+
+    python traffic_trace.py replay trace.*.jsonl.gz --url http://127.0.0.1:5000 --speed 10
+
+sends every record at (t - t0) / speed after start, preserving the
+inter-arrival distribution, and reports latency per endpoint plus how late
+requests were sent relative to the schedule.
+"""
+import argparse
+import asyncio
+import glob
+import gzip
+import hashlib
+import hmac
+import heapq
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+POINT_FIELDS = ("latitude", "longitude", "accuracy", "current_status")
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class Sanitizer:
+    def __init__(self, salt, offset=None):
+        self.salt = salt.encode("utf-8") if isinstance(salt, str) else salt
+        self.offset = offset if offset is not None else self._derived_offset()
+
+    def _derived_offset(self):
+        # The same salt gives the same shift in every worker and on every restart
+        digest = hmac.new(self.salt, b"offset", hashlib.sha256).digest()
+        unit = (int.from_bytes(digest[:8], "big") / 2 ** 64, int.from_bytes(digest[8:16], "big") / 2 ** 64)
+        return unit[0] * 40 - 20, unit[1] * 80 - 40
+
+    def serial(self, serial_number):
+        digest = hmac.new(self.salt, str(serial_number).encode("utf-8"), hashlib.sha256).hexdigest()
+        return f"TR-{digest[:12]}"
+
+    def keep(self, serial_number, fraction):
+        """Deterministic per-device sampling."""
+        if fraction >= 1:
+            return True
+        digest = hmac.new(self.salt, b"sample:" + str(serial_number).encode("utf-8"), hashlib.sha256).digest()
+        return int.from_bytes(digest[:4], "big") / 2 ** 32 < fraction
+
+    def point(self, point, arrived):
+        if not isinstance(point, dict):
+            return {}
+        clean = {key: point[key] for key in POINT_FIELDS if key in point}
+        if point.get("serial_number"):
+            clean["serial_number"] = self.serial(point["serial_number"])
+        for key, shift in (("latitude", self.offset[0]), ("longitude", self.offset[1])):
+            try:
+                clean[key] = round(float(clean[key]) + shift, 6)
+            except (KeyError, TypeError, ValueError):
+                pass
+        if "latitude" in clean:
+            clean["latitude"] = max(-90.0, min(90.0, clean["latitude"]))
+        if "longitude" in clean:
+            clean["longitude"] = (clean["longitude"] + 180) % 360 - 180
+        last_seen = _parse_time(point.get("last_seen"))
+        if last_seen is not None:
+            clean["ls_ms"] = int((last_seen - arrived).total_seconds() * 1000)
+        return clean
+
+    def acks(self, acks):
+        if not isinstance(acks, list):
+            return []
+        return [{"command_id": ack.get("command_id"), "status": ack.get("status")}
+                for ack in acks if isinstance(ack, dict)]
+
+    def body(self, body, arrived):
+        if not isinstance(body, dict):
+            return None
+        clean = self.point(body, arrived)
+        if isinstance(body.get("points"), list):
+            clean["points"] = [self.point(point, arrived) for point in body["points"]]
+        if body.get("acks"):
+            clean["acks"] = self.acks(body["acks"])
+        if body.get("command_id") is not None:
+            clean["command_id"] = body["command_id"]
+            clean["status"] = body.get("status")
+        return clean
+
+
+class TraceRecorder:
+    """Sanitize and queue requests on the request path; a daemon thread writes them."""
+
+    def __init__(self, base_path, sanitizer, sample=1.0, maxsize=100000):
+        self.base_path = base_path
+        self.sanitizer = sanitizer
+        self.sample = sample
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.written = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def record(self, method, path, serial_number, body, path_serial=None):
+        if serial_number and not self.sanitizer.keep(serial_number, self.sample):
+            return
+        self._ensure_writer()
+        arrived = datetime.now(timezone.utc)
+        if path_serial:
+            path = path.replace(path_serial, self.sanitizer.serial(path_serial), 1)
+        entry = {"t": int(arrived.timestamp() * 1000), "m": method, "p": path}
+        clean = self.sanitizer.body(body, arrived)
+        if clean:
+            entry["b"] = clean
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_writer(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._write_loop, args=(f"{self.base_path}.{os.getpid()}.jsonl.gz",),
+                         name="trace-writer", daemon=True).start()
+
+    def _write_loop(self, path):
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            while True:
+                entry = self.queue.get()
+                batch = [entry]
+                while len(batch) < 1000:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                f.write("".join(json.dumps(item, separators=(",", ":")) + "\n" for item in batch))
+                # Sync flush so a trace is readable while capture is still running
+                f.flush()
+                self.written += len(batch)
+
+
+def recorder_from_env():
+    base_path = os.environ.get("TRACE_CAPTURE_PATH")
+    if not base_path:
+        return None
+    salt = os.environ.get("TRACE_SALT")
+    if not salt:
+        logger.error("TRACE_CAPTURE_PATH is set without TRACE_SALT; traffic capture is disabled")
+        return None
+    return TraceRecorder(base_path, Sanitizer(salt), sample=float(os.environ.get("TRACE_SAMPLE", 1.0)))
+
+
+# ===================== REPLAY =====================
+def _open_trace(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _lines(f):
+    try:
+        yield from f
+    except EOFError:
+        # Trace still being captured (or capture killed): no gzip end marker yet
+        return
+
+
+def _read_one(path):
+    with _open_trace(path) as f:
+        for line in _lines(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A capture killed mid-write can leave a torn last line
+                continue
+
+
+def read_trace(paths):
+    """Records from every file, merged in arrival order (each file is already ordered)."""
+    return heapq.merge(*(_read_one(path) for path in paths), key=lambda entry: entry["t"])
+
+
+def restamp(body, now):
+    """Turn stored last_seen offsets back into timestamps relative to `now`."""
+    if not body:
+        return body
+    body = dict(body)
+    for point in [body] + list(body.get("points") or []):
+        if "ls_ms" in point:
+            point["last_seen"] = (now + timedelta(milliseconds=point.pop("ls_ms"))).isoformat()
+    return body
+
+
+def serial_of(entry):
+    """Device a record belongs to: body serial, first point's serial or the command path's serial."""
+    body = entry.get("b") or {}
+    if body.get("serial_number"):
+        return body["serial_number"]
+    for point in body.get("points") or []:
+        if point.get("serial_number"):
+            return point["serial_number"]
+    parts = entry["p"].split("/")
+    if entry["p"].startswith("/api/device_commands/") and len(parts) > 3:
+        return parts[3]
+    return None
+
+
+def endpoint_name(method, path):
+    if path.startswith("/api/device_commands/"):
+        return "device_commands_wait" if path.endswith("/wait") else "device_commands"
+    return path.rsplit("/", 1)[-1] or path
+
+
+async def replay(args):
+    import aiohttp
+    from load_generator import EndpointStats, Stats
+
+    paths = sorted({path for pattern in args.traces for path in glob.glob(pattern)})
+    if not paths:
+        raise SystemExit("No trace files matched")
+    stats = Stats()
+    lag = EndpointStats()
+    headers = {}
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        if args.register:
+            serials = {point.get("serial_number") for entry in read_trace(paths)
+                       for point in [entry.get("b") or {}] + list((entry.get("b") or {}).get("points") or [])
+                       if point.get("serial_number")}
+            headers = await register_all(session, args, serials)
+
+        async def send(entry, scheduled):
+            lag.record(max(0.0, time.monotonic() - scheduled), 200)
+            body = restamp(entry.get("b"), datetime.now(timezone.utc))
+            serial = serial_of(entry)
+            name = endpoint_name(entry["m"], entry["p"])
+            started = time.perf_counter()
+            try:
+                async with session.request(entry["m"], args.url + entry["p"], json=body,
+                                           headers=headers.get(serial, {})) as response:
+                    await response.read()
+                    stats.endpoint(name).record(time.perf_counter() - started, response.status)
+            except asyncio.TimeoutError:
+                stats.endpoint(name).record(time.perf_counter() - started, error="timeout")
+            except aiohttp.ClientError as exc:
+                stats.endpoint(name).record(time.perf_counter() - started, error=type(exc).__name__)
+            if body:
+                stats.points += len(body.get("points") or []) or int("latitude" in body)
+
+        tasks = set()
+        start = time.monotonic()
+        stats.started = start
+        t0 = None
+        for entry in read_trace(paths):
+            t0 = entry["t"] if t0 is None else t0
+            offset = (entry["t"] - t0) / 1000 / args.speed
+            if args.limit and offset > args.limit:
+                break
+            scheduled = start + offset
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(send(entry, scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    summary = stats.summary()
+    summary["schedule_lag_ms"] = lag.summary(1)["latency_ms"]
+    summary["speed"] = args.speed
+    return summary
+
+
+async def register_all(session, args, serials):
+    """Register each pseudonymous serial on the test server; returns {serial: auth headers}."""
+    headers = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def register(serial):
+        async with semaphore:
+            async with session.post(args.url + "/api/register_device", json={
+                    "serial_number": serial, "name": serial, "make": "Replay", "model": "Trace",
+                    "device_type": "Replay", "current_status": "active", "current_location": "Replay",
+                    "email": args.email, "password": args.password}) as response:
+                if response.status == 200:
+                    token = (await response.json()).get("device_token")
+                    if token:
+                        headers[serial] = {"Authorization": f"Bearer {token}"}
+
+    await asyncio.gather(*(register(serial) for serial in serials))
+    return headers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured device traffic.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay_parser = sub.add_parser("replay", help="send a trace against a server")
+    replay_parser.add_argument("traces", nargs="+", help="trace files or glob patterns")
+    replay_parser.add_argument("--url", default="http://127.0.0.1:5000")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="time compression, 1-100x")
+    replay_parser.add_argument("--limit", type=float, default=0, help="stop after this many replay seconds")
+    replay_parser.add_argument("--register", action="store_true", help="register trace serials first")
+    replay_parser.add_argument("--email")
+    replay_parser.add_argument("--password")
+    replay_parser.add_argument("--concurrency", type=int, default=500)
+    replay_parser.add_argument("--timeout", type=float, default=30)
+    replay_parser.add_argument("--json", help="write the summary to this file")
+    args = parser.parse_args(argv)
+    args.url = args.url.rstrip("/")
+    if not 0 < args.speed <= 100:
+        parser.error("--speed must be between 0 and 100")
+    if args.register and not (args.email and args.password):
+        parser.error("--register needs --email and --password")
+
+    from load_generator import print_summary
+    summary = asyncio.run(replay(args))
+    print_summary(summary)
+    print(f"schedule lag: {summary['schedule_lag_ms']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
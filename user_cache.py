@@ -0,0 +1,82 @@
+"""
+Short-lived cache of logged-in users for Flask-Login's user_loader.
+
+Every authenticated request (including the map's 5 second polls) used to
+load the User row. The loader now returns a UserSnapshot, a plain read-only
+copy of the fields requests need, cached per process for USER_CACHE_TTL_SECONDS.
+Changes made in this process (plan upgrades) call invalidate(); other
+gunicorn workers pick them up when their entry expires.
+"""
+import os
+import threading
+import time
+
+from flask_login import UserMixin
+
+
+class UserSnapshot(UserMixin):
+    """Detached, immutable view of a User; safe to share between requests and threads."""
+
+    __slots__ = ("id", "username", "email", "plan")
+
+    def __init__(self, id, username, email, plan):
+        object.__setattr__(self, "id", id)
+        object.__setattr__(self, "username", username)
+        object.__setattr__(self, "email", email)
+        object.__setattr__(self, "plan", plan)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSnapshot is read-only; update the User row and invalidate the cache")
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.plan or "free")
+
+
+class UserCache:
+    """TTL cache of UserSnapshots; `load(user_id)` returns a User or None on a miss."""
+
+    def __init__(self, load, ttl=None, maxsize=10000):
+        self.load = load
+        self.ttl = ttl if ttl is not None else float(os.environ.get("USER_CACHE_TTL_SECONDS", 30))
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        user = self.load(user_id)
+        if user is None:
+            self.invalidate(user_id)
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        with self._lock:
+            if len(self._entries) >= self.maxsize:
+                self._evict(now)
+            self._entries[user_id] = (now + self.ttl, snapshot)
+        return snapshot
+
+    def _evict(self, now):
+        expired = [key for key, (expires, _) in self._entries.items() if expires <= now]
+        for key in expired or list(self._entries)[:len(self._entries) // 10 + 1]:
+            del self._entries[key]
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}